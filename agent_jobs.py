@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+# 同时运行的智能体任务数（工作线程数）
+AGENT_WORKERS = int(os.environ.get('AGENT_WORKERS', 8))
+
+# 排队等待的任务数上限，超出后拒绝新任务
+AGENT_MAX_QUEUE = int(os.environ.get('AGENT_MAX_QUEUE', 64))
+
+# 每个会话同时处理的任务数上限，已取消的任务不计入
+AGENT_JOBS_PER_SESSION = int(os.environ.get('AGENT_JOBS_PER_SESSION', 1))
+
+
+class AgentJob:
+    """一个智能体任务，过程事件记录在任务上，页面重新运行后可以继续显示"""
+
+    def __init__(self, session_id):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        # 已产生的过程事件 (类型, 内容)，不含最终结果
+        self.events = []
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def cancel(self):
+        """取消任务：排队中的直接取消，运行中的在下一次调用模型或工具前停止，停止前仍处于运行状态"""
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self.status = 'cancelled'
+            self._finished.set()
+
+    def wait(self, timeout=None):
+        """
+        等待任务结束
+        :return: 任务是否已结束
+        """
+        return self._finished.wait(timeout)
+
+
+class AgentJobPool:
+    """
+    有界的智能体任务池
+    智能体在工作线程中运行，不占用Streamlit脚本线程；同一会话提交新问题时取消未完成的旧问题
+    被取消的任务在下一次调用模型或工具前才停止，新任务不等待它，直接排在它后面；
+    停止前它仍占用工作线程，总并发数始终受工作线程数限制
+    """
+
+    def __init__(self, max_workers=AGENT_WORKERS, max_queue=AGENT_MAX_QUEUE,
+                 jobs_per_session=AGENT_JOBS_PER_SESSION):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.jobs_per_session = jobs_per_session
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='agent')
+        self._jobs = {}
+        self._counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, run, cancel_previous=True):
+        """
+        提交任务
+        :param session_id: 会话ID
+        :param run: 以cancel=取消事件调用、返回事件生成器的函数，如 partial(dataframe_agent, ..., stream=True)
+        :param cancel_previous: 是否取消该会话中未完成的任务
+        :return: AgentJob
+        """
+        with self._lock:
+            unfinished = [job for job in self._jobs.get(session_id, []) if not job.done()]
+            if cancel_previous:
+                for job in unfinished:
+                    if not job.cancelled:
+                        job.cancel()
+                unfinished = [job for job in unfinished if not job.done()]
+            active = [job for job in unfinished if not job.cancelled]
+            if len(active) >= self.jobs_per_session:
+                raise RuntimeError("当前会话正在处理的问题过多，请稍后再试")
+            if self._count('queued') >= self.max_queue:
+                raise RuntimeError("服务繁忙，请稍后再试")
+
+            job = AgentJob(session_id)
+            # 仍在运行的已取消任务保留在列表中，统计运行数时计入
+            self._jobs[session_id] = unfinished + [job]
+            job.future = self._executor.submit(self._run, job, run)
+            # 排队中被取消的任务不会运行，在这里计数；运行中取消的任务在结束时计数
+            job.future.add_done_callback(self._count_cancelled)
+            with self._counters_lock:
+                self._counters['submitted'] += 1
+            return job
+
+    def _count_cancelled(self, future):
+        if future.cancelled():
+            with self._counters_lock:
+                self._counters['cancelled'] += 1
+
+    def _run(self, job, run):
+        if job.cancelled:
+            job.status = 'cancelled'
+            with self._counters_lock:
+                self._counters['cancelled'] += 1
+            job._finished.set()
+            return
+        job.status = 'running'
+        job.started_at = time.monotonic()
+        try:
+            events = run(cancel=job._cancelled)
+            for kind, payload in events:
+                if job.cancelled:
+                    # 关闭生成器会等待智能体线程结束，之后工作线程才空闲
+                    events.close()
+                    break
+                if kind == 'result':
+                    job.result = payload
+                else:
+                    job.events.append((kind, payload))
+            job.status = 'cancelled' if job.cancelled else 'done'
+        except Exception as e:
+            job.error = e
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.monotonic()
+            with self._counters_lock:
+                self._counters[job.status] += 1
+            job._finished.set()
+
+    def _count(self, status):
+        return sum(job.status == status for jobs in self._jobs.values() for job in jobs)
+
+    def stats(self):
+        """任务池指标：工作线程数、排队数、运行数和累计的完成/失败/取消数"""
+        with self._lock:
+            # 顺便清理已结束的任务
+            for session_id in list(self._jobs):
+                self._jobs[session_id] = [job for job in self._jobs[session_id] if not job.done()]
+                if not self._jobs[session_id]:
+                    del self._jobs[session_id]
+            return {
+                'workers': self.max_workers,
+                'queued': self._count('queued'),
+                'running': self._count('running'),
+                'submitted': self._counters['submitted'],
+                'done': self._counters['done'],
+                'failed': self._counters['failed'],
+                'cancelled': self._counters['cancelled'],
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@st.cache_resource
+def get_agent_job_pool():
+    """获取全局共享的智能体任务池"""
+    return AgentJobPool()
@@ -0,0 +1,127 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# 相似度不低于该阈值时视为同一问题
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('ANSWER_CACHE_THRESHOLD', 0.95))
+
+# 缓存答案的有效期（秒）
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', 3600))
+
+# 缓存的答案数量上限
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000))
+
+# 向量相似的问题可能只差一个数字或方向（"前10名"和"前5名"、"最高"和"最低"），答案却完全不同，
+# 命中前还要求两个问题中的数字和方向、比较词一致
+_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?|(?<=[前后第])[零一二两三四五六七八九十]+'
+                             r'|[零一二两三四五六七八九十]+(?=[个名位条家项年月天人])')
+_POLARITY_WORDS = [
+    (r'不低于|不少于|不小于|至少', 'ge'),
+    (r'不高于|不多于|不大于|至多', 'le'),
+    (r'大于|高于|超过|多于', 'gt'),
+    (r'小于|低于|少于|不足', 'lt'),
+    (r'等于', 'eq'),
+    (r'最高|最大|最多|降序|从高到低|从大到小', 'max'),
+    (r'最低|最小|最少|升序|从低到高|从小到大', 'min'),
+    (r'不|非|没有|除', 'not'),
+]
+_POLARITY_PATTERN = re.compile('|'.join(f"(?P<{name}>{words})" for words, name in _POLARITY_WORDS))
+_CHINESE_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+
+def _parse_number(text):
+    """解析阿拉伯数字或"十""二十三"这类中文数字"""
+    if text[0].isdigit():
+        return float(text)
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return float(_CHINESE_DIGITS.get(tens, 1) * 10 + _CHINESE_DIGITS.get(ones, 0))
+    return float(''.join(str(_CHINESE_DIGITS[ch]) for ch in text))
+
+
+def _question_signature(question):
+    """问题中的数字和方向、比较词，两个问题的签名相同时才可能共用答案"""
+    numbers = sorted(_parse_number(match) for match in _NUMBER_PATTERN.findall(question))
+    polarity = sorted(match.lastgroup for match in _POLARITY_PATTERN.finditer(question))
+    return tuple(numbers), tuple(polarity)
+
+
+class AnswerCache:
+    """
+    语义答案缓存：以 (数据版本, 问题向量) 为键缓存智能体解析后的JSON结果
+    同一数据版本下与已有问题的余弦相似度达到阈值、且数字和方向词一致即命中，按TTL过期、按LRU淘汰
+    :param embedder: 提供embed_query(text)方法的向量模型，如OpenAIEmbeddings
+    """
+
+    def __init__(self, embedder, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # 条目id -> (数据版本, 单位化向量, 问题, 结果, 写入时间, 问题签名)
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def embed(self, question):
+        """计算单位化的问题向量"""
+        vector = np.asarray(self.embedder.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        for entry_id in [i for i, e in self._entries.items() if now - e[4] > self.ttl]:
+            del self._entries[entry_id]
+
+    def lookup(self, version, question, embedding=None):
+        """
+        查找相似问题的缓存结果
+        :return: (结果或None, 问题向量)，向量可传给store避免重复计算
+        """
+        if embedding is None:
+            embedding = self.embed(question)
+        with self._lock:
+            self._expire(self.clock())
+            signature = _question_signature(question)
+            candidates = [(i, e) for i, e in self._entries.items() if e[0] == version and e[5] == signature]
+            if not candidates:
+                return None, embedding
+            matrix = np.stack([e[1] for _, e in candidates])
+            scores = matrix @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None, embedding
+            entry_id, entry = candidates[best]
+            self._entries.move_to_end(entry_id)
+            return entry[3], embedding
+
+    def store(self, version, question, result, embedding=None):
+        """写入缓存"""
+        if embedding is None:
+            embedding = self.embed(question)
+        with self._lock:
+            self._entries[self._next_id] = (version, embedding, question, result, self.clock(),
+                                            _question_signature(question))
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, version):
+        """移除某个数据版本的全部缓存，包括该版本搭配工作区的缓存（键为 版本|工作区指纹）"""
+        with self._lock:
+            for entry_id in [i for i, e in self._entries.items()
+                             if e[0] == version or e[0].startswith(f"{version}|")]:
+                del self._entries[entry_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,249 @@
+import ast
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field, ValidationError, model_validator
+
+# 结果中可能出现的键，与PROMPT_PREFIX中的格式一致
+ANSWER_KEYS = ('answer', 'table', 'bar', 'line', 'pie', 'scatter', 'heatmap', 'boxplot')
+
+
+class TableData(BaseModel):
+    """表格"""
+    columns: List[str]
+    data: List[List[Any]]
+
+    @model_validator(mode='after')
+    def _check_rows(self):
+        if any(len(row) != len(self.columns) for row in self.data):
+            raise ValueError("表格每行的值个数必须与列数一致")
+        return self
+
+
+class XYChart(BaseModel):
+    """柱状图、折线图、散点图"""
+    x: List[Any]
+    y: List[Any] = Field(description="数值列表；分组时为每组一个数值列表")
+    groups: Optional[List[str]] = None
+    title: Optional[str] = None
+    x_label: Optional[str] = None
+    y_label: Optional[str] = None
+
+
+class PieChart(BaseModel):
+    """饼图"""
+    labels: List[Any]
+    values: List[float]
+    title: Optional[str] = None
+
+    @model_validator(mode='after')
+    def _check_lengths(self):
+        if len(self.labels) != len(self.values):
+            raise ValueError("饼图的labels和values长度必须一致")
+        return self
+
+
+class HeatmapChart(BaseModel):
+    """热力图"""
+    data: List[List[float]]
+    x_labels: Optional[List[Any]] = None
+    y_labels: Optional[List[Any]] = None
+    title: Optional[str] = None
+
+    @model_validator(mode='after')
+    def _check_shape(self):
+        widths = {len(row) for row in self.data}
+        if len(widths) > 1:
+            raise ValueError("热力图每行的值个数必须一致")
+        if self.x_labels is not None and widths and len(self.x_labels) != widths.pop():
+            raise ValueError("热力图的x_labels长度必须与列数一致")
+        if self.y_labels is not None and len(self.y_labels) != len(self.data):
+            raise ValueError("热力图的y_labels长度必须与行数一致")
+        return self
+
+
+class BoxPlotChart(BaseModel):
+    """箱线图，data和groups二选一"""
+    data: Optional[List[float]] = None
+    groups: Optional[Dict[str, List[float]]] = None
+    title: Optional[str] = None
+    x_label: Optional[str] = None
+    y_label: Optional[str] = None
+
+    @model_validator(mode='after')
+    def _check_data(self):
+        if self.data is None and self.groups is None:
+            raise ValueError("箱线图需要data或groups")
+        return self
+
+
+def _check_series(x, y, name):
+    """单组数据：y是与x等长的数值列表"""
+    if len(y) != len(x) or any(isinstance(v, list) for v in y):
+        raise ValueError(f"{name}的x和y长度必须一致")
+
+
+class AgentAnswer(BaseModel):
+    """智能体的最终回答，只填写与用户请求对应的一项"""
+    answer: Optional[str] = Field(default=None, description="不超过50个字符的纯文字回答")
+    table: Optional[TableData] = None
+    bar: Optional[XYChart] = None
+    line: Optional[XYChart] = None
+    pie: Optional[PieChart] = None
+    scatter: Optional[XYChart] = None
+    heatmap: Optional[HeatmapChart] = None
+    boxplot: Optional[BoxPlotChart] = None
+
+    @model_validator(mode='after')
+    def _check_xy_charts(self):
+        """x/y图表的数据形状，与build_chart_figure的用法一致"""
+        for name in ('bar', 'line'):
+            chart = getattr(self, name)
+            if chart is None:
+                continue
+            if chart.groups is None:
+                _check_series(chart.x, chart.y, name)
+            else:
+                # 分组时y为每组一个与x等长的数值列表
+                if len(chart.y) != len(chart.groups):
+                    raise ValueError(f"{name}的y必须为每组一个列表")
+                for y in chart.y:
+                    if not isinstance(y, list):
+                        raise ValueError(f"{name}的y必须为每组一个列表")
+                    _check_series(chart.x, y, name)
+        if self.scatter is not None:
+            _check_series(self.scatter.x, self.scatter.y, 'scatter')
+            # 分组散点图的groups是每个点所属的组
+            if self.scatter.groups is not None and len(self.scatter.groups) != len(self.scatter.x):
+                raise ValueError("scatter的groups长度必须与x一致")
+        return self
+
+
+class AnswerParseError(ValueError):
+    """无法把智能体输出解析为约定格式"""
+
+
+def _extract_object(text):
+    """
+    取出第一个JSON对象的文本，忽略前后的说明文字
+    缺少的右括号按嵌套顺序补齐
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+    stack = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return text[start:i + 1]
+    return text[start:] + ('"' if in_string else '') + ''.join(reversed(stack))
+
+
+def _candidates(text):
+    """依次产出逐步修复后的候选文本"""
+    # 去掉代码块标记
+    text = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', text.strip())
+    yield text
+    obj = _extract_object(text)
+    if obj is None:
+        return
+    yield obj
+    # 去掉对象和数组末尾多余的逗号
+    obj = re.sub(r',\s*([}\]])', r'\1', obj)
+    yield obj
+    # 中文引号和Python字面量
+    obj = obj.replace('“', '"').replace('”', '"')
+    obj = re.sub(r'\bTrue\b', 'true', re.sub(r'\bFalse\b', 'false', re.sub(r'\bNone\b', 'null', obj)))
+    yield obj
+
+
+def repair_json(text):
+    """
+    本地容错解析：去掉代码块标记和多余文字、补齐括号、去掉多余逗号、兼容单引号
+    :return: 解析出的dict，失败时返回None
+    """
+    if not text:
+        return None
+    for candidate in _candidates(text):
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            try:
+                # 兼容Python字典写法（单引号）
+                value = ast.literal_eval(candidate)
+            except (ValueError, SyntaxError, MemoryError, RecursionError):
+                continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def _is_valid(value):
+    return isinstance(value, dict) and any(key in value for key in ANSWER_KEYS)
+
+
+def _conforms(value):
+    """结果是否符合AgentAnswer的格式，如图表的x和y长度一致"""
+    try:
+        AgentAnswer.model_validate(value)
+    except ValidationError:
+        return False
+    return True
+
+
+def parse_answer(output, llm=None, callbacks=None):
+    """
+    把智能体的最终输出解析为约定格式
+    先严格解析，再本地修复，解析结果须通过AgentAnswer的校验；不是JSON的纯文字直接作为文字回答；
+    都失败且提供了llm时，用结构化输出转换一次
+    :param output: 智能体的最终输出
+    :param llm: 支持with_structured_output的聊天模型
+    :param callbacks: 结构化输出调用使用的回调，如本轮的TraceCallbackHandler，用于统计token
+    :return: 结果字典
+    """
+    output = output or ''
+    try:
+        value = json.loads(output)
+    except ValueError:
+        value = None
+    if not _is_valid(value):
+        value = repair_json(output)
+    if _is_valid(value) and _conforms(value):
+        return value
+
+    if output.startswith('Agent stopped'):
+        raise AnswerParseError("智能体达到迭代次数上限，仍未给出答案")
+
+    # 模型直接给出了文字答案
+    if value is None and '{' not in output and output.strip():
+        return {"answer": output.strip()}
+
+    if llm is not None:
+        try:
+            structured = llm.with_structured_output(AgentAnswer).invoke(
+                "把下面的数据分析结果转换为指定格式，只填写与内容对应的一项，不要编造数据：\n" + output,
+                config={'callbacks': callbacks}
+            )
+            value = structured.model_dump(exclude_none=True)
+            if _is_valid(value):
+                return value
+        except (ValidationError, ValueError) as e:
+            raise AnswerParseError(f"无法解析智能体的输出: {e}") from e
+    raise AnswerParseError("无法解析智能体的输出")
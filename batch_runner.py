@@ -0,0 +1,138 @@
+"""
+离线批量提问：对一个数据集依次回答问题文件中的所有问题，结果写为JSONL
+用法: python batch_runner.py 数据文件 问题文件 [-o 结果文件] [-c 并发数] [--sheet 工作表]
+问题文件为.txt时每行一个问题；为.jsonl时每行一个JSON对象，取question字段（没有时取body或title）
+每条结果包含问题、回答、耗时、智能体迭代次数和token用量，可用于定时生成报告和吞吐量测试
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from data_loader import load_path
+from data_profile import get_profile
+from telemetry import TurnTrace
+from utils import dataframe_agent, model
+
+# 默认并发数
+DEFAULT_CONCURRENCY = 4
+
+
+def read_questions(path):
+    """读取问题文件"""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith('.jsonl'):
+                item = json.loads(line)
+                line = item.get('question') or item.get('body') or item.get('title')
+                if not line:
+                    continue
+            questions.append(line)
+    return questions
+
+
+def answer_one(index, question, df, profile, version, fast_path, cache=True):
+    """回答一个问题，返回结果记录"""
+    stats = {}
+    record = {'index': index, 'question': question}
+    start = time.perf_counter()
+    # 每个问题单独记录token用量；不传会话ID，每个问题使用独立的沙箱执行上下文，并发时分散到各个沙箱进程
+    trace = TurnTrace(question)
+    try:
+        record['result'] = dataframe_agent(df, question, model, profile=profile, version=version,
+                                           fast_path=fast_path, stats=stats, trace=trace, cache=cache)
+        record['error'] = None
+    except Exception as e:
+        record['result'] = None
+        record['error'] = f"{type(e).__name__}: {e}"
+    record.update({
+        'latency': round(time.perf_counter() - start, 3),
+        'source': stats.get('source'),
+        'iterations': stats.get('iterations', 0),
+        'prompt_tokens': trace.prompt_tokens,
+        'completion_tokens': trace.completion_tokens,
+        'total_tokens': trace.prompt_tokens + trace.completion_tokens,
+    })
+    return record
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_batch(df, questions, output, concurrency=DEFAULT_CONCURRENCY, profile=None, version=None,
+              fast_path=True, cache=True):
+    """
+    并发回答一组问题，每完成一个就写入一行结果
+    :param output: 可写的文本文件对象
+    :param cache: 是否使用相似问题的答案缓存
+    :return: 全部结果记录，按问题顺序排列
+    """
+    records = []
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(answer_one, i, question, df, profile, version, fast_path, cache)
+            for i, question in enumerate(questions)
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            with lock:
+                output.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                output.flush()
+                records.append(record)
+            status = '出错' if record['error'] else f"{record['source']}, {record['iterations']}次迭代"
+            print(f"  [{record['index']}] {record['question']}: {status}, {record['latency']:.1f}s",
+                  file=sys.stderr)
+    return sorted(records, key=lambda r: r['index'])
+
+
+def summarize(records, elapsed):
+    """汇总吞吐量、耗时分位数和token用量"""
+    latencies = [r['latency'] for r in records]
+    return {
+        'questions': len(records),
+        'errors': sum(1 for r in records if r['error']),
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(records) / elapsed, 3) if elapsed else None,
+        'latency_p50': _percentile(latencies, 0.5) if latencies else None,
+        'latency_p95': _percentile(latencies, 0.95) if latencies else None,
+        'total_tokens': sum(r['total_tokens'] for r in records),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量提问")
+    parser.add_argument('data', help="数据文件（.csv或.xlsx）")
+    parser.add_argument('questions', help="问题文件（.txt或.jsonl）")
+    parser.add_argument('-o', '--output', default='batch_results.jsonl', help="结果文件，传-时输出到标准输出")
+    parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="并发数")
+    parser.add_argument('--sheet', default=None, help="Excel工作表名，默认第一个工作表")
+    parser.add_argument('--no-fast-path', action='store_true', help="所有问题都交给智能体回答")
+    parser.add_argument('--no-cache', action='store_true', help="不使用相似问题的答案缓存，每个问题都实际回答")
+    args = parser.parse_args()
+
+    version, df = load_path(args.data, sheet_name=args.sheet)
+    profile = get_profile(version, df)
+    questions = read_questions(args.questions)
+
+    start = time.perf_counter()
+    if args.output == '-':
+        records = run_batch(df, questions, sys.stdout, args.concurrency, profile, version,
+                            fast_path=not args.no_fast_path, cache=not args.no_cache)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            records = run_batch(df, questions, output, args.concurrency, profile, version,
+                                fast_path=not args.no_fast_path, cache=not args.no_cache)
+    print(json.dumps(summarize(records, time.perf_counter() - start), ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+对比提示词中加入数据结构摘要前后，智能体回答同一组问题的平均迭代次数
+用法: python benchmark_iterations.py [数据文件] [问题文件]
+问题文件每行一个问题，不提供时使用内置的问题集
+"""
+import sys
+import time
+
+import pandas as pd
+
+from data_profile import DataProfile
+from utils import dataframe_agent, model
+
+# 针对 2023年北京积分落户数据.csv 的固定问题集
+DEFAULT_QUESTIONS = [
+    "积分分值的平均值是多少",
+    "出生年月最早的人是谁",
+    "哪个单位落户的人数最多",
+    "画出积分分值的箱线图",
+    "按出生年份统计人数并画出折线图",
+    "积分超过120分的人来自哪些单位",
+    "列出人数最多的5个单位及其平均积分",
+    "1980年以后出生的人占比是多少",
+]
+
+
+def run(df, questions, profile):
+    """依次提问，返回每个问题的迭代次数"""
+    iterations = []
+    for question in questions:
+        stats = {}
+        start = time.perf_counter()
+        try:
+            dataframe_agent(df, question, model, profile=profile, fast_path=False, stats=stats)
+        except Exception as e:
+            print(f"  提问出错: {question}: {e}")
+        iterations.append(stats.get('iterations', 0))
+        print(f"  {question}: {iterations[-1]}次迭代, {time.perf_counter() - start:.1f}s")
+    return iterations
+
+
+def main():
+    data_path = sys.argv[1] if len(sys.argv) > 1 else '2023年北京积分落户数据.csv'
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = DEFAULT_QUESTIONS
+
+    if data_path.endswith('.csv'):
+        df = pd.read_csv(data_path)
+    else:
+        df = pd.read_excel(data_path)
+
+    print("不加数据结构摘要:")
+    before = run(df, questions, profile=None)
+    print("加入数据结构摘要:")
+    after = run(df, questions, profile=DataProfile.from_dataframe(df))
+
+    mean_before = sum(before) / len(before)
+    mean_after = sum(after) / len(after)
+    print(f"\n平均迭代次数: {mean_before:.2f} -> {mean_after:.2f} ({len(questions)}个问题)")
+
+
+if __name__ == '__main__':
+    main()
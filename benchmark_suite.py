@@ -0,0 +1,335 @@
+"""
+性能基准测试：数据入库、数据画像、智能体单轮问答、图表构建和对话记录渲染
+智能体调用的是本地启动的OpenAI兼容模拟服务，按预先编写的思考-行动轨迹回放，不访问付费接口
+用法: python benchmark_suite.py [--scales 1,4,16] [--repeat 5] [--llm-latency 0.2] [--json 结果.json]
+      [--baseline 基线.json --tolerance 0.2]
+提供基线时，任一项的p95比基线慢超过容忍比例则以非零状态退出
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from chat_render import message_html
+from data_loader import open_columnar, parse_bytes, write_columnar
+from data_profile import DataProfile
+from llm_clients import get_chat_model
+from utils import build_chart_figure, count_tokens, dataframe_agent, figure_cache
+
+CSV_PATH = '2023年北京积分落户数据.csv'
+XLSX_PATH = '2020年销售数据.xlsx'
+XLSX_SHEET = 'data'
+
+# 针对CSV数据集的回放轨迹：问题 -> 每一步的模型输出
+# 模型收到的提示词中，当前请求之后出现了几次Observation，就回放第几步
+SCRIPTED_TRACES = {
+    "积分分值的平均值是多少": [
+        "Thought: 计算积分分值列的平均值\nAction: python_repl_ast\nAction Input: df['积分分值'].mean()",
+        'Thought: I now know the final answer\nFinal Answer: {"answer": "积分分值的平均值约为101.76"}',
+    ],
+    "哪个单位落户的人数最多": [
+        "Thought: 统计各单位人数\nAction: python_repl_ast\nAction Input: df['单位名称'].value_counts().head(1)",
+        'Thought: I now know the final answer\nFinal Answer: {"answer": "落户人数最多的单位是华为技术有限公司"}',
+    ],
+    "列出人数最多的5个单位及其平均积分": [
+        "Thought: 按单位分组统计人数和平均积分\nAction: python_repl_ast\n"
+        "Action Input: df.groupby('单位名称')['积分分值'].agg(['count', 'mean'])"
+        ".sort_values('count', ascending=False).head(5)",
+        "Thought: 取出结果的列表形式\nAction: python_repl_ast\n"
+        "Action Input: df.groupby('单位名称')['积分分值'].agg(['count', 'mean'])"
+        ".sort_values('count', ascending=False).head(5).reset_index().values.tolist()",
+        'Thought: I now know the final answer\nFinal Answer: {"table": {"columns": ["单位名称", "人数", "平均积分"], '
+        '"data": [["华为技术有限公司", 27, 108.2], ["北京首钢股份有限公司", 20, 110.5], '
+        '["中国石油天然气股份有限公司", 18, 109.1], ["联想(北京)有限公司", 15, 106.3], '
+        '["百度在线网络技术(北京)有限公司", 14, 105.8]]}}',
+    ],
+    "画出积分分值的箱线图": [
+        "Thought: 查看积分分值的分布\nAction: python_repl_ast\nAction Input: df['积分分值'].describe()",
+        'Thought: I now know the final answer\nFinal Answer: {"boxplot": {"data": [92.1, 95.4, 99.8, 101.2, '
+        '104.6, 108.9, 115.3, 126.7, 140.05], "title": "积分分值分布", "y_label": "积分分值"}}',
+    ],
+}
+
+# 不在轨迹中的问题使用的默认轨迹
+DEFAULT_TRACE = [
+    "Thought: 查看数据行数\nAction: python_repl_ast\nAction Input: len(df)",
+    'Thought: I now know the final answer\nFinal Answer: {"answer": "数据共6000行"}',
+]
+
+# 模拟向量的维度
+EMBEDDING_DIMENSIONS = 64
+
+
+def _next_step(prompt):
+    """根据提示词找到问题和已经完成的步数，返回回放的模型输出"""
+    marker = "### 当前请求:\n"
+    tail = prompt[prompt.rfind(marker) + len(marker):] if marker in prompt else prompt
+    question = tail.split('\n', 1)[0].strip()
+    trace = SCRIPTED_TRACES.get(question, DEFAULT_TRACE)
+    step = tail.count('Observation:')
+    return trace[min(step, len(trace) - 1)]
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """OpenAI兼容接口：/chat/completions（含流式）和 /embeddings"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.endswith('/embeddings'):
+            self._embeddings(request)
+        elif self.path.endswith('/chat/completions'):
+            time.sleep(self.server.llm_latency)
+            self._chat(request)
+        else:
+            self.send_error(404)
+
+    def _embeddings(self, request):
+        inputs = request.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = []
+        for i, text in enumerate(inputs):
+            rng = np.random.default_rng(abs(hash(str(text))) % (2 ** 32))
+            vector = rng.standard_normal(EMBEDDING_DIMENSIONS)
+            data.append({'object': 'embedding', 'index': i, 'embedding': (vector / np.linalg.norm(vector)).tolist()})
+        self._send_json({'object': 'list', 'data': data, 'model': request.get('model'),
+                         'usage': {'prompt_tokens': 0, 'total_tokens': 0}})
+
+    def _chat(self, request):
+        prompt = '\n'.join(str(m.get('content', '')) for m in request.get('messages', []))
+        content = _next_step(prompt)
+        usage = {'prompt_tokens': count_tokens(prompt), 'completion_tokens': count_tokens(content)}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        base = {'id': f"chatcmpl-{uuid.uuid4().hex}", 'created': int(time.time()), 'model': request.get('model')}
+
+        if not request.get('stream'):
+            self._send_json({**base, 'object': 'chat.completion', 'usage': usage, 'choices': [
+                {'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}
+            ]})
+            return
+
+        # 流式响应按行切分回放
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        pieces = content.splitlines(keepends=True)
+        for i, piece in enumerate(pieces):
+            delta = {'role': 'assistant', 'content': piece} if i == 0 else {'content': piece}
+            chunk = {**base, 'object': 'chat.completion.chunk',
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+        chunk = {**base, 'object': 'chat.completion.chunk',
+                 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self.close_connection = True
+
+
+class MockLLMServer:
+    """在后台线程中运行的本地模拟服务"""
+
+    def __init__(self, llm_latency=0.0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.llm_latency = llm_latency
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def timed(results, name, repeat, func, setup=None):
+    """
+    重复执行并记录每次耗时（毫秒）
+    :param setup: 每次计时前调用，不计入耗时
+    """
+    timings = results.setdefault(name, [])
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def bench_ingest(results, scales, repeat):
+    """按倍数放大内置数据集，测试解析和列式文件读写"""
+    csv_df = pd.read_csv(CSV_PATH)
+    xlsx_df = pd.read_excel(XLSX_PATH, sheet_name=XLSX_SHEET)
+    frames = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            csv_data = pd.concat([csv_df] * scale, ignore_index=True).to_csv(index=False).encode('utf-8')
+            timed(results, f"ingest_csv x{scale}", repeat, lambda: parse_bytes(csv_data, 'data.csv'))
+
+            buffer = io.BytesIO()
+            pd.concat([xlsx_df] * scale, ignore_index=True).to_excel(buffer, sheet_name=XLSX_SHEET, index=False)
+            xlsx_data = buffer.getvalue()
+            timed(results, f"ingest_xlsx x{scale}", repeat,
+                  lambda: parse_bytes(xlsx_data, 'data.xlsx', sheet_name=XLSX_SHEET))
+
+            df = parse_bytes(csv_data, 'data.csv')
+            path = os.path.join(tmp_dir, f"x{scale}.arrow")
+            timed(results, f"spill_write x{scale}", repeat, lambda: write_columnar(df, path))
+            timed(results, f"spill_open x{scale}", repeat, lambda: open_columnar(path))
+            frames[scale] = df
+    return frames
+
+
+def bench_profile(results, frames, repeat):
+    """数据画像的计算和摘要生成"""
+    for scale, df in frames.items():
+        timed(results, f"profile x{scale}", repeat, lambda: DataProfile.from_dataframe(df).to_prompt())
+
+
+def bench_agent(results, df, base_url, repeat):
+    """智能体单轮问答，模型由模拟服务回放"""
+    mock_model = get_chat_model('gpt-4o-mini', base_url, 'sk-benchmark', temperature=0)
+    profile = DataProfile.from_dataframe(df)
+    for question in SCRIPTED_TRACES:
+        timed(results, f"agent_turn {question}", repeat,
+              lambda: dataframe_agent(df, question, mock_model, profile=profile, fast_path=False))
+
+
+def _chart_data(chart_type, n, rng):
+    """生成指定规模的图表数据"""
+    if chart_type == 'pie':
+        return {'labels': [f"类别{i}" for i in range(10)], 'values': rng.random(10).tolist()}
+    if chart_type == 'heatmap':
+        side = max(2, int(n ** 0.5))
+        return {'data': rng.random((side, side)).tolist()}
+    if chart_type == 'boxplot':
+        return {'data': rng.standard_normal(n).tolist()}
+    if chart_type == 'bar':
+        return {'x': [f"类别{i}" for i in range(min(n, 50))], 'y': rng.random(min(n, 50)).tolist()}
+    return {'x': np.arange(n).tolist(), 'y': rng.standard_normal(n).cumsum().tolist()}
+
+
+def bench_charts(results, sizes, repeat):
+    """图表构建，每次计时前清空图表缓存"""
+    rng = np.random.default_rng(0)
+    for chart_type in ['bar', 'line', 'pie', 'scatter', 'heatmap', 'boxplot']:
+        for n in sizes:
+            data = _chart_data(chart_type, n, rng)
+            timed(results, f"chart_{chart_type} n={n}", repeat,
+                  lambda: build_chart_figure(data, chart_type), setup=figure_cache.clear)
+
+
+def bench_render(results, repeat, turns=50, table_rows=500):
+    """渲染整段对话记录的气泡HTML"""
+    table = {'columns': ['单位名称', '人数', '平均积分'],
+             'data': [[f"单位{i}", i, round(100 + i * 0.01, 2)] for i in range(table_rows)]}
+    messages = []
+    for i in range(turns):
+        messages.append({'role': 'user', 'content': f"问题{i}"})
+        if i % 3 == 0:
+            messages.append({'role': 'assistant', 'text': "以下是表格结果：", 'table': table})
+        elif i % 3 == 1:
+            messages.append({'role': 'assistant', 'text': "以下是图表：", 'chart': {'type': 'bar', 'data': {}}})
+        else:
+            messages.append({'role': 'assistant', 'content': f"回答{i}"})
+    timed(results, f"render_transcript {len(messages)}条", repeat,
+          lambda: [message_html(m, i) for i, m in enumerate(messages)])
+
+
+def summarize(results):
+    """每项的p50和p95（毫秒）"""
+    return {
+        name: {'n': len(t), 'p50': float(np.percentile(t, 50)), 'p95': float(np.percentile(t, 95))}
+        for name, t in results.items()
+    }
+
+
+def compare(summary, baseline, tolerance):
+    """与基线比较，返回p95变慢超过容忍比例的项"""
+    regressions = []
+    for name, stats in summary.items():
+        base = baseline.get(name)
+        if base and stats['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append((name, base['p95'], stats['p95']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    parser.add_argument('--scales', default='1,4,16', help="数据集放大倍数，逗号分隔")
+    parser.add_argument('--chart-sizes', default='1000,100000', help="图表数据点数，逗号分隔")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="模拟服务每次响应前等待的秒数")
+    parser.add_argument('--only', default=None, help="只运行指定的测试，逗号分隔：ingest,profile,agent,chart,render")
+    parser.add_argument('--json', default=None, help="把结果写入JSON文件，可作为之后的基线")
+    parser.add_argument('--baseline', default=None, help="基线JSON文件")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许p95比基线慢的比例")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(',')]
+    only = set(args.only.split(',')) if args.only else {'ingest', 'profile', 'agent', 'chart', 'render'}
+    results = {}
+
+    if 'ingest' in only or 'profile' in only:
+        frames = bench_ingest(results, scales, args.repeat) if 'ingest' in only else {
+            scale: pd.concat([pd.read_csv(CSV_PATH)] * scale, ignore_index=True) for scale in scales
+        }
+        if 'profile' in only:
+            bench_profile(results, frames, args.repeat)
+    if 'agent' in only:
+        with MockLLMServer(args.llm_latency) as server:
+            bench_agent(results, pd.read_csv(CSV_PATH), server.base_url, args.repeat)
+    if 'chart' in only:
+        bench_charts(results, [int(n) for n in args.chart_sizes.split(',')], args.repeat)
+    if 'render' in only:
+        bench_render(results, args.repeat)
+
+    summary = summarize(results)
+    width = max(len(name) for name in summary)
+    print(f"\n{'测试项'.ljust(width)}  {'次数':>4}  {'p50(ms)':>10}  {'p95(ms)':>10}")
+    for name, stats in summary.items():
+        print(f"{name.ljust(width)}  {stats['n']:>4}  {stats['p50']:>10.2f}  {stats['p95']:>10.2f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for name, base, current in regressions:
+            print(f"变慢: {name} p95 {base:.2f}ms -> {current:.2f}ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
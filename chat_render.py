@@ -0,0 +1,219 @@
+import math
+import uuid
+
+import pandas as pd
+import streamlit as st
+
+from utils import CHART_TYPES, build_chart_figure, chart_is_downsampled
+
+# 气泡内每页显示的表格行数
+TABLE_PAGE_ROWS = 50
+
+
+def new_message_id():
+    """为消息生成唯一ID，用于缓存渲染结果"""
+    return uuid.uuid4().hex
+
+
+def _escape(series):
+    """向量化的HTML转义，缺失值显示为空单元格"""
+    # 先转为Python字符串：新版pandas的astype(str)会保留缺失值，拼接后整行丢失该单元格
+    return (series.astype(object).where(series.notna(), '').map(str)
+            .str.replace('&', '&amp;', regex=False)
+            .str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False))
+
+
+def table_page_count(table):
+    """表格的分页数"""
+    return max(1, math.ceil(len(table["data"]) / TABLE_PAGE_ROWS))
+
+
+def table_html(table, page=0):
+    """
+    把表格数据渲染为气泡内的HTML表格，只渲染指定页的行
+    单元格标签由pandas按列一次性拼接，不再逐行逐格累加字符串
+    """
+    total_rows = len(table["data"])
+    start = page * TABLE_PAGE_ROWS
+    table_df = pd.DataFrame(
+        data=table["data"][start:start + TABLE_PAGE_ROWS],
+        columns=table["columns"]
+    )
+
+    header = ''.join(f'<th>{col}</th>' for col in _escape(pd.Series(table_df.columns, dtype=object)))
+    if table_df.empty:
+        body = ''
+    else:
+        cells = table_df.apply(lambda col: '<td>' + _escape(col) + '</td>')
+        body = ''.join('<tr>' + cells.agg(''.join, axis=1) + '</tr>')
+
+    # 创建表格HTML
+    html = ('<div class="chart-container">'
+            f'<table class="message-table"><thead><tr>{header}</tr></thead>'
+            f'<tbody>{body}</tbody></table>')
+    pages = table_page_count(table)
+    if pages > 1:
+        html += f'<div class="message-time">第{page + 1}/{pages}页，共{total_rows}行</div>'
+    return html + '</div>'
+
+
+def table_csv(table):
+    """完整表格结果的CSV，带BOM以便Excel正确识别中文"""
+    return pd.DataFrame(data=table["data"], columns=table["columns"]).to_csv(index=False).encode('utf-8-sig')
+
+
+def message_html(message, chart_id, page=0):
+    """构建一条消息的气泡HTML"""
+    role = message["role"]
+    row_class = "user-row" if role == "user" else "assistant-row"
+    bubble_class = "user-bubble" if role == "user" else "assistant-bubble"
+
+    # 使用自定义消息样式
+    html = f"""
+    <div class="message-row {row_class}">
+        <div class="message-bubble {bubble_class}">
+            <div class="message-header">
+                <span class="message-role">
+                    {'<i class="fas fa-user"></i> 用户' if role == "user" else '<i class="fas fa-robot"></i> 助手'}
+                </span>
+                <span class="message-time">刚刚</span>
+            </div>
+            <div class="message-content">
+    """
+
+    # 显示文本回答
+    if "text" in message:
+        html += f'<div>{message["text"]}</div>'
+    elif "content" in message:
+        html += f'<div>{message["content"]}</div>'
+
+    # 显示表格数据
+    if "table" in message:
+        html += table_html(message["table"], page)
+
+    # 添加图表占位符
+    if "chart" in message:
+        html += f'<div id="chart-{chart_id}" class="message-chart"></div>'
+
+    html += """
+            </div>
+        </div>
+    </div>
+    """
+    return html
+
+
+def _render_cache():
+    """当前会话的渲染缓存：消息ID -> {'html': {页码: 气泡HTML}, 'figure': {是否完整显示: 图表}, 'error': 图表错误, 'csv': 完整表格}"""
+    if '_render_cache' not in st.session_state:
+        st.session_state._render_cache = {}
+    return st.session_state._render_cache
+
+
+def _move_chart_script(chart_id, scroll=False):
+    """把图表移动到气泡内占位符的脚本"""
+    scroll_js = """
+                // 再次滚动到底部确保可见
+                const container = document.querySelector('.chat-container');
+                container.scrollTop = container.scrollHeight;""" if scroll else ""
+    return f"""
+    <script>
+    // 将图表移动到气泡内的占位符
+    setTimeout(function() {{
+        const chartContainer = document.querySelector('#chart-{chart_id}');
+        const chartElement = document.querySelector('[data-testid="stPlotlyChart"]:last-child');
+        if (chartContainer && chartElement) {{
+            // 复制图表元素到气泡中
+            const clonedChart = chartElement.cloneNode(true);
+            chartContainer.innerHTML = '';
+            chartContainer.appendChild(clonedChart);
+
+            // 移除原始图表
+            chartElement.remove();
+
+            // 调整图表大小
+            clonedChart.style.width = '100%';
+            clonedChart.style.height = 'auto';{scroll_js}
+        }}
+    }}, 300);
+    </script>
+    """
+
+
+def render_message(message, index, scroll=False):
+    """
+    渲染一条消息，气泡HTML和图表JSON按消息ID缓存
+    重新运行时历史消息直接复用缓存，不再重新构建HTML、图表，也不再序列化图表
+    :param message: 消息
+    :param index: 消息序号，消息没有ID时作为缓存键
+    :param scroll: 渲染图表后是否滚动到底部
+    """
+    message_id = message.get("id", index)
+    cache = _render_cache()
+    entry = cache.get(message_id)
+    if entry is None:
+        entry = {'html': {}, 'figure': {}, 'error': None, 'csv': None}
+        cache[message_id] = entry
+
+    # 大表格分页显示，页码来自气泡下方的翻页控件
+    pages = table_page_count(message["table"]) if "table" in message else 1
+    page_key = f"table-page-{message_id}"
+    page = min(st.session_state.get(page_key, 1), pages) - 1
+    if page not in entry['html']:
+        entry['html'][page] = message_html(message, message_id, page)
+
+    st.markdown(entry['html'][page], unsafe_allow_html=True)
+
+    if pages > 1:
+        if entry['csv'] is None:
+            entry['csv'] = table_csv(message["table"])
+        page_col, download_col = st.columns(2)
+        page_col.number_input("表格页码", min_value=1, max_value=pages, step=1, key=page_key)
+        download_col.download_button(
+            "下载完整结果",
+            data=entry['csv'],
+            file_name="result.csv",
+            mime="text/csv",
+            key=f"table-download-{message_id}"
+        )
+
+    # 渲染图表到占位符
+    if "chart" not in message:
+        return
+    chart_data = message["chart"]["data"]
+    chart_type = message["chart"]["type"]
+
+    # 数据量大的图表默认降采样显示，可按需切换为完整数据
+    full_key = f"chart-full-{message_id}"
+    full_resolution = st.session_state.get(full_key, False)
+    if full_resolution not in entry['figure'] and entry['error'] is None:
+        if chart_type not in CHART_TYPES:
+            entry['error'] = f"不支持的图表类型: {chart_type}"
+        else:
+            try:
+                # 缓存构建好的图表对象，重新运行时不再降采样和构建；
+                # 用st.plotly_chart显示，使用Streamlit自带的plotly.js，离线部署时也能显示
+                entry['figure'][full_resolution] = build_chart_figure(chart_data, chart_type, full_resolution)
+            except Exception as e:
+                entry['error'] = f"生成{chart_type}图表时出错: {str(e)}"
+
+    # 在气泡内部显示图表
+    with st.container():
+        if entry['error'] is not None:
+            st.error(entry['error'])
+            if chart_type in CHART_TYPES:
+                st.json(chart_data)
+            return
+        st.plotly_chart(entry['figure'][full_resolution], use_container_width=True,
+                        key=f"chart-{message_id}-{full_resolution}")
+        if chart_is_downsampled(chart_data, chart_type):
+            st.toggle("显示完整数据", key=full_key, help="数据点较多，默认降采样显示以保证流畅")
+
+        # 使用CSS将图表移动到气泡内部
+        st.markdown(_move_chart_script(message_id, scroll=scroll), unsafe_allow_html=True)
+
+
+def clear_render_cache():
+    """清除当前会话的渲染缓存"""
+    _render_cache().clear()
@@ -0,0 +1,447 @@
+import hashlib
+import io
+import itertools
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+import pandas as pd
+import streamlit as st
+
+try:
+    import pyarrow as pa
+except ImportError:  # 未安装pyarrow时不落盘，直接使用内存中的DataFrame
+    pa = None
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:  # 未安装python-calamine时使用openpyxl（pandas以只读模式流式读取）
+    EXCEL_ENGINE = 'openpyxl'
+
+# 数据集缓存的内存上限（字节），默认1GB，可通过环境变量调整
+DATASET_CACHE_MAX_BYTES = int(os.environ.get('DATASET_CACHE_MAX_BYTES', 1024 ** 3))
+
+# CSV分块读取的行数
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 200_000))
+
+# 单个数据集入库后的内存预算（字节），超出后改为等比例抽样，默认2GB
+INGEST_MEMORY_BUDGET = int(os.environ.get('INGEST_MEMORY_BUDGET', 2 * 1024 ** 3))
+
+# 用于推断列类型的样本行数
+DTYPE_SAMPLE_ROWS = 10_000
+
+# 文本列唯一值占比低于该阈值时转为category
+CATEGORY_MAX_RATIO = 0.5
+
+# 会话内记录的上传文件哈希数量
+UPLOAD_HASHES_MAX = 64
+
+# 列式文件的格式版本，类型转换规则变化时递增，旧规则写出的文件不再复用
+SPILL_FORMAT_VERSION = 2
+
+# 列式数据文件的存放目录，服务重启后可直接复用
+DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data'))
+
+
+def content_hash(data):
+    """计算上传文件内容的哈希值"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def dataframe_nbytes(df):
+    """估算DataFrame占用的内存字节数"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class DatasetCache:
+    """
+    已解析数据集的进程级缓存，所有会话共享
+    以 (内容哈希, 工作表名) 为键，按内存占用做LRU淘汰
+    缓存中的DataFrame不会被任何会话修改：取出时返回浅复制，列数据共享、不额外占用内存，
+    会话（包括进程内执行的智能体代码和预处理）对浅复制的原地修改按写时复制生效，不影响缓存和其他会话
+    """
+
+    def __init__(self, max_bytes=DATASET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # 每个键一把加载锁，避免多个会话同时解析同一文件
+        self._load_locks = {}
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key].copy(deep=False)
+
+    def put(self, key, df):
+        size = dataframe_nbytes(df)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = df
+            self._sizes[key] = size
+            self._total_bytes += size
+            # 淘汰最久未使用的数据集，但至少保留刚放入的这一份
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, _ = self._entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_key)
+
+    def get_or_load(self, key, loader):
+        """命中则直接返回，否则调用loader解析并写入缓存"""
+        df = self.get(key)
+        if df is not None:
+            return df
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            df = self.get(key)
+            if df is None:
+                df = loader()
+                self.put(key, df)
+                df = df.copy(deep=False)
+        with self._lock:
+            self._load_locks.pop(key, None)
+        return df
+
+    def discard(self, key):
+        """释放缓存对数据集的引用；仍在使用它的会话持有各自的浅复制，不受影响，之后再次加载时重新打开列式文件"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._total_bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@st.cache_resource
+def get_dataset_cache():
+    """获取全局共享的数据集缓存"""
+    return DatasetCache()
+
+
+def workbook_sheet_names(data):
+    """
+    从xlsx压缩包的xl/workbook.xml读取工作表列表，不解析任何工作表的数据
+    不是xlsx格式时退回pandas
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive, archive.open('xl/workbook.xml') as f:
+            return [elem.get('name') for _, elem in ElementTree.iterparse(f)
+                    if elem.tag.rsplit('}', 1)[-1] == 'sheet']
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+        return pd.ExcelFile(io.BytesIO(data)).sheet_names
+
+
+@st.cache_data(max_entries=64)
+def _excel_sheet_names(file_hash, _data):
+    """读取Excel工作表列表，按内容哈希缓存"""
+    return workbook_sheet_names(_data)
+
+
+def _uploaded_bytes_and_hash(uploaded_file):
+    """读取上传文件内容并计算哈希，同一上传对象在会话内只计算一次"""
+    data = uploaded_file.getvalue()
+    file_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    hashes = st.session_state.setdefault('_upload_hashes', {})
+    if file_id not in hashes:
+        # 工作区可能同时有多个上传文件，只淘汰最早的记录
+        if len(hashes) >= UPLOAD_HASHES_MAX:
+            hashes.pop(next(iter(hashes)))
+        hashes[file_id] = content_hash(data)
+    return data, hashes[file_id]
+
+
+def upload_hash(uploaded_file):
+    """上传文件的内容哈希"""
+    return _uploaded_bytes_and_hash(uploaded_file)[1]
+
+
+def excel_sheet_names(uploaded_file):
+    """获取上传Excel文件的工作表列表"""
+    data, file_hash = _uploaded_bytes_and_hash(uploaded_file)
+    return _excel_sheet_names(file_hash, data)
+
+
+def _looks_like_date(series):
+    """判断文本列是否为日期，如"出生年月"这类 1977-02 格式的列"""
+    values = series.dropna().astype(str)
+    if values.empty or not values.str.match(r'^\d{4}[-/年.]\d{1,2}').all():
+        return False
+    parsed = pd.to_datetime(values, errors='coerce')
+    return parsed.notna().mean() >= 0.95
+
+
+def infer_dtype_plan(sample):
+    """
+    根据样本推断每列的紧凑类型
+    整数列保持int64：降为int8/int16后，智能体代码中的算术运算可能溢出
+    :param sample: 数据样本
+    :return: {列名: 'date' | 'category' | 'float'}，未列出的列保持原类型
+    """
+    plan = {}
+    for col in sample.columns:
+        series = sample[col]
+        if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+            continue
+        if pd.api.types.is_float_dtype(series):
+            plan[col] = 'float'
+        elif series.dtype == object or pd.api.types.is_string_dtype(series):
+            if _looks_like_date(series):
+                plan[col] = 'date'
+            elif series.nunique() <= max(1, len(series.dropna())) * CATEGORY_MAX_RATIO:
+                plan[col] = 'category'
+    return plan
+
+
+def _downcast_float(series):
+    """浮点列只在转为float32后数值不变时降精度，否则保持原样，避免140.05变为140.050003"""
+    downcast = series.astype('float32')
+    return downcast if downcast.astype(series.dtype).equals(series) else series
+
+
+def _parse_dates(series):
+    """
+    文本列转为日期；日期列由样本推断，样本之外有非空值无法解析时保持文本，不把这些值变为缺失值
+    """
+    parsed = pd.to_datetime(series, errors='coerce')
+    if (parsed.isna() & series.notna()).any():
+        return series
+    return parsed
+
+
+def apply_dtype_plan(df, plan, parse_dates=True):
+    """
+    按推断结果转换列类型，返回新的DataFrame
+    :param parse_dates: 是否转换日期列；分块读取时为False，合并后对整列统一转换
+    """
+    columns = {}
+    for col in df.columns:
+        kind = plan.get(col)
+        series = df[col]
+        if kind == 'float' and pd.api.types.is_float_dtype(series):
+            series = _downcast_float(series)
+        elif kind == 'date':
+            if parse_dates:
+                series = _parse_dates(series)
+        elif kind == 'category':
+            series = series.astype('category')
+        columns[col] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _concat_chunks(chunks, plan):
+    """合并分块，category列合并类别，日期列整列转换，数值列取各分块的公共类型"""
+    if not chunks:
+        return pd.DataFrame()
+    columns = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if plan.get(col) == 'category':
+            try:
+                columns[col] = pd.Series(pd.api.types.union_categoricals(parts, ignore_order=True))
+            except TypeError:
+                # 某些分块该列全为空时类别类型不一致，退回普通合并
+                columns[col] = pd.concat(parts, ignore_index=True).astype('category')
+        elif plan.get(col) == 'date':
+            columns[col] = _parse_dates(pd.concat(parts, ignore_index=True))
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def read_csv_chunked(buffer, total_bytes=None, memory_budget=None, on_progress=None):
+    """
+    分块读取CSV，按样本推断的紧凑类型逐块转换
+    超出内存预算时对已读数据和后续分块按同一比例随机抽样，结果的attrs['sample_ratio']记录抽样比例
+    :param buffer: 二进制文件对象
+    :param total_bytes: 文件总字节数，用于计算进度
+    :param memory_budget: 内存预算（字节），默认INGEST_MEMORY_BUDGET
+    :param on_progress: 进度回调，参数为0~1之间的小数
+    :return: DataFrame
+    """
+    memory_budget = memory_budget or INGEST_MEMORY_BUDGET
+    start = buffer.tell()
+    plan = infer_dtype_plan(pd.read_csv(buffer, nrows=DTYPE_SAMPLE_ROWS))
+
+    # pandas会提前读入整个缓冲区，buffer.tell()不能反映解析进度；按样本行的平均字节数和已解析的行数估算
+    buffer.seek(start)
+    sample_lines = sum(1 for _ in itertools.islice(buffer, DTYPE_SAMPLE_ROWS + 1))
+    row_bytes = (buffer.tell() - start) / max(1, sample_lines)
+    buffer.seek(start)
+
+    chunks = []
+    kept_bytes = 0
+    rows_read = 0
+    sample_ratio = 1.0
+    for i, chunk in enumerate(pd.read_csv(buffer, chunksize=CSV_CHUNK_ROWS)):
+        rows_read += len(chunk)
+        # 日期列合并后再整列转换，任何分块中有无法解析的值时整列保持文本
+        chunk = apply_dtype_plan(chunk, plan, parse_dates=False)
+        # 抽样后按原索引排序，保持文件中的行顺序
+        if sample_ratio < 1.0:
+            chunk = chunk.sample(frac=sample_ratio, random_state=i).sort_index()
+        chunks.append(chunk)
+        kept_bytes += dataframe_nbytes(chunk)
+
+        # 超出预算时抽样比例减半，已保留的数据同样减半
+        while kept_bytes > memory_budget and sample_ratio > 1e-6:
+            sample_ratio /= 2
+            chunks = [c.sample(frac=0.5, random_state=j).sort_index() for j, c in enumerate(chunks)]
+            kept_bytes = sum(dataframe_nbytes(c) for c in chunks)
+
+        if on_progress and total_bytes:
+            on_progress(min(rows_read * row_bytes / total_bytes, 1.0))
+
+    if on_progress and total_bytes:
+        on_progress(1.0)
+    df = _concat_chunks(chunks, plan)
+    df.attrs['sample_ratio'] = sample_ratio
+    return df
+
+
+def spill_path(dataset_key):
+    """数据集对应的列式文件路径，包含格式版本"""
+    key = f"{SPILL_FORMAT_VERSION}:{dataset_key}"
+    return os.path.join(DATA_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.arrow')
+
+
+def write_columnar(df, path):
+    """将DataFrame写为Arrow IPC文件（不压缩，便于内存映射）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # 保存抽样比例等数据集属性，重新打开时恢复
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'dataset_attrs'] = json.dumps(df.attrs).encode('utf-8')
+    table = table.replace_schema_metadata(metadata)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # 先写临时文件再原子替换，避免其他进程读到写了一半的文件
+    os.replace(tmp_path, path)
+
+
+def open_columnar(path):
+    """
+    以内存映射方式打开列式文件，返回Arrow类型的DataFrame
+    数据页由操作系统共享，多个会话打开同一数据集不会重复占用内存
+    """
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    attrs = (table.schema.metadata or {}).get(b'dataset_attrs')
+    if attrs:
+        df.attrs.update(json.loads(attrs))
+    return df
+
+
+def ingest(dataset_key, parse):
+    """
+    数据集入库：首次解析后转为列式文件，之后直接内存映射打开
+    :param dataset_key: 数据集键
+    :param parse: 解析原始文件的函数
+    :return: DataFrame
+    """
+    if pa is None:
+        return parse()
+    path = spill_path(dataset_key)
+    if not os.path.exists(path):
+        df = parse()
+        try:
+            write_columnar(df, path)
+        except pa.ArrowException:
+            # 混合类型的object列（如 ['001', 'A12', 3]）无法转为Arrow，与未安装pyarrow时一样保留在内存中
+            return df
+    return open_columnar(path)
+
+
+def ensure_columnar(dataset_key, df):
+    """
+    确保数据集有对应的列式文件，供沙箱进程内存映射读取；预处理产生的新版本首次使用时写入
+    :return: 文件路径，未安装pyarrow或数据无法转为Arrow时返回None
+    """
+    if pa is None:
+        return None
+    path = spill_path(dataset_key)
+    if not os.path.exists(path):
+        try:
+            write_columnar(df, path)
+        except pa.ArrowException:
+            return None
+    return path
+
+
+def load_uploaded_file(uploaded_file, sheet_name=None, on_progress=None):
+    """
+    读取上传的数据文件，相同内容只解析一次
+    :param uploaded_file: st.file_uploader返回的文件对象
+    :param sheet_name: Excel工作表名，CSV文件传None
+    :param on_progress: 解析进度回调，仅在实际解析文件时调用
+    :return: (数据集键, DataFrame)，数据集键在内容或工作表变化时才会改变
+    """
+    data, file_hash = _uploaded_bytes_and_hash(uploaded_file)
+    return load_bytes(data, file_hash, uploaded_file.name, sheet_name, on_progress)
+
+
+def load_path(path, sheet_name=None, on_progress=None):
+    """
+    读取本地数据文件，与上传文件共用解析、列式文件和内存缓存
+    :return: (数据集键, DataFrame)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_bytes(data, content_hash(data), os.path.basename(path), sheet_name, on_progress)
+
+
+def parse_bytes(data, name, sheet_name=None, on_progress=None):
+    """
+    解析数据文件内容，不经过任何缓存
+    :param data: 文件内容
+    :param name: 文件名，按扩展名区分CSV和Excel
+    :param sheet_name: Excel工作表名
+    :param on_progress: 解析进度回调
+    :return: DataFrame
+    """
+    buffer = io.BytesIO(data)
+    if name.endswith('.csv'):
+        return read_csv_chunked(buffer, total_bytes=len(data), on_progress=on_progress)
+    df = read_excel_sheet(buffer, sheet_name)
+    return apply_dtype_plan(df, infer_dtype_plan(df.head(DTYPE_SAMPLE_ROWS)))
+
+
+def read_excel_sheet(buffer, sheet_name=None):
+    """只解析一个工作表，优先使用calamine引擎"""
+    return pd.read_excel(buffer, sheet_name=0 if sheet_name is None else sheet_name, engine=EXCEL_ENGINE)
+
+
+def load_bytes(data, file_hash, name, sheet_name=None, on_progress=None):
+    """
+    按内容哈希读取数据，不访问会话状态，可在后台线程中调用
+    :return: (数据集键, DataFrame)
+    """
+    # 未指定工作表时按第一个工作表的名称缓存，与显式选择第一个工作表共用同一份数据
+    if sheet_name is None and not name.endswith('.csv'):
+        sheet_name = _excel_sheet_names(file_hash, data)[0]
+    dataset_key = f"{file_hash}:{sheet_name or ''}"
+    return dataset_key, get_dataset_cache().get_or_load(
+        dataset_key, lambda: ingest(dataset_key, lambda: parse_bytes(data, name, sheet_name, on_progress))
+    )
@@ -0,0 +1,219 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+# 全局缓存的数据画像数量上限
+PROFILE_CACHE_MAX_ENTRIES = 64
+
+# 数据结构摘要中每列的示例值个数和示例值最大长度
+DIGEST_EXAMPLES = 3
+DIGEST_EXAMPLE_MAX_CHARS = 20
+
+# 取示例值的行数
+DIGEST_SAMPLE_ROWS = 100
+
+
+class DataProfile:
+    """
+    数据集画像：行列数、列类型、唯一值数、缺失值数和描述统计
+    每个数据版本计算一次，预处理后只重新计算受影响的部分
+    """
+
+    def __init__(self, rows, dtypes, nunique, null_counts, describe, examples=None):
+        self.rows = rows
+        self.dtypes = dtypes
+        self.nunique = nunique
+        self.null_counts = null_counts
+        self.describe = describe
+        self.examples = examples or {}
+        self._digest = None
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """一次性向量化计算所有统计量"""
+        return cls(
+            rows=len(df),
+            dtypes=df.dtypes,
+            nunique=df.nunique(),
+            null_counts=df.isna().sum(),
+            describe=df.describe(),
+            examples=_examples(df),
+        )
+
+    @property
+    def columns(self):
+        return list(self.dtypes.index)
+
+    @property
+    def total_nulls(self):
+        return int(self.null_counts.sum())
+
+    @property
+    def missing_columns(self):
+        return self.null_counts[self.null_counts > 0].index.tolist()
+
+    def after_dropna(self, df):
+        """
+        删除缺失行之后的画像
+        缺失值数直接归零，行数未变化时复用全部统计量
+        """
+        null_counts = pd.Series(0, index=self.null_counts.index, dtype='int64')
+        if len(df) == self.rows:
+            return DataProfile(self.rows, self.dtypes, self.nunique, null_counts, self.describe, self.examples)
+        return DataProfile(
+            rows=len(df),
+            dtypes=df.dtypes,
+            nunique=df.nunique(),
+            null_counts=null_counts,
+            describe=df.describe(),
+            examples=_examples(df),
+        )
+
+    def after_fillna(self, df, columns):
+        """
+        填充缺失值之后的画像，只重新计算被填充的列
+        :param df: 填充后的数据
+        :param columns: 被填充的列
+        """
+        columns = [col for col in columns if col in df.columns]
+        if not columns:
+            return self
+        nunique = self.nunique.copy()
+        nunique[columns] = df[columns].nunique()
+        null_counts = self.null_counts.copy()
+        null_counts[columns] = df[columns].isna().sum()
+
+        describe = self.describe
+        changed = [col for col in columns if col in describe.columns]
+        if changed:
+            describe = describe.copy()
+            describe[changed] = df[changed].describe().reindex(describe.index)
+        return DataProfile(self.rows, df.dtypes, nunique, null_counts, describe, self.examples)
+
+    def column_summary(self):
+        """列信息：列名、类型和唯一值数"""
+        return [
+            f"- {col}: {dtype}, {self.nunique[col]}个唯一值"
+            for col, dtype in self.dtypes.items()
+        ]
+
+    def _column_range(self, col):
+        """数值和日期列的取值范围，来自已计算的描述统计"""
+        if col not in self.describe.columns or 'min' not in self.describe.index:
+            return None
+        low, high = self.describe.at['min', col], self.describe.at['max', col]
+        if pd.isna(low) or pd.isna(high):
+            return None
+        return f"{_format_value(low)}~{_format_value(high)}"
+
+    def schema_digest(self):
+        """
+        紧凑的数据结构摘要：每列一行，包含类型、唯一值数、缺失值数、取值范围和示例值
+        同一个画像只生成一次
+        """
+        if self._digest is None:
+            lines = []
+            for col, dtype in self.dtypes.items():
+                parts = [f"{col}({_short_dtype(dtype)})", f"唯一{self.nunique[col]}", f"缺失{self.null_counts[col]}"]
+                value_range = self._column_range(col)
+                if value_range:
+                    parts.append(f"范围{value_range}")
+                examples = self.examples.get(col)
+                if examples:
+                    parts.append("例" + "|".join(examples))
+                lines.append("- " + " ".join(parts))
+            self._digest = "\n".join(lines)
+        return self._digest
+
+    def to_prompt(self):
+        """供智能体使用的数据结构摘要，模型无需再调用df.columns、df.dtypes、df.head()或df.describe()"""
+        return (
+            "\n\n### 数据结构(df已加载，以下信息无需再用代码查看):\n"
+            f"共{self.rows}行{len(self.dtypes)}列\n"
+            + self.schema_digest()
+        )
+
+
+def _short_dtype(dtype):
+    """
+    摘要中的简短类型名：int/float/bool/datetime/category/str
+    列式文件读回的列是Arrow类型，完整名称如 int64[pyarrow]、timestamp[ns][pyarrow] 较长且对模型没有额外信息
+    """
+    # Arrow的字典类型即分类列
+    if isinstance(dtype, pd.CategoricalDtype) or str(dtype).startswith('dictionary<'):
+        return 'category'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'int'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if pd.api.types.is_string_dtype(dtype) or dtype == object:
+        return 'str'
+    return str(dtype)
+
+
+def _format_value(value):
+    """格式化摘要中的值"""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:.6g}"
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:DIGEST_EXAMPLE_MAX_CHARS]
+
+
+def _examples(df):
+    """从前若干行中为每列取几个不同的示例值"""
+    head = df.head(DIGEST_SAMPLE_ROWS)
+    examples = {}
+    for col in head.columns:
+        values = head[col].dropna().drop_duplicates().head(DIGEST_EXAMPLES)
+        examples[col] = [_format_value(v) for v in values.tolist()]
+    return examples
+
+
+class ProfileCache:
+    """按数据版本缓存画像，所有会话共享"""
+
+    def __init__(self, max_entries=PROFILE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version):
+        with self._lock:
+            if version not in self._entries:
+                return None
+            self._entries.move_to_end(version)
+            return self._entries[version]
+
+    def put(self, version, profile):
+        with self._lock:
+            self._entries[version] = profile
+            self._entries.move_to_end(version)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, version):
+        with self._lock:
+            self._entries.pop(version, None)
+
+
+@st.cache_resource
+def get_profile_cache():
+    """获取全局共享的画像缓存"""
+    return ProfileCache()
+
+
+def get_profile(version, df):
+    """获取指定数据版本的画像，不存在时计算"""
+    cache = get_profile_cache()
+    profile = cache.get(version)
+    if profile is None:
+        profile = DataProfile.from_dataframe(df)
+        cache.put(version, profile)
+    return profile
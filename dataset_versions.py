@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+from data_loader import dataframe_nbytes
+from data_profile import DataProfile, get_profile_cache
+
+# 预处理产生的中间版本占用的内存上限（字节），默认512MB
+VERSION_CACHE_MAX_BYTES = int(os.environ.get('VERSION_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+
+def _dropna(df):
+    """删除含有缺失值的行"""
+    return df.dropna()
+
+
+def _fillna(df, columns):
+    """
+    数值列用平均值、其他列用众数填充缺失值
+    浅复制后只替换被填充的列，其余列与上一版本共享数据，不复制
+    """
+    out = df.copy(deep=False)
+    numeric_cols = df.select_dtypes(include='number').columns
+    for col in df.columns.intersection(columns):
+        if col in numeric_cols:
+            out[col] = df[col].fillna(df[col].mean())
+        else:
+            # 全部缺失的列没有众数，保持原样
+            mode = df[col].mode()
+            if not mode.empty:
+                out[col] = df[col].fillna(mode.iloc[0])
+    return out
+
+
+# 预处理步骤：名称 -> (变换函数, 显示名称, 由上一版本画像增量得到新画像的函数)
+TRANSFORMS = {
+    'dropna': (_dropna, "删除缺失行", lambda profile, df: profile.after_dropna(df)),
+    'fillna': (_fillna, "填充缺失值", lambda profile, df, columns: profile.after_fillna(df, columns)),
+}
+
+
+class DatasetVersion:
+    """
+    数据版本：原始数据集加上一串预处理步骤，只记录步骤，不保存数据
+    版本ID由原始数据集键和步骤决定，相同的步骤在任何会话中得到同一个ID，按版本缓存的结果始终有效
+    """
+
+    def __init__(self, base_key, steps=()):
+        self.base_key = base_key
+        self.steps = tuple(steps)
+        if self.steps:
+            digest = hashlib.sha256(json.dumps(self.steps, ensure_ascii=False).encode('utf-8')).hexdigest()
+            self.id = f"{base_key}@{digest[:16]}"
+        else:
+            self.id = base_key
+
+    @property
+    def parent(self):
+        return DatasetVersion(self.base_key, self.steps[:-1]) if self.steps else None
+
+    def then(self, name, **params):
+        """追加一个预处理步骤，返回新版本"""
+        if name not in TRANSFORMS:
+            raise ValueError(f"不支持的预处理步骤: {name}")
+        return DatasetVersion(self.base_key, self.steps + ((name, json.dumps(params, ensure_ascii=False,
+                                                                             sort_keys=True)),))
+
+    def describe(self):
+        """版本经过的步骤，如 原始数据 → 删除缺失行"""
+        return " → ".join(["原始数据"] + [TRANSFORMS[name][1] for name, _ in self.steps])
+
+
+class VersionStore:
+    """
+    按版本ID缓存预处理后的数据，所有会话共享
+    需要某个版本时从最近的已缓存祖先开始依次应用剩余步骤，原始数据由调用方提供
+    与DatasetCache一样返回浅复制，会话对取出的DataFrame的原地修改不影响缓存和其他会话
+    """
+
+    def __init__(self, max_bytes=VERSION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, version_id):
+        with self._lock:
+            entry = self._entries.get(version_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(version_id)
+            return entry[0]
+
+    def _put(self, version_id, df):
+        nbytes = dataframe_nbytes(df)
+        with self._lock:
+            if version_id in self._entries:
+                self._total_bytes -= self._entries.pop(version_id)[1]
+            self._entries[version_id] = (df, nbytes)
+            self._total_bytes += nbytes
+            # 至少保留刚写入的版本
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+
+    def materialize(self, version, load_base):
+        """
+        获取某个版本的数据
+        :param version: DatasetVersion
+        :param load_base: 返回原始数据的函数
+        :return: DataFrame，缓存数据的浅复制
+        """
+        if not version.steps:
+            return load_base()
+        df = self._get(version.id)
+        if df is None:
+            parent_df = self.materialize(version.parent, load_base)
+            name, params = version.steps[-1]
+            df = TRANSFORMS[name][0](parent_df, **json.loads(params))
+            self._put(version.id, df)
+        return df.copy(deep=False)
+
+    def discard(self, version_id):
+        with self._lock:
+            entry = self._entries.pop(version_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+@st.cache_resource
+def get_version_store():
+    """获取全局共享的版本缓存"""
+    return VersionStore()
+
+
+def version_profile(version, load_base):
+    """
+    获取某个版本的数据画像，不存在时由上一版本的画像增量计算
+    :param version: DatasetVersion
+    :param load_base: 返回原始数据的函数
+    """
+    cache = get_profile_cache()
+    profile = cache.get(version.id)
+    if profile is not None:
+        return profile
+    df = get_version_store().materialize(version, load_base)
+    if not version.steps:
+        profile = DataProfile.from_dataframe(df)
+    else:
+        name, params = version.steps[-1]
+        profile = TRANSFORMS[name][2](version_profile(version.parent, load_base), df, **json.loads(params))
+    cache.put(version.id, profile)
+    return profile
+
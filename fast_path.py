@@ -0,0 +1,274 @@
+import re
+
+import pandas as pd
+
+# 分组结果中最多展示的类别数
+FAST_PATH_MAX_GROUPS = 50
+
+# 出现这些词时问题通常需要多步推理，交给智能体处理
+_COMPLEX_WORDS = ('趋势', '相关', '占比', '比例', '增长', '预测', '同比', '环比', '对比', '为什么', '如何', '分析')
+
+# 不影响语义的常见词，识别完列名和关键词后问题中只应剩下这些词
+_FILLER_PATTERN = re.compile(r'请问|请|帮我|帮忙|给我|列出|显示|展示|给出|查询|查看|看看|看一下|一下|计算|求出|求|'
+                             r'统计|画出|画成|画|绘制|生成|用|柱状|条形|饼|图表|图|表格|分别|所有|全部|总共|一共|共|'
+                             r'数据|记录|哪些|是|有|的|中|里|内|人|个|名|位|条|家|种|类|多少|几|值|排名|排序|按照|'
+                             r'[\s\d.,，。？?！!、:：]')
+
+_CHINESE_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+_NUMBER = r'(\d+|[零一二两三四五六七八九十]+)'
+
+_TOP_N_PATTERN = re.compile(r'(最高|最大|最多|最低|最小|最少)的?前\s*' + _NUMBER
+                            + r'|前\s*' + _NUMBER + r'\s*(?:个|名|位|条|家)?.*?(最高|最大|最多|最低|最小|最少)')
+_TOP_N_WORDS = re.compile(r'最高|最大|最多|最低|最小|最少|前\s*' + _NUMBER)
+_ROW_COUNT_PATTERN = re.compile(r'(多少|几)(行|条)|数据量|记录数')
+_GROUP_PATTERN = re.compile(r'各|每个|每种|每类|不同|按')
+_COUNT_PATTERN = re.compile(r'数量|个数|人数|多少|几个|分布|统计|计数')
+_FILTER_PATTERN = re.compile(r'(不低于|不少于|不小于|至少|不高于|不多于|不大于|至多|大于|高于|超过|多于|'
+                             r'小于|低于|少于|不足|等于)\s*(-?\d+(?:\.\d+)?)')
+_AGGREGATES = [
+    ('平均', 'mean', '平均值'),
+    ('均值', 'mean', '平均值'),
+    ('中位数', 'median', '中位数'),
+    ('总和', 'sum', '总和'),
+    ('合计', 'sum', '总和'),
+    ('总计', 'sum', '总和'),
+    ('最大', 'max', '最大值'),
+    ('最高', 'max', '最大值'),
+    ('最小', 'min', '最小值'),
+    ('最低', 'min', '最小值'),
+]
+# 否定和多条件的问题只识别出一部分条件会得到错误结果，交给智能体处理
+_NEGATION_PATTERN = re.compile(r'不|非|没有|无|除|以外|之外|排除')
+_COMPOUND_PATTERN = re.compile(r'且|并|或|和|与|及|同时|但')
+
+# 有对话历史时，出现这些词说明问题承接上文（如"那女性呢"），不能脱离上下文直接计算
+_FOLLOW_UP_PATTERN = re.compile(r'那|这|其|它|他|她|呢|上述|上面|刚才|之前|前面|同样|也|还|再|只看')
+
+_FILTER_OPERATORS = {
+    '不低于': 'ge', '不少于': 'ge', '不小于': 'ge', '至少': 'ge',
+    '不高于': 'le', '不多于': 'le', '不大于': 'le', '至多': 'le',
+    '大于': 'gt', '高于': 'gt', '超过': 'gt', '多于': 'gt',
+    '小于': 'lt', '低于': 'lt', '少于': 'lt', '不足': 'lt',
+    '等于': 'eq',
+}
+
+
+def _parse_number(text):
+    """解析阿拉伯数字或"十""二十三"这类中文数字"""
+    if text.isdigit():
+        return int(text)
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return _CHINESE_DIGITS.get(tens, 1) * 10 + _CHINESE_DIGITS.get(ones, 0)
+    return _CHINESE_DIGITS.get(text)
+
+
+def _common_substring_length(a, b):
+    """两个字符串的最长公共子串长度"""
+    best = 0
+    for i in range(len(a)):
+        for j in range(i + best + 1, len(a) + 1):
+            if a[i:j] in b:
+                best = j - i
+            else:
+                break
+    return best
+
+
+def _mentioned_columns(df, question):
+    """
+    找出问题中提到的列，按在问题中出现的位置排序
+    列名全文出现，或与问题的公共子串至少2个字符且不少于列名的一半时视为提到
+    :return: [(列名, 问题中匹配到的文字)]
+    """
+    mentions = []
+    for col in df.columns:
+        name = str(col)
+        if name in question:
+            mentions.append((question.index(name), col, name))
+            continue
+        length = _common_substring_length(name, question)
+        if length >= 2 and length * 2 >= len(name):
+            # 取公共子串在问题中的位置
+            for i in range(len(name) - length + 1):
+                if name[i:i + length] in question:
+                    mentions.append((question.index(name[i:i + length]), col, name[i:i + length]))
+                    break
+    return [(col, text) for _, col, text in sorted(mentions, key=lambda m: m[0])]
+
+
+def _has_unrecognized_words(question, mentions):
+    """去掉列名、关键词和常见虚词后仍有任何其他内容（如筛选条件），说明问题超出了快速路径的能力"""
+    rest = question
+    for _, text in mentions:
+        rest = rest.replace(text, '')
+    for pattern in (_TOP_N_WORDS, _ROW_COUNT_PATTERN, _GROUP_PATTERN, _COUNT_PATTERN, _FILTER_PATTERN):
+        rest = pattern.sub('', rest)
+    for word, _, _ in _AGGREGATES:
+        rest = rest.replace(word, '')
+    rest = _FILLER_PATTERN.sub('', rest)
+    return bool(rest)
+
+
+def _split_columns(df, columns):
+    """把提到的列分为数值列和非数值列"""
+    numeric = [col for col in columns if pd.api.types.is_numeric_dtype(df[col])]
+    other = [col for col in columns if col not in numeric]
+    return numeric, other
+
+
+def _to_native(value):
+    """转换为可直接序列化为JSON的Python值"""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if value is None or (not isinstance(value, (list, tuple, dict)) and pd.isna(value)):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _format_number(value):
+    value = _to_native(value)
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip('0').rstrip('.')
+    return str(value)
+
+
+def _table(df):
+    """DataFrame转为PROMPT_PREFIX中的表格格式"""
+    return {"table": {
+        "columns": [str(col) for col in df.columns],
+        "data": [[_to_native(v) for v in row] for row in df.astype(object).itertuples(index=False)]
+    }}
+
+
+def _series_result(series, question, title, x_label, y_label):
+    """分组结果按问题要求输出为饼图、柱状图或表格"""
+    series = series.head(FAST_PATH_MAX_GROUPS)
+    labels = [str(_to_native(v)) for v in series.index]
+    values = [_to_native(v) for v in series.values]
+    if '饼' in question:
+        return {"pie": {"labels": labels, "values": values, "title": title}}
+    if '图' in question:
+        return {"bar": {"x": labels, "y": values, "title": title, "x_label": x_label, "y_label": y_label}}
+    return _table(pd.DataFrame({x_label: labels, y_label: values}))
+
+
+def _row_count(df, question, numeric, other):
+    if numeric or other or not _ROW_COUNT_PATTERN.search(question):
+        return None
+    return {"answer": f"数据共{len(df)}行{len(df.columns)}列。"}
+
+
+def _top_n(df, question, numeric, other):
+    match = _TOP_N_PATTERN.search(question)
+    if not match or len(numeric) != 1 or len(other) > 1:
+        return None
+    word = match.group(1) or match.group(4)
+    n = _parse_number(match.group(2) or match.group(3))
+    if not n:
+        return None
+    value_col = numeric[0]
+    ascending = word in ('最低', '最小', '最少')
+    if other:
+        # 按实体分组，取每个实体的最高（最低）值后排序
+        label_col = other[0]
+        grouped = df.groupby(label_col, observed=True)[value_col]
+        series = grouped.min() if ascending else grouped.max()
+        series = series.sort_values(ascending=ascending).head(n)
+        return _table(series.reset_index())
+    rows = df.nsmallest(n, value_col) if ascending else df.nlargest(n, value_col)
+    return _table(rows)
+
+
+def _filter_count(df, question, numeric, other):
+    match = _FILTER_PATTERN.search(question)
+    if not match or len(numeric) != 1 or other or not _COUNT_PATTERN.search(question):
+        return None
+    col = numeric[0]
+    threshold = float(match.group(2))
+    count = int(getattr(df[col], _FILTER_OPERATORS[match.group(1)])(threshold).sum())
+    return {"answer": f"{col}{match.group(1)}{match.group(2)}的记录共{count}条。"}
+
+
+def _group_count(df, question, numeric, other):
+    if numeric or len(other) != 1 or not _GROUP_PATTERN.search(question) or not _COUNT_PATTERN.search(question):
+        return None
+    col = other[0]
+    counts = df[col].value_counts()
+    return _series_result(counts, question, f"各{col}数量", str(col), '数量')
+
+
+def _aggregate(df, question, numeric, other):
+    if len(numeric) != 1 or len(other) > 1 or re.search('谁|哪', question):
+        return None
+    for word, func, label in _AGGREGATES:
+        if word in question:
+            break
+    else:
+        return None
+    col = numeric[0]
+    if other:
+        if not _GROUP_PATTERN.search(question):
+            return None
+        group_col = other[0]
+        series = getattr(df.groupby(group_col, observed=True)[col], func)()
+        series = series.sort_values(ascending=False)
+        return _series_result(series, question, f"各{group_col}{col}{label}", str(group_col), f"{col}{label}")
+    return {"answer": f"{col}的{label}为{_format_number(getattr(df[col], func)())}。"}
+
+
+def _has_multiple_intents(rest):
+    """
+    前N名之外还有分组、计数或聚合的要求（如"积分最高的前5个单位的人数""各单位积分最高的前3人"），
+    快速路径只能完成其中一项，交给智能体处理
+    """
+    match = _TOP_N_PATTERN.search(rest)
+    if not match:
+        return False
+    rest = rest[:match.start()] + rest[match.end():]
+    return bool(_GROUP_PATTERN.search(rest) or _COUNT_PATTERN.search(rest)
+                or any(word in rest for word, _, _ in _AGGREGATES))
+
+
+def _has_conversation(history):
+    return any(entry.get("role") in ("user", "assistant") for entry in history or ())
+
+
+def try_fast_path(df, question, history=None):
+    """
+    识别简单的统计类问题（行数、前N名、分组计数、条件计数、聚合）并直接用pandas计算
+    :param df: 数据集
+    :param question: 用户问题
+    :param history: 对话历史，问题承接上文时不走快速路径
+    :return: 与PROMPT_PREFIX格式一致的结果，无法可靠识别时返回None，由智能体处理
+    """
+    if any(word in question for word in _COMPLEX_WORDS):
+        return None
+    mentions = _mentioned_columns(df, question)
+    # 列名和筛选条件本身可能带"不""和"等字（如"不低于"），先去掉再判断追问、否定和多条件
+    rest = question
+    for _, text in mentions:
+        rest = rest.replace(text, '')
+    if len(_FILTER_PATTERN.findall(rest)) > 1:
+        return None
+    rest = _FILTER_PATTERN.sub('', rest)
+    if _has_conversation(history) and _FOLLOW_UP_PATTERN.search(rest):
+        return None
+    if _NEGATION_PATTERN.search(rest) or _COMPOUND_PATTERN.search(rest):
+        return None
+    if _has_multiple_intents(rest):
+        return None
+    if _has_unrecognized_words(question, mentions):
+        return None
+    numeric, other = _split_columns(df, [col for col, _ in mentions])
+    for handler in (_row_count, _top_n, _filter_count, _group_count, _aggregate):
+        try:
+            result = handler(df, question, numeric, other)
+        except (TypeError, ValueError, KeyError):
+            return None
+        if result is not None:
+            return result
+    return None
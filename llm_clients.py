@@ -0,0 +1,95 @@
+import hashlib
+import os
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from openai import OpenAI
+from pydantic import SecretStr
+
+# 连接池大小
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get('LLM_POOL_MAX_CONNECTIONS', 50))
+
+# 保持长连接的数量
+LLM_POOL_MAX_KEEPALIVE = int(os.environ.get('LLM_POOL_MAX_KEEPALIVE', 20))
+
+# 空闲长连接的保留时间（秒）
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_POOL_KEEPALIVE_EXPIRY', 60))
+
+# 请求超时和建立连接的超时（秒）
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 120))
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 10))
+
+_lock = threading.Lock()
+_http_client = None
+_clients = {}
+
+
+def get_http_client():
+    """所有模型和向量客户端共享的HTTP连接池"""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            )
+        return _http_client
+
+
+def _registry_key(kind, base_url, api_key, model, **kwargs):
+    """客户端注册表的键，API密钥只保存摘要"""
+    if isinstance(api_key, SecretStr):
+        api_key = api_key.get_secret_value()
+    digest = hashlib.sha256(str(api_key).encode('utf-8')).hexdigest()
+    return kind, base_url.rstrip('/'), digest, model, tuple(sorted(kwargs.items()))
+
+
+def _get_or_create(key, factory):
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+    client = factory()
+    with _lock:
+        return _clients.setdefault(key, client)
+
+
+def get_openai_client(base_url, api_key):
+    """按 (接口地址, API密钥) 复用OpenAI客户端"""
+    key = _registry_key('openai', base_url, api_key, None)
+    return _get_or_create(key, lambda: OpenAI(
+        base_url=base_url,
+        api_key=api_key.get_secret_value() if isinstance(api_key, SecretStr) else api_key,
+        http_client=get_http_client(),
+    ))
+
+
+def get_chat_model(model, base_url, api_key, **kwargs):
+    """
+    按 (接口地址, API密钥, 模型, 其他参数) 复用ChatOpenAI实例
+    :param kwargs: 传给ChatOpenAI的其他参数，如temperature、streaming
+    """
+    key = _registry_key('chat', base_url, api_key, model, **kwargs)
+    return _get_or_create(key, lambda: ChatOpenAI(
+        model=model,
+        base_url=base_url,
+        api_key=api_key if isinstance(api_key, SecretStr) else SecretStr(api_key),
+        http_client=get_http_client(),
+        **kwargs
+    ))
+
+
+def get_embeddings(model, base_url, api_key):
+    """按 (接口地址, API密钥, 模型) 复用OpenAIEmbeddings实例"""
+    key = _registry_key('embeddings', base_url, api_key, model)
+    return _get_or_create(key, lambda: OpenAIEmbeddings(
+        model=model,
+        base_url=base_url,
+        api_key=api_key if isinstance(api_key, SecretStr) else SecretStr(api_key),
+        http_client=get_http_client(),
+    ))
@@ -0,0 +1,284 @@
+import ast
+import contextvars
+import io
+import multiprocessing
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import redirect_stdout
+from typing import Any
+
+from langchain_core.tools import BaseTool
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不限制资源
+    resource = None
+
+# 沙箱工作进程数
+SANDBOX_WORKERS = int(os.environ.get('SANDBOX_WORKERS', os.cpu_count() or 2))
+
+# 单次代码执行的CPU时间上限（秒）
+SANDBOX_CPU_SECONDS = int(os.environ.get('SANDBOX_CPU_SECONDS', 30))
+
+# 单次代码执行的墙钟时间上限（秒），超时后终止工作进程
+SANDBOX_WALL_SECONDS = float(os.environ.get('SANDBOX_WALL_SECONDS', 60))
+
+# 工作进程的虚拟内存上限（字节），默认4GB
+SANDBOX_MEMORY_BYTES = int(os.environ.get('SANDBOX_MEMORY_BYTES', 4 * 1024 ** 3))
+
+# 返回给智能体的输出最大字符数
+SANDBOX_MAX_OUTPUT_CHARS = 10_000
+
+# 每个工作进程保留的执行上下文数量
+SANDBOX_MAX_CONTEXTS = 32
+
+# 每个工作进程保持打开的列式文件数量，内存映射同样计入虚拟内存上限
+SANDBOX_MAX_DATASETS = 4
+
+# 当前的执行上下文ID，由调用方按会话或按轮设置，同一上下文的多次执行共享变量
+# 不同上下文分散到不同的工作进程，多个会话可以并行执行
+execution_context = contextvars.ContextVar('sandbox_execution_context', default=None)
+
+
+def _sanitize(code):
+    """去掉模型输入中的代码块标记，与python_repl_ast的处理一致"""
+    code = re.sub(r"^(\s|`)*(?i:python)?\s*", "", code)
+    return re.sub(r"(\s|`)*$", "", code)
+
+
+def _run_code(code, namespace):
+    """执行代码，最后一条语句是表达式时返回其值，否则返回打印的内容"""
+    try:
+        tree = ast.parse(_sanitize(code))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exec(ast.unparse(ast.Module(body=tree.body[:-1], type_ignores=[])), namespace)
+            if not tree.body:
+                return output.getvalue()
+            last = ast.unparse(ast.Module(body=tree.body[-1:], type_ignores=[]))
+            try:
+                result = eval(last, namespace)
+            except SyntaxError:
+                exec(last, namespace)
+                return output.getvalue()
+        return output.getvalue() if result is None else str(result)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def _open_dataset(path):
+    """以内存映射方式打开数据集的列式文件，多个工作进程共享同一份页缓存"""
+    import pandas as pd
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def table_helpers(tables):
+    """
+    智能体代码中可用的跨表变量和函数
+    :param tables: 表名 -> DataFrame 的映射，按需加载
+    """
+    import pandas as pd
+
+    def _frame(table):
+        return tables[table] if isinstance(table, str) else table
+
+    def join_tables(left, right, on=None, how='inner', **kwargs):
+        """按列连接两张表，参数可以是表名或DataFrame"""
+        return pd.merge(_frame(left), _frame(right), on=on, how=how, **kwargs)
+
+    def union_tables(names, source_column='来源表'):
+        """纵向合并多张表，并用一列记录每行来自哪张表"""
+        frames = [_frame(name).assign(**{source_column: name}) if isinstance(name, str) else name
+                  for name in names]
+        return pd.concat(frames, ignore_index=True)
+
+    return {'tables': tables, 'join_tables': join_tables, 'union_tables': union_tables}
+
+
+class _PathTables(Mapping):
+    """工作进程内的表映射：表名 -> 列式文件，首次访问时打开"""
+
+    def __init__(self, open_path):
+        self.paths = {}
+        self._open_path = open_path
+
+    def __getitem__(self, name):
+        if name not in self.paths:
+            raise KeyError(f"工作区中没有数据表: {name}")
+        return self._open_path(self.paths[name])
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def _worker_main(conn, cpu_seconds, memory_bytes):
+    """沙箱工作进程：按请求在数据集上执行代码"""
+    import numpy as np
+    import pandas as pd
+
+    if resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+    datasets = OrderedDict()
+    contexts = OrderedDict()
+
+    def open_path(path):
+        """打开列式文件，返回浅复制：各上下文中的原地修改互不影响，未修改的列仍共享内存映射"""
+        if path not in datasets:
+            datasets[path] = _open_dataset(path)
+            while len(datasets) > SANDBOX_MAX_DATASETS:
+                datasets.popitem(last=False)
+        datasets.move_to_end(path)
+        return datasets[path].copy(deep=False)
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        dataset_path, context_id, code, table_paths = request
+
+        # 同一上下文的多次调用共享变量，与进程内的python_repl_ast行为一致
+        key = (dataset_path, context_id)
+        if key not in contexts:
+            try:
+                df = open_path(dataset_path)
+            except Exception as e:
+                conn.send(f"{type(e).__name__}: {e}")
+                continue
+            contexts[key] = {'df': df, 'pd': pd, 'np': np, **table_helpers(_PathTables(open_path))}
+        contexts[key]['tables'].paths.update(table_paths)
+        contexts.move_to_end(key)
+        while len(contexts) > SANDBOX_MAX_CONTEXTS:
+            contexts.popitem(last=False)
+
+        # CPU时间是累计值，每次执行前在已用时间的基础上设置上限，超出后进程收到SIGXCPU被终止
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+        conn.send(_run_code(code, contexts[key])[:SANDBOX_MAX_OUTPUT_CHARS])
+
+
+class _Worker:
+    """一个沙箱工作进程及其通信管道"""
+
+    def __init__(self, mp_context, cpu_seconds, memory_bytes):
+        self._mp_context = mp_context
+        self._args = (cpu_seconds, memory_bytes)
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self._mp_context.Pipe()
+        self.process = self._mp_context.Process(
+            target=_worker_main, args=(child_conn,) + self._args, daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def restart(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+
+class SandboxPool:
+    """
+    预先启动的沙箱进程池，在独立进程中执行智能体生成的pandas代码
+    数据集通过内存映射的列式文件共享；同一上下文固定发往同一个进程，以保留变量，不同上下文分散到各个进程
+    """
+
+    def __init__(self, size=SANDBOX_WORKERS, cpu_seconds=SANDBOX_CPU_SECONDS,
+                 wall_seconds=SANDBOX_WALL_SECONDS, memory_bytes=SANDBOX_MEMORY_BYTES):
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.wall_seconds = wall_seconds
+        self._workers = [_Worker(mp_context, cpu_seconds, memory_bytes) for _ in range(size)]
+
+    def execute(self, dataset_path, context_id, code, table_paths=None):
+        """
+        在沙箱进程中执行代码
+        :param dataset_path: 数据集的列式文件路径
+        :param context_id: 执行上下文ID
+        :param code: 代码
+        :param table_paths: 工作区中其他表的列式文件路径，表名 -> 路径
+        :return: 执行结果文本
+        """
+        worker = self._workers[hash(context_id) % len(self._workers)]
+        with worker.lock:
+            if not worker.process.is_alive():
+                worker.restart()
+            try:
+                worker.conn.send((dataset_path, context_id, code, table_paths or {}))
+                if not worker.conn.poll(self.wall_seconds):
+                    worker.restart()
+                    return f"TimeoutError: 代码执行超过{self.wall_seconds:g}秒，已终止"
+                return worker.conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                worker.restart()
+                return "ResourceError: 代码执行超出CPU时间或内存限制，已终止"
+
+    def shutdown(self):
+        for worker in self._workers:
+            with worker.lock:
+                try:
+                    worker.conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+                worker.process.join(timeout=1)
+                if worker.process.is_alive():
+                    worker.process.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool():
+    """获取全局共享的沙箱进程池，首次使用时启动"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+        return _pool
+
+
+class SandboxPythonTool(BaseTool):
+    """在沙箱进程中执行代码的python_repl_ast工具，替换智能体默认的进程内执行"""
+
+    name: str = "python_repl_ast"
+    description: str = (
+        "A Python shell. Use this to execute python commands. "
+        "Input should be a valid python command. "
+        "When using this tool, sometimes output is abbreviated - "
+        "make sure it does not look abbreviated before using it in your answer."
+    )
+    dataset_path: str
+    # 工作区（workspace.Workspace），代码中引用到的表在这里加载并写出列式文件
+    workspace: Any = None
+
+    def _run(self, query, run_manager=None):
+        table_paths = self.workspace.resolve_paths(query) if self.workspace is not None else None
+        # 没有设置执行上下文时每次执行使用独立的上下文，不保留变量
+        context_id = execution_context.get() or uuid.uuid4().hex
+        return get_sandbox_pool().execute(self.dataset_path, context_id, query, table_paths)
@@ -0,0 +1,99 @@
+import json
+import os
+import re
+from typing import Any, Optional
+
+from langchain_core.tools import BaseTool
+
+try:
+    import duckdb
+except ImportError:  # 未安装duckdb时不提供SQL工具
+    duckdb = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# 是否默认给智能体提供SQL查询工具
+AGENT_SQL = os.environ.get('AGENT_SQL', '0') == '1'
+
+# SQL查询使用的线程数
+SQL_THREADS = int(os.environ.get('SQL_THREADS', os.cpu_count() or 4))
+
+# 返回给智能体的最大行数
+SQL_MAX_ROWS = int(os.environ.get('SQL_MAX_ROWS', 200))
+
+# 返回给智能体的错误：SQL错误、表不存在，以及列式文件被删除或损坏
+_QUERY_ERRORS = ((duckdb.Error,) if duckdb is not None else ()) + (KeyError, OSError) + (
+    (pa.ArrowException,) if pa is not None else ())
+
+
+def sql_available():
+    """是否安装了duckdb"""
+    return duckdb is not None
+
+
+def _sanitize(query):
+    """去掉模型输入中的代码块标记"""
+    query = re.sub(r"^(\s|`)*(?i:sql)?\s*", "", query)
+    return re.sub(r"(\s|`|;)*$", "", query)
+
+
+def _open_arrow(path):
+    """内存映射打开列式文件，DuckDB直接扫描其中的Arrow数据，不复制"""
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def run_sql(query, df=None, dataset_path=None, workspace=None, max_rows=SQL_MAX_ROWS):
+    """
+    用DuckDB执行SQL查询
+    :param query: SQL语句，当前数据表名为df
+    :param df: 当前数据集
+    :param dataset_path: 当前数据集的列式文件路径，提供时直接扫描文件而不是DataFrame
+    :param workspace: 多文件工作区，查询中出现的表名按需加载后注册
+    :param max_rows: 最多返回的行数
+    :return: 表格格式的结果 {"columns": [...], "data": [[...]], "truncated": 是否截断}
+    """
+    # 只允许查询注册的数据，禁止读写本地文件
+    con = duckdb.connect(config={'threads': SQL_THREADS, 'enable_external_access': False})
+    try:
+        con.register('df', _open_arrow(dataset_path) if dataset_path and pa is not None else df)
+        if workspace is not None:
+            for name in workspace.referenced(query, identifiers=True):
+                con.register(name, workspace.get(name))
+        cursor = con.execute(query)
+        if cursor.description is None:
+            return {"columns": [], "data": [], "truncated": False}
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchmany(max_rows + 1)
+    finally:
+        con.close()
+    return {
+        "columns": columns,
+        "data": [list(row) for row in rows[:max_rows]],
+        "truncated": len(rows) > max_rows,
+    }
+
+
+class SQLQueryTool(BaseTool):
+    """DuckDB SQL查询工具，多线程、向量化执行，适合大数据集上的筛选和分组聚合"""
+
+    name: str = "sql_query"
+    description: str = (
+        "A DuckDB SQL engine for filtering, grouping and aggregating large data quickly. "
+        "Input should be a single SQL query without code fences. The current dataset is the table df; "
+        "other workspace tables are referenced by their names in double quotes. "
+        "Returns JSON in the table format {\"columns\": [...], \"data\": [[...]], \"truncated\": bool}, "
+        "which can be used directly as the final answer's table or reshaped into a chart."
+    )
+    df: Any = None
+    dataset_path: Optional[str] = None
+    workspace: Any = None
+
+    def _run(self, query, run_manager=None):
+        try:
+            result = run_sql(_sanitize(query), self.df, self.dataset_path, self.workspace)
+        except _QUERY_ERRORS as e:
+            return f"{type(e).__name__}: {e}"
+        return json.dumps(result, ensure_ascii=False, default=str)
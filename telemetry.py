@@ -0,0 +1,283 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 每轮问答的记录追加写入的JSONL文件，为空时不写
+TELEMETRY_JSONL = os.environ.get('TELEMETRY_JSONL', '')
+
+# Prometheus文本格式指标的输出文件（可配合node_exporter的textfile采集），为空时不写
+TELEMETRY_PROM_FILE = os.environ.get('TELEMETRY_PROM_FILE', '')
+
+# Prometheus指标的HTTP端口，为0时不启动
+TELEMETRY_PROM_PORT = int(os.environ.get('TELEMETRY_PROM_PORT', 0))
+
+# 每千token的价格，用于估算费用（默认按gpt-4o-mini的美元价格）
+TELEMETRY_PROMPT_PRICE = float(os.environ.get('TELEMETRY_PROMPT_PRICE', 0.00015))
+TELEMETRY_COMPLETION_PRICE = float(os.environ.get('TELEMETRY_COMPLETION_PRICE', 0.0006))
+
+# 内存中保留的最近记录数
+TELEMETRY_MAX_TRACES = 200
+
+# 耗时直方图的分桶（秒）
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class TurnTrace:
+    """
+    一轮问答（或一次数据加载）的耗时分解
+    每个阶段记为一个span：ingest、profile、prompt_build、llm、tool、parse、render等
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self.spans = []
+        self.meta = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.duration = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end=None, **attrs):
+        """
+        记录一个阶段
+        :param start: time.perf_counter()时间
+        :param end: 结束时间，默认为当前时间
+        """
+        end = time.perf_counter() if end is None else end
+        span = {'name': name, 'start': round(start - self._start, 4), 'duration': round(end - start, 4)}
+        span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """记录代码块耗时的上下文管理器"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, **attrs)
+
+    def add_tokens(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    @property
+    def cost(self):
+        return (self.prompt_tokens * TELEMETRY_PROMPT_PRICE
+                + self.completion_tokens * TELEMETRY_COMPLETION_PRICE) / 1000
+
+    def finish(self):
+        self.duration = round(time.perf_counter() - self._start, 4)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost': round(self.cost, 6),
+            'meta': dict(self.meta),
+            'spans': spans,
+        }
+
+
+def _token_usage(response):
+    """从模型返回结果中取token用量，取不到时返回None"""
+    usage = (response.llm_output or {}).get('token_usage')
+    if usage:
+        return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if metadata:
+                return metadata.get('input_tokens', 0), metadata.get('output_tokens', 0)
+    return None
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """把智能体每次迭代的模型调用和工具执行记录到TurnTrace"""
+
+    def __init__(self, trace, count_tokens=None):
+        """
+        :param trace: TurnTrace
+        :param count_tokens: 接口没有返回token用量（如流式输出）时用于估算的函数
+        """
+        self.trace = trace
+        self.count_tokens = count_tokens or (lambda text: len(text))
+        self._starts = {}
+        self._iteration = 0
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._iteration += 1
+        self._starts[run_id] = (time.perf_counter(), self._iteration, prompts)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start, iteration, prompts = self._starts.pop(run_id, (time.perf_counter(), self._iteration, []))
+        usage = _token_usage(response)
+        if usage is None:
+            usage = (
+                sum(self.count_tokens(p) for p in prompts),
+                sum(self.count_tokens(g.text) for gens in response.generations for g in gens),
+            )
+        self.trace.add_span('llm', start, iteration=iteration, prompt_tokens=usage[0], completion_tokens=usage[1])
+        self.trace.add_tokens(*usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start, iteration, _ = self._starts.pop(run_id, (time.perf_counter(), self._iteration, []))
+        self.trace.add_span('llm', start, iteration=iteration, error=f"{type(error).__name__}: {error}")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), self._iteration, (serialized or {}).get('name'))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        start, iteration, tool = self._starts.pop(run_id, (time.perf_counter(), self._iteration, None))
+        self.trace.add_span('tool', start, iteration=iteration, tool=tool)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        start, iteration, tool = self._starts.pop(run_id, (time.perf_counter(), self._iteration, None))
+        self.trace.add_span('tool', start, iteration=iteration, tool=tool, error=f"{type(error).__name__}: {error}")
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class TelemetryRecorder:
+    """
+    汇总所有会话的记录：保留最近的记录，追加写入JSONL，并维护Prometheus格式的指标
+    """
+
+    def __init__(self, jsonl_path=TELEMETRY_JSONL, prom_path=TELEMETRY_PROM_FILE,
+                 max_traces=TELEMETRY_MAX_TRACES):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.traces = deque(maxlen=max_traces)
+        self._spans = {}
+        self._turns = {}
+        self._counters = {'prompt': 0, 'completion': 0, 'cost': 0.0}
+        self._lock = threading.Lock()
+        # 指标文件的写入按顺序进行，后写入的总是较新的指标
+        self._prom_lock = threading.Lock()
+
+    def record(self, trace):
+        """记录一轮已结束的问答"""
+        if trace.duration is None:
+            trace.finish()
+        data = trace.to_dict()
+        with self._lock:
+            self.traces.append(data)
+            source = data['meta'].get('source', 'unknown')
+            self._turns.setdefault(source, _Histogram()).observe(data['duration'])
+            for span in data['spans']:
+                self._spans.setdefault(span['name'], _Histogram()).observe(span['duration'])
+            self._counters['prompt'] += data['prompt_tokens']
+            self._counters['completion'] += data['completion_tokens']
+            self._counters['cost'] += data['cost']
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(data, ensure_ascii=False, default=str) + '\n')
+        if self.prom_path:
+            with self._prom_lock:
+                # 先写临时文件再替换，采集方不会读到写了一半的文件；临时文件名区分进程，多个进程可写同一指标文件
+                tmp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(self.prometheus_text())
+                os.replace(tmp_path, self.prom_path)
+
+    def recent(self, n=20):
+        with self._lock:
+            return list(self.traces)[-n:]
+
+    def prometheus_text(self):
+        """Prometheus文本格式的指标"""
+        lines = []
+        with self._lock:
+            for metric, label, histograms, help_text in (
+                ('agent_turn_duration_seconds', 'source', self._turns, '每轮问答的总耗时'),
+                ('agent_span_duration_seconds', 'span', self._spans, '各阶段耗时'),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for value, hist in histograms.items():
+                    for bound, count in zip(DURATION_BUCKETS, hist.buckets):
+                        lines.append(f"{metric}_bucket{_labels(**{label: value, 'le': bound})} {count}")
+                    lines.append(f"{metric}_bucket{_labels(**{label: value, 'le': '+Inf'})} {hist.count}")
+                    lines.append(f"{metric}_sum{_labels(**{label: value})} {hist.sum:.6f}")
+                    lines.append(f"{metric}_count{_labels(**{label: value})} {hist.count}")
+            lines.append("# HELP agent_tokens_total 模型调用的token数")
+            lines.append("# TYPE agent_tokens_total counter")
+            lines.append(f"agent_tokens_total{_labels(type='prompt')} {self._counters['prompt']}")
+            lines.append(f"agent_tokens_total{_labels(type='completion')} {self._counters['completion']}")
+            lines.append("# HELP agent_cost_total 估算的模型调用费用")
+            lines.append("# TYPE agent_cost_total counter")
+            lines.append(f"agent_cost_total {self._counters['cost']:.6f}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port):
+        """在后台线程中提供 /metrics 接口"""
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_telemetry():
+    """获取全局共享的记录器，配置了端口时首次使用启动指标接口"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = TelemetryRecorder()
+            if TELEMETRY_PROM_PORT:
+                _recorder.serve(TELEMETRY_PROM_PORT)
+        return _recorder
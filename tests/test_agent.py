@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('langchain_experimental')
+from benchmark_suite import MockLLMServer  # noqa: E402
+from llm_clients import get_chat_model  # noqa: E402
+from utils import build_agent, dataframe_agent  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def mock_model():
+    with MockLLMServer() as server:
+        yield get_chat_model('gpt-4o-mini', server.base_url, 'sk-test', temperature=0)
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'积分分值': [100.0, 110.0], '单位名称': ['甲', '乙']})
+
+
+def test_build_agent_returns_intermediate_steps(df, mock_model):
+    agent = build_agent(df, mock_model)
+    assert agent.return_intermediate_steps
+
+
+def test_agent_turn_against_mock_server(df, mock_model):
+    stats = {}
+    result = dataframe_agent(df, "积分分值的平均值是多少", mock_model, fast_path=False, stats=stats)
+    assert result == {"answer": "积分分值的平均值约为101.76"}
+    assert stats['source'] == 'agent'
+    assert stats['iterations'] == 1
+
+
+def test_streamed_agent_turn_against_mock_server(df, mock_model):
+    events = list(dataframe_agent(df, "积分分值的平均值是多少", mock_model, stream=True, fast_path=False))
+    assert events[-1] == ('result', {"answer": "积分分值的平均值约为101.76"})
+    assert any(kind == 'action' for kind, _ in events)
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('streamlit')
+from agent_jobs import AgentJobPool  # noqa: E402
+
+
+def _slow_run(release, answer):
+    """模拟一次耗时的模型调用：取消只在调用返回后生效"""
+    def run(cancel):
+        release.wait(5)
+        if cancel.is_set():
+            return
+        yield 'action', answer
+        yield 'result', {"answer": answer}
+    return run
+
+
+@pytest.fixture
+def pool():
+    pool = AgentJobPool(max_workers=1, max_queue=4, jobs_per_session=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_submit_runs_job(pool):
+    release = threading.Event()
+    release.set()
+    job = pool.submit('s', _slow_run(release, '第一个'))
+    assert job.wait(5)
+    assert job.status == 'done'
+    assert job.result == {"answer": '第一个'}
+    assert job.events == [('action', '第一个')]
+
+
+def test_resubmit_does_not_wait_for_cancelled_job(pool):
+    release = threading.Event()
+    first = pool.submit('s', _slow_run(release, '第一个'))
+    while first.status != 'running':
+        time.sleep(0.01)
+    start = time.monotonic()
+    second = pool.submit('s', _slow_run(release, '第二个'))
+    assert time.monotonic() - start < 1
+    assert first.cancelled and not first.done()
+    # 唯一的工作线程仍被旧任务占用，新任务排在其后
+    assert second.status == 'queued'
+    release.set()
+    assert second.wait(5)
+    assert first.status == 'cancelled'
+    assert second.result == {"answer": '第二个'}
+
+
+def test_cancel_queued_job(pool):
+    release = threading.Event()
+    first = pool.submit('a', _slow_run(release, '第一个'))
+    queued = pool.submit('b', _slow_run(release, '第二个'))
+    queued.cancel()
+    assert queued.wait(0) and queued.status == 'cancelled'
+    release.set()
+    assert first.wait(5) and first.status == 'done'
+    assert pool.stats()['cancelled'] == 1
+
+
+def test_limits(pool):
+    release = threading.Event()
+    pool.submit('s', _slow_run(release, '第一个'))
+    with pytest.raises(RuntimeError):
+        pool.submit('s', _slow_run(release, '第二个'), cancel_previous=False)
+    for i in range(4):
+        pool.submit(f"other{i}", _slow_run(release, str(i)))
+    with pytest.raises(RuntimeError):
+        pool.submit('other', _slow_run(release, '排队已满'))
+    release.set()
+
+
+def test_sessions_run_concurrently_up_to_worker_count():
+    pool = AgentJobPool(max_workers=2, max_queue=4, jobs_per_session=1)
+    release = threading.Event()
+    try:
+        jobs = [pool.submit(f"会话{i}", _slow_run(release, str(i))) for i in range(3)]
+        while sum(job.status == 'running' for job in jobs) < 2:
+            time.sleep(0.01)
+        stats = pool.stats()
+        assert (stats['running'], stats['queued']) == (2, 1)
+        release.set()
+        assert all(job.wait(5) for job in jobs)
+        assert [job.result for job in jobs] == [{"answer": str(i)} for i in range(3)]
+        assert pool.stats()['done'] == 3
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_failed_job_keeps_error(pool):
+    def run(cancel):
+        yield 'action', '读取数据'
+        raise ValueError("数据有误")
+
+    job = pool.submit('s', run)
+    assert job.wait(5)
+    assert job.status == 'failed'
+    assert isinstance(job.error, ValueError)
+    assert job.events == [('action', '读取数据')]
+    assert pool.stats()['failed'] == 1
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from answer_cache import AnswerCache
+
+
+class StubEmbedder:
+    """按预设的向量返回结果，未登记的问题返回与其他向量都正交的向量"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self.vectors.get(text, [0.0, 0.0, 0.0, 1.0])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def embedder():
+    return StubEmbedder({
+        "积分最高的前10个单位": [1.0, 0.0, 0.0, 0.0],
+        "积分最高的前十个单位": [0.99, 0.1, 0.0, 0.0],
+        "积分最高的前10名": [0.8, 0.6, 0.0, 0.0],
+        # 与上面的问题向量几乎相同，但数字或方向不同
+        "积分最高的前5个单位": [0.99, 0.1, 0.0, 0.0],
+        "积分最低的前10个单位": [0.99, 0.1, 0.0, 0.0],
+        "积分不是最高的前10个单位": [0.99, 0.1, 0.0, 0.0],
+        "积分大于120的有多少人": [0.0, 1.0, 0.0, 0.0],
+        "积分小于120的有多少人": [0.0, 0.99, 0.1, 0.0],
+        "积分大于130的有多少人": [0.0, 0.99, 0.1, 0.0],
+    })
+
+
+def test_hit_for_similar_question(embedder):
+    cache = AnswerCache(embedder, threshold=0.95)
+    result = {"table": {"columns": ["单位名称"], "data": [["华为"]]}}
+    cache.store("v1", "积分最高的前10个单位", result)
+    cached, embedding = cache.lookup("v1", "积分最高的前十个单位")
+    assert cached == result
+    assert embedding.shape == (4,)
+    assert np.isclose(np.linalg.norm(embedding), 1.0)
+
+
+def test_miss_for_other_version_or_question(embedder):
+    cache = AnswerCache(embedder)
+    cache.store("v1", "积分最高的前10个单位", {"answer": "a"})
+    assert cache.lookup("v2", "积分最高的前10个单位")[0] is None
+    assert cache.lookup("v1", "数据有多少行")[0] is None
+
+
+def test_threshold(embedder):
+    cache = AnswerCache(embedder, threshold=0.95)
+    cache.store("v1", "积分最高的前10个单位", {"answer": "a"})
+    # 余弦相似度0.8，低于阈值
+    assert cache.lookup("v1", "积分最高的前10名")[0] is None
+    cache.threshold = 0.75
+    assert cache.lookup("v1", "积分最高的前10名")[0] == {"answer": "a"}
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ("积分最高的前10个单位", "积分最高的前5个单位"),
+    ("积分最高的前10个单位", "积分最低的前10个单位"),
+    ("积分最高的前10个单位", "积分不是最高的前10个单位"),
+    ("积分大于120的有多少人", "积分小于120的有多少人"),
+    ("积分大于120的有多少人", "积分大于130的有多少人"),
+])
+def test_miss_for_other_numbers_or_polarity(embedder, stored, asked):
+    cache = AnswerCache(embedder, threshold=0.95)
+    cache.store("v1", stored, {"answer": "a"})
+    assert cache.lookup("v1", asked)[0] is None
+
+
+def test_lookup_embedding_is_reused_by_store(embedder):
+    cache = AnswerCache(embedder)
+    _, embedding = cache.lookup("v1", "积分最高的前10个单位")
+    cache.store("v1", "积分最高的前10个单位", {"answer": "a"}, embedding=embedding)
+    assert embedder.calls == 1
+
+
+def test_invalidate_version_and_workspace_keys(embedder):
+    cache = AnswerCache(embedder)
+    cache.store("v1", "积分最高的前10个单位", {"answer": "a"})
+    cache.store("v1|ws", "积分最高的前10个单位", {"answer": "b"})
+    cache.store("v10", "积分最高的前10个单位", {"answer": "c"})
+    cache.invalidate("v1")
+    assert cache.lookup("v1", "积分最高的前10个单位")[0] is None
+    assert cache.lookup("v1|ws", "积分最高的前10个单位")[0] is None
+    assert cache.lookup("v10", "积分最高的前10个单位")[0] == {"answer": "c"}
+
+
+def test_ttl_and_lru(embedder):
+    clock = FakeClock()
+    cache = AnswerCache(embedder, ttl=10, max_entries=2, clock=clock)
+    cache.store("v1", "积分最高的前10个单位", {"answer": "a"})
+    clock.now = 11
+    assert cache.lookup("v1", "积分最高的前10个单位")[0] is None
+    for version in ("v1", "v2", "v3"):
+        cache.store(version, "积分最高的前10个单位", {"answer": version})
+    assert len(cache) == 2
+    assert cache.lookup("v1", "积分最高的前10个单位")[0] is None
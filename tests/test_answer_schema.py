@@ -0,0 +1,78 @@
+import pytest
+
+from answer_schema import AgentAnswer, AnswerParseError, parse_answer, repair_json
+
+
+class StubStructured:
+    """模拟with_structured_output返回的可调用对象，记录调用参数"""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def invoke(self, prompt, config=None):
+        self.llm.calls.append((prompt, config))
+        return AgentAnswer.model_validate(self.llm.answer)
+
+
+class StubLLM:
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = []
+
+    def with_structured_output(self, schema):
+        assert schema is AgentAnswer
+        return StubStructured(self)
+
+
+@pytest.mark.parametrize('output, expected', [
+    ('```json\n{"answer": "共6000行"}\n```', {"answer": "共6000行"}),
+    ('结果如下：{"answer": "共6000行"} 以上', {"answer": "共6000行"}),
+    ('{"table": {"columns": ["单位"], "data": [["华为"], ["百度"]]', {"table": {"columns": ["单位"], "data": [["华为"], ["百度"]]}}),
+    ('{"pie": {"labels": ["甲", "乙"], "values": [1, 2],},}', {"pie": {"labels": ["甲", "乙"], "values": [1, 2]}}),
+    ("{'answer': '平均积分为101.76'}", {"answer": "平均积分为101.76"}),
+    ('{“answer”: “共6000行”}', {"answer": "共6000行"}),
+])
+def test_local_repair(output, expected):
+    assert parse_answer(output) == expected
+
+
+def test_plain_text_answer():
+    assert parse_answer("平均积分为101.76") == {"answer": "平均积分为101.76"}
+
+
+def test_repair_json_returns_none_for_non_objects():
+    assert repair_json("[1, 2, 3]") is None
+    assert repair_json("") is None
+
+
+@pytest.mark.parametrize('output', [
+    '{"bar": {"x": ["甲", "乙", "丙"], "y": [1, 2]}}',
+    '{"line": {"x": [1, 2], "y": [[1, 2], [3]], "groups": ["甲", "乙"]}}',
+    '{"pie": {"labels": ["甲"], "values": [1, 2]}}',
+    '{"table": {"columns": ["单位", "人数"], "data": [["华为"]]}}',
+    '{"boxplot": {"title": "分布"}}',
+])
+def test_malformed_payload_is_rejected(output):
+    with pytest.raises(AnswerParseError):
+        parse_answer(output)
+
+
+def test_malformed_payload_uses_structured_output_with_callbacks():
+    fixed = {"bar": {"x": ["甲", "乙"], "y": [1.0, 2.0]}}
+    llm = StubLLM(fixed)
+    callbacks = [object()]
+    assert parse_answer('{"bar": {"x": ["甲", "乙", "丙"], "y": [1, 2]}}', llm=llm, callbacks=callbacks) == fixed
+    assert len(llm.calls) == 1
+    assert llm.calls[0][1] == {'callbacks': callbacks}
+
+
+def test_valid_payload_skips_structured_output():
+    llm = StubLLM({"answer": "不应调用"})
+    output = '{"line": {"x": [1, 2], "y": [[1, 2], [3, 4]], "groups": ["甲", "乙"]}}'
+    assert parse_answer(output, llm=llm)["line"]["groups"] == ["甲", "乙"]
+    assert not llm.calls
+
+
+def test_agent_stopped():
+    with pytest.raises(AnswerParseError):
+        parse_answer("Agent stopped due to iteration limit or time limit.")
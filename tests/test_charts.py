@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('langchain_experimental')
+import utils  # noqa: E402
+from utils import (FigureCache, build_chart_figure, chart_cache_key, chart_is_downsampled, figure_cache,  # noqa: E402
+                   lttb_indices)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    figure_cache.clear()
+    yield
+    figure_cache.clear()
+
+
+def test_figure_cache_lru():
+    cache = FigureCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_same_chart_data_is_built_once():
+    fig = build_chart_figure({"x": ["甲", "乙"], "y": [1, 2], "title": "人数"}, 'bar')
+    # 内容相同的另一份数据命中同一个缓存条目
+    assert build_chart_figure({"title": "人数", "x": ["甲", "乙"], "y": [1, 2]}, 'bar') is fig
+    assert build_chart_figure({"x": ["甲", "乙"], "y": [1, 3], "title": "人数"}, 'bar') is not fig
+
+
+def test_full_resolution_is_cached_separately():
+    data = {"x": list(range(10)), "y": list(range(10))}
+    assert chart_cache_key(data, 'line') != chart_cache_key(data, 'line', full_resolution=True)
+    assert chart_cache_key(data, 'line') != chart_cache_key(data, 'scatter')
+    downsampled = build_chart_figure(data, 'line')
+    full = build_chart_figure(data, 'line', full_resolution=True)
+    assert full is not downsampled
+    assert build_chart_figure(data, 'line', full_resolution=True) is full
+
+
+def test_unsupported_chart_type():
+    with pytest.raises(ValueError):
+        build_chart_figure({"x": [1], "y": [1]}, 'radar')
+
+
+def test_lttb_keeps_endpoints_and_point_budget():
+    x = np.arange(10_000, dtype=float)
+    y = np.sin(x / 100)
+    indices = lttb_indices(x, y, 500)
+    assert len(indices) == 500
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert (np.diff(indices) > 0).all()
+
+
+def test_lttb_keeps_spikes():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[437] = 100
+    assert 437 in lttb_indices(x, y, 50)
+
+
+def test_lttb_returns_all_points_under_budget():
+    x = np.arange(10, dtype=float)
+    assert lttb_indices(x, x, 20).tolist() == list(range(10))
+
+
+def test_large_line_is_downsampled(monkeypatch):
+    monkeypatch.setattr(utils, 'LINE_MAX_POINTS', 100)
+    data = {"x": list(range(1000)), "y": np.random.default_rng(0).standard_normal(1000).cumsum().tolist()}
+    assert chart_is_downsampled(data, 'line')
+    assert len(build_chart_figure(data, 'line').data[0].y) == 100
+    assert len(build_chart_figure(data, 'line', full_resolution=True).data[0].y) == 1000
+
+
+def test_large_scatter_is_binned(monkeypatch):
+    monkeypatch.setattr(utils, 'SCATTER_BIN_POINTS', 100)
+    rng = np.random.default_rng(0)
+    data = {"x": rng.standard_normal(1000).tolist(), "y": rng.standard_normal(1000).tolist()}
+    assert chart_is_downsampled(data, 'scatter')
+    assert build_chart_figure(data, 'scatter').data[0].type == 'histogram2d'
+    assert build_chart_figure(data, 'scatter', full_resolution=True).data[0].type != 'histogram2d'
+    # 分组散点图不分箱
+    grouped = dict(data, groups=['甲', '乙'] * 500)
+    assert not chart_is_downsampled(grouped, 'scatter')
+
+
+def test_large_heatmap_is_aggregated(monkeypatch):
+    monkeypatch.setattr(utils, 'HEATMAP_MAX_CELLS', 100)
+    data = {"data": np.ones((40, 30)).tolist(), "x_labels": list(range(30)), "y_labels": list(range(40))}
+    assert chart_is_downsampled(data, 'heatmap')
+    trace = build_chart_figure(data, 'heatmap').data[0]
+    assert np.asarray(trace.z).shape == (10, 8)
+    assert len(trace.x) == 8 and len(trace.y) == 10
@@ -0,0 +1,24 @@
+import pytest
+
+chat_render = pytest.importorskip('chat_render')
+
+
+def test_table_html_keeps_missing_cells():
+    table = {"columns": ["名称", "数值"], "data": [["a", None], [float('nan'), 3.0]]}
+    html = chat_render.table_html(table)
+    assert '<tr><td>a</td><td></td></tr>' in html
+    assert '<tr><td></td><td>3.0</td></tr>' in html
+
+
+def test_table_html_escapes_cells():
+    table = {"columns": ["<列>"], "data": [["<b>&"]]}
+    html = chat_render.table_html(table)
+    assert '<th>&lt;列&gt;</th>' in html
+    assert '<td>&lt;b&gt;&amp;</td>' in html
+
+
+def test_table_html_paginates():
+    table = {"columns": ["序号"], "data": [[i] for i in range(chat_render.TABLE_PAGE_ROWS + 1)]}
+    html = chat_render.table_html(table, page=1)
+    assert html.count('<tr>') == 2
+    assert f"第2/2页，共{chat_render.TABLE_PAGE_ROWS + 1}行" in html
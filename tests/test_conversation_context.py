@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('langchain_experimental')
+from utils import CONTEXT_RECENT_ENTRIES, build_conversation_context, count_tokens  # noqa: E402
+
+
+def _history(turns, length=20):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"问题{i}" + "问" * length})
+        history.append({"role": "assistant", "content": f"回答{i}" + "答" * length})
+    return history
+
+
+def test_short_history_is_kept_verbatim():
+    history = _history(2)
+    context = build_conversation_context(history)
+    assert "早前对话摘要" not in context
+    for entry in history:
+        assert f"{entry['role']}: {entry['content']}\n" in context
+    assert context.endswith("### 当前请求:\n")
+
+
+@pytest.mark.parametrize('budget', [200, 500, 1500])
+def test_context_stays_within_budget(budget):
+    context = build_conversation_context(_history(40, length=200), token_budget=budget)
+    # 标题不计入预算
+    body = context.split("### 对话历史:\n", 1)[1].rsplit("\n### 当前请求:", 1)[0]
+    assert count_tokens(body) <= budget + count_tokens("早前对话摘要: \n")
+
+
+def test_repeated_system_notes_are_deduplicated():
+    note = {"role": "system", "content": "用户上传了文件: 数据.csv"}
+    history = [note, {"role": "user", "content": "有多少行"}, note, {"role": "assistant", "content": "6000行"}]
+    context = build_conversation_context(history)
+    assert context.count(note["content"]) == 1
+    assert context.index("有多少行") < context.index(note["content"]) < context.index("6000行")
+
+
+def test_older_turns_are_summarized_newest_first():
+    history = _history(CONTEXT_RECENT_ENTRIES)
+    context = build_conversation_context(history)
+    summary = context.split("早前对话摘要: ", 1)[1].split("\n", 1)[0]
+    assert "问题0" in summary
+    assert "问题9" not in summary
+    # 预算不足时先丢弃最早的摘要
+    tight = build_conversation_context(history, token_budget=300)
+    if "早前对话摘要" in tight:
+        assert "问题0" not in tight.split("早前对话摘要: ", 1)[1].split("\n", 1)[0]
+    assert "问题9" in tight
@@ -0,0 +1,82 @@
+import io
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+import data_loader  # noqa: E402
+
+
+def _csv(df):
+    return df.to_csv(index=False).encode('utf-8')
+
+
+def test_float_precision_is_kept():
+    data = _csv(pd.DataFrame({'积分分值': [140.05, 134.29], '人数': [1.0, 2.0]}))
+    df = data_loader.read_csv_chunked(io.BytesIO(data))
+    assert df['积分分值'].dtype == 'float64'
+    assert df['积分分值'].tolist() == [140.05, 134.29]
+    # 无损时仍然降精度
+    assert df['人数'].dtype == 'float32'
+
+
+def test_integers_are_not_downcast():
+    df = data_loader.read_csv_chunked(io.BytesIO(_csv(pd.DataFrame({'编号': [1, 2, 3]}))))
+    assert df['编号'].dtype == 'int64'
+
+
+def test_progress_follows_parsed_rows(monkeypatch):
+    monkeypatch.setattr(data_loader, 'CSV_CHUNK_ROWS', 100)
+    data = _csv(pd.DataFrame({'序号': range(1000), '名称': ['abc'] * 1000}))
+    progress = []
+    data_loader.read_csv_chunked(io.BytesIO(data), total_bytes=len(data), on_progress=progress.append)
+    assert progress[0] < 0.2
+    assert progress == sorted(progress)
+    assert progress[-1] == 1.0
+
+
+def test_sampling_keeps_file_order(monkeypatch):
+    monkeypatch.setattr(data_loader, 'CSV_CHUNK_ROWS', 100)
+    data = _csv(pd.DataFrame({'序号': range(1000), '名称': ['abc'] * 1000}))
+    df = data_loader.read_csv_chunked(io.BytesIO(data), memory_budget=2_000)
+    assert df.attrs['sample_ratio'] < 1.0
+    assert df['序号'].is_monotonic_increasing
+
+
+def test_spill_path_includes_format_version(monkeypatch):
+    path = data_loader.spill_path('key')
+    monkeypatch.setattr(data_loader, 'SPILL_FORMAT_VERSION', data_loader.SPILL_FORMAT_VERSION + 1)
+    assert data_loader.spill_path('key') != path
+
+
+def test_discard_releases_cached_bytes():
+    cache = data_loader.DatasetCache()
+    cache.put('a', pd.DataFrame({'x': range(100)}))
+    held = cache.get('a')
+    cache.discard('a')
+    cache.discard('a')
+    assert cache.get('a') is None
+    assert cache.total_bytes == 0
+    assert held['x'].sum() == 4950
+
+
+@pytest.mark.parametrize('values', [['001', 'A12', '7', 3], [1, 'x', 2.5, None]])
+def test_mixed_type_columns_stay_in_memory(monkeypatch, tmp_path, values):
+    monkeypatch.setattr(data_loader, 'DATA_DIR', str(tmp_path))
+    frame = pd.DataFrame({'编号': values, '人数': range(4)})
+    df = data_loader.ingest('mixed', lambda: frame)
+    assert df['编号'].tolist()[:3] == values[:3]
+    assert data_loader.ensure_columnar('mixed', frame) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_unparseable_dates_after_sample_stay_text(monkeypatch):
+    monkeypatch.setattr(data_loader, 'DTYPE_SAMPLE_ROWS', 10)
+    monkeypatch.setattr(data_loader, 'CSV_CHUNK_ROWS', 10)
+    months = [f"19{70 + i % 30}-{i % 12 + 1:02d}" for i in range(40)]
+    data = _csv(pd.DataFrame({'出生年月': months[:35] + ['不详'] + months[36:], '入职日期': months}))
+    df = data_loader.read_csv_chunked(io.BytesIO(data))
+    assert not pd.api.types.is_datetime64_any_dtype(df['出生年月'])
+    assert df['出生年月'].tolist()[35] == '不详'
+    assert df['出生年月'].notna().all()
+    assert pd.api.types.is_datetime64_any_dtype(df['入职日期'])
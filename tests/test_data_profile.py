@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+from data_profile import DataProfile  # noqa: E402
+
+
+def test_schema_digest_uses_short_dtype_names():
+    df = pd.DataFrame({
+        '人数': [1, 2], '分值': [1.5, 2.5], '日期': pd.to_datetime(['2024-01-01', '2024-01-02']),
+        '名称': ['甲', '乙'], '类别': pd.Categorical(['a', 'b']),
+    })
+    digests = [DataProfile.from_dataframe(df).schema_digest(),
+               DataProfile.from_dataframe(df.convert_dtypes(dtype_backend='pyarrow')).schema_digest()]
+    for digest in digests:
+        assert '[pyarrow]' not in digest
+        for col, name in [('人数', 'int'), ('分值', 'float'), ('日期', 'datetime'), ('名称', 'str'), ('类别', 'category')]:
+            assert f"{col}({name})" in digest
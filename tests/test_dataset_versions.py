@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+from dataset_versions import DatasetVersion, VersionStore, _fillna  # noqa: E402
+
+
+def test_fillna_skips_all_null_columns():
+    df = pd.DataFrame({'分数': [1.0, None], '备注': [None, None], '类别': ['甲', None]}).astype({'备注': object})
+    out = _fillna(df, ['分数', '备注', '类别'])
+    assert out['分数'].tolist() == [1.0, 1.0]
+    assert out['备注'].isna().all()
+    assert out['类别'].tolist() == ['甲', '甲']
+    # 上一版本不受影响
+    assert df['类别'].isna().sum() == 1
+
+
+def test_materialize_returns_isolated_copies():
+    base = pd.DataFrame({'分数': [1.0, None, 3.0], '类别': ['甲', None, '乙']})
+    store = VersionStore()
+    version = DatasetVersion('base').then('fillna', columns=['分数'])
+    df = store.materialize(version, lambda: base.copy(deep=False))
+    df.loc[0, '分数'] = 100.0
+    df['新列'] = 1
+    again = store.materialize(version, lambda: base.copy(deep=False))
+    assert again['分数'].tolist() == [1.0, 2.0, 3.0]
+    assert '新列' not in again.columns
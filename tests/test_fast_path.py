@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+import pytest
+
+from fast_path import try_fast_path
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '2023年北京积分落户数据.csv')
+
+
+@pytest.fixture(scope='module')
+def df():
+    return pd.read_csv(CSV_PATH)
+
+
+@pytest.mark.parametrize('question', [
+    # 筛选词不是列名，不能丢掉后按全表计算
+    "男性平均积分",
+    "女性平均积分",
+    "华为平均积分",
+    "其中平均积分",
+    # 复合比较符只识别出一半
+    "积分分值小于等于110的有多少人",
+    # 多个条件只应用第一个
+    "积分分值大于120且小于130的有多少人",
+    "积分分值大于120或小于100的有多少人",
+    # 否定
+    "积分不是最高的前3个单位",
+    "除了华为以外各单位的人数",
+    # 前N名之外还有计数、分组或聚合的要求
+    "积分最高的前5个单位的人数",
+    "积分最高的前5个单位各有多少人",
+    "各单位积分最高的前3人",
+    "每个单位积分最高的前3名",
+    "积分最高的前10个单位的平均积分",
+    "积分最高的前十名的平均积分",
+])
+def test_near_misses_fall_back_to_agent(df, question):
+    assert try_fast_path(df, question) is None
+
+
+@pytest.mark.parametrize('question', ["那女性呢", "那平均积分呢", "其中积分最高的前3个单位", "再看平均积分"])
+def test_follow_up_questions_fall_back_to_agent(df, question):
+    history = [{"role": "user", "content": "男性有多少人"}, {"role": "assistant", "content": "共3000人"}]
+    assert try_fast_path(df, question, history) is None
+
+
+def test_self_contained_question_with_history(df):
+    history = [{"role": "system", "content": "已上传文件"}, {"role": "user", "content": "数据有多少行"}]
+    result = try_fast_path(df, "积分分值的平均值是多少", history)
+    assert result == {"answer": f"积分分值的平均值为{df['积分分值'].mean():.2f}。"}
+
+
+def test_simple_aggregate(df):
+    assert try_fast_path(df, "平均积分是多少") == {"answer": f"积分分值的平均值为{df['积分分值'].mean():.2f}。"}
+
+
+def test_filter_count(df):
+    count = int((df['积分分值'] > 120).sum())
+    assert try_fast_path(df, "积分分值大于120的有多少人") == {"answer": f"积分分值大于120的记录共{count}条。"}
+    assert try_fast_path(df, "积分不低于120的有多少人")["answer"].startswith("积分分值不低于120")
+
+
+def test_group_count_chart(df):
+    result = try_fast_path(df, "各单位人数画成饼图")
+    counts = df['单位名称'].value_counts()
+    assert result["pie"]["labels"][0] == counts.index[0]
+    assert result["pie"]["values"][0] == counts.iloc[0]
+
+
+def test_top_n(df):
+    result = try_fast_path(df, "积分最高的前3人")
+    assert [row[-1] for row in result["table"]["data"]] == df['积分分值'].nlargest(3).tolist()
@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('langchain_core')
+pa = pytest.importorskip('pyarrow')
+from sandbox import SandboxPool  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def dataset_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('sandbox') / 'data.arrow')
+    table = pa.Table.from_pandas(pd.DataFrame({'积分': [100.0, 110.0, 120.0]}), preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(size=1, wall_seconds=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_variables_persist_within_context(pool, dataset_path):
+    assert pool.execute(dataset_path, 'a', "total = df['积分'].sum()\ntotal") == '330.0'
+    assert pool.execute(dataset_path, 'a', "total + 1") == '331.0'
+    assert pool.execute(dataset_path, 'b', "total").startswith('NameError')
+
+
+def test_in_place_changes_stay_in_context(pool, dataset_path):
+    pool.execute(dataset_path, 'a', "df.loc[0, '积分'] = 0.0")
+    assert pool.execute(dataset_path, 'a', "df['积分'].sum()") == '230.0'
+    assert pool.execute(dataset_path, 'b', "df['积分'].sum()") == '330.0'
+
+
+def test_timeout_restarts_worker(pool, dataset_path):
+    assert pool.execute(dataset_path, 'a', "while True:\n    pass").startswith('TimeoutError')
+    # 工作进程已重启，之前的变量不再保留，但可以继续执行
+    assert pool.execute(dataset_path, 'a', "len(df)") == '3'
+
+
+def test_missing_dataset_returns_error(pool, tmp_path):
+    assert pool.execute(str(tmp_path / 'missing.arrow'), 'a', "len(df)").startswith('FileNotFoundError')
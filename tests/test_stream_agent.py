@@ -0,0 +1,84 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('langchain_experimental')
+from sandbox import execution_context  # noqa: E402
+from utils import _stream_agent  # noqa: E402
+
+
+class FakeAgent:
+    """
+    按AgentExecutor.stream的格式回放若干步，每步前后触发模型和工具回调
+    提供gate时，第二步起每次调用模型前等待gate，模拟耗时的模型调用
+    """
+
+    def __init__(self, steps=3, gate=None):
+        self.steps = steps
+        self.gate = gate
+        self.model_calls = 0
+        self.contexts = []
+        self.finished = threading.Event()
+
+    def stream(self, inputs, config):
+        handlers = config['callbacks']
+        try:
+            for i in range(self.steps):
+                if i and self.gate is not None:
+                    self.gate.acquire(timeout=5)
+                for handler in handlers:
+                    handler.on_chat_model_start({}, [])
+                self.model_calls += 1
+                self.contexts.append(execution_context.get())
+                for handler in handlers:
+                    handler.on_llm_new_token(f"思考{i}")
+                yield {'actions': [SimpleNamespace(log=f"行动{i}")]}
+                for handler in handlers:
+                    handler.on_tool_start({}, f"代码{i}")
+                yield {'steps': [SimpleNamespace(observation=f"结果{i}")]}
+            yield {'output': '{"answer": "完成"}'}
+        finally:
+            self.finished.set()
+
+
+def test_events_in_order_with_context():
+    agent = FakeAgent(steps=2)
+    events = list(_stream_agent(agent, "问题", context_id='session-1'))
+    assert events == [
+        ('token', '思考0'), ('action', '行动0'), ('observation', '结果0'),
+        ('token', '思考1'), ('action', '行动1'), ('observation', '结果1'),
+        ('output', '{"answer": "完成"}'),
+    ]
+    assert agent.contexts == ['session-1', 'session-1']
+
+
+def test_closing_generator_stops_agent():
+    gate = threading.Semaphore(0)
+    agent = FakeAgent(steps=5, gate=gate)
+    events = _stream_agent(agent, "问题")
+    for kind, _ in events:
+        if kind == 'action':
+            break
+    # 关闭后模型调用才返回
+    threading.Timer(0.1, gate.release).start()
+    events.close()
+    # 关闭时等待后台线程结束，智能体不再调用模型
+    assert agent.finished.is_set()
+    assert agent.model_calls == 1
+
+
+def test_cancel_event_stops_agent_without_output():
+    gate = threading.Semaphore(0)
+    agent = FakeAgent(steps=5, gate=gate)
+    cancel = threading.Event()
+    kinds = []
+    for kind, _ in _stream_agent(agent, "问题", cancel=cancel):
+        kinds.append(kind)
+        if kind == 'observation':
+            cancel.set()
+            gate.release()
+    assert 'output' not in kinds
+    assert agent.finished.is_set()
+    assert agent.model_calls == 1
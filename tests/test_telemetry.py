@@ -0,0 +1,29 @@
+import threading
+
+import pytest
+
+pytest.importorskip('langchain_core')
+from telemetry import TelemetryRecorder, TurnTrace  # noqa: E402
+
+
+def test_concurrent_records_write_complete_prometheus_file(tmp_path):
+    prom_path = tmp_path / 'agent.prom'
+    recorder = TelemetryRecorder(jsonl_path='', prom_path=str(prom_path))
+
+    def record(i):
+        trace = TurnTrace(f"问题{i}")
+        with trace.span('agent'):
+            pass
+        trace.meta['source'] = 'agent'
+        trace.add_tokens(10, 5)
+        recorder.record(trace)
+
+    threads = [threading.Thread(target=record, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert prom_path.read_text(encoding='utf-8') == recorder.prometheus_text()
+    assert 'agent_turn_duration_seconds_count{source="agent"} 16' in recorder.prometheus_text()
+    assert [p.name for p in tmp_path.iterdir()] == ['agent.prom']
@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('langchain_core')
+import data_loader  # noqa: E402
+import workspace as workspace_module  # noqa: E402
+from workspace import Workspace  # noqa: E402
+
+
+class UploadedFile:
+    """与st.file_uploader返回的对象接口一致"""
+
+    def __init__(self, name, df):
+        self.name = name
+        self._data = df.to_csv(index=False).encode('utf-8')
+        self.size = len(self._data)
+        self.file_id = name
+
+    def getvalue(self):
+        return self._data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = data_loader.DatasetCache()
+    monkeypatch.setattr(data_loader, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(data_loader, 'get_dataset_cache', lambda: cache)
+    monkeypatch.setattr(workspace_module, 'get_dataset_cache', lambda: cache)
+    monkeypatch.setattr(workspace_module, 'upload_hash', lambda f: data_loader.content_hash(f.getvalue()))
+    return cache
+
+
+def _files():
+    return [
+        UploadedFile('a.csv', pd.DataFrame({'编号': range(100), '积分': [1.0] * 100})),
+        UploadedFile('data.csv', pd.DataFrame({'编号': range(100), '单位': ['甲'] * 100})),
+    ]
+
+
+def test_tables_load_lazily(cache):
+    ws = Workspace()
+    assert ws.sync(_files()) == ['a', 'data']
+    assert not any(ws.entry(name).loaded for name in ws.names())
+    assert len(ws.tables()['data']) == 100
+    assert ws.entry('data').loaded and not ws.entry('a').loaded
+    with pytest.raises(KeyError):
+        ws.tables()['b']
+
+
+def test_eviction_releases_shared_cache(cache):
+    ws = Workspace(memory_budget=1)
+    ws.sync(_files())
+    ws.current = 'a'
+    ws.load('a')
+    ws.load('data')
+    # 超出预算时当前表保留在共享缓存中
+    assert ws.entry('a').loaded is False
+    assert cache.get(ws.entry('a').dataset_key) is not None
+    ws.load('a')
+    assert not ws.entry('data').loaded
+    assert cache.get(ws.entry('data').dataset_key) is None
+    # 重新引用时从列式文件重新打开
+    assert len(ws.get('data')) == 100
+
+
+def test_idle_tables_are_released(cache):
+    clock = FakeClock()
+    ws = Workspace(idle_seconds=10, clock=clock)
+    ws.sync(_files())
+    ws.load('data')
+    clock.now = 11
+    ws.load('a')
+    assert not ws.entry('data').loaded
+    assert cache.get(ws.entry('data').dataset_key) is None
+
+
+def test_references_match_whole_names(cache):
+    ws = Workspace()
+    ws.sync(_files())
+    assert ws.referenced("tables['data'].head()") == ['data']
+    assert ws.referenced('join_tables("a", "data", on="编号")') == ['a', 'data']
+    assert ws.referenced('SELECT * FROM df JOIN data USING (编号)', identifiers=True) == ['data']
+    assert ws.referenced('SELECT * FROM df JOIN data USING (编号)') == []
+    assert list(ws.resolve_paths("tables['data']")) == ['data']
@@ -1,17 +1,46 @@
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from openai import OpenAI
 from pydantic import SecretStr
 import streamlit as st
+import copy
+import hashlib
 import json
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_experimental.agents import create_pandas_dataframe_agent
+from answer_cache import AnswerCache
+from answer_schema import parse_answer
+from data_loader import ensure_columnar
+from fast_path import try_fast_path
+from llm_clients import get_chat_model, get_embeddings, get_openai_client
+from sandbox import SandboxPythonTool, execution_context
+from sql_tool import AGENT_SQL, SQLQueryTool, sql_available
+from telemetry import TraceCallbackHandler, TurnTrace
+from workspace import workspace_locals
+
+try:
+    import tiktoken
+except ImportError:  # 未安装tiktoken时按字符数估算token
+    tiktoken = None
+
+_token_encoding = None
+if tiktoken is not None:
+    try:
+        # 编码文件在首次使用时下载，离线环境中失败时同样按字符数估算
+        _token_encoding = tiktoken.get_encoding('o200k_base')
+    except Exception:
+        _token_encoding = None
 
 base_url = 'https://api.openai-hk.com/v1'
 api_key = 'hk-z8yz1o1000056196f1a2032989e330e608278c706fad5a66'
-client = OpenAI(base_url=base_url, api_key=api_key)
+# 客户端从注册表获取，共享同一个HTTP长连接池
+client = get_openai_client(base_url, api_key)
 
 
 def get_response(*, messages):
@@ -22,21 +51,23 @@ def get_response(*, messages):
     return response.choices[0].message.content
 
 
-model = ChatOpenAI(
-    model='gpt-4o-mini',
-    base_url='https://api.openai-hk.com/v1/',
-    # api_key=SecretStr('hk-z8yz1o1000056196f1a2032989e330e608278c706fad5a66'),
-    api_key=api_key,
+model = get_chat_model(
+    'gpt-4o-mini',
+    'https://api.openai-hk.com/v1/',
+    api_key,
     temperature=0.7
 )
 
 
-zp_embeddings = OpenAIEmbeddings(
-    model='embedding-3',
-    base_url='https://open.bigmodel.cn/api/paas/v4',
-    api_key=SecretStr('4630e11e632e4274a7287471d0a32d81.BPL4ctRqpJmQJo7d'),
+zp_embeddings = get_embeddings(
+    'embedding-3',
+    'https://open.bigmodel.cn/api/paas/v4',
+    SecretStr('4630e11e632e4274a7287471d0a32d81.BPL4ctRqpJmQJo7d'),
 )
 
+# 相似问题的答案缓存
+answer_cache = AnswerCache(zp_embeddings)
+
 
 PROMPT_PREFIX = """
 你是一位数据分析助手，你的回应内容取决于用户的请求内容，请按照下面的步骤处理用户请求：
@@ -128,216 +159,802 @@ Action Input: {"answer": "李白于762年去世。"}
 """
 
 
-# 添加对话历史上下文功能
-def build_conversation_context(history):
-    """构建对话上下文"""
-    context = "\n\n### 对话历史:\n"
+# 对话历史在提示词中最多占用的token数
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 1500))
 
-    # 添加最近的对话历史（最多10条消息）
-    recent_history = history[-10:]  # 取最近的10条消息
+# 原样保留的最近对话条数上限
+CONTEXT_RECENT_ENTRIES = 10
 
-    for entry in recent_history:
-        role = entry["role"]
-        content = entry["content"]
+# 原样保留的单条消息最大字符数，系统消息单独更短
+CONTEXT_ENTRY_MAX_CHARS = 300
+CONTEXT_SYSTEM_MAX_CHARS = 100
 
-        # 简化系统消息
-        if role == "system" and len(content) > 100:
-            content = content[:100] + "..."
+# 早前对话在摘要中保留的字符数
+CONTEXT_SUMMARY_ENTRY_CHARS = 30
 
-        context += f"{role}: {content}\n"
+_ROLE_NAMES = {'user': '用户', 'assistant': '助手', 'system': '系统'}
+
+
+def count_tokens(text):
+    """统计token数，未安装tiktoken时按中文每字1个、其他字符每4个1个估算"""
+    if _token_encoding is not None:
+        return len(_token_encoding.encode(text))
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
 
-    return context + "\n### 当前请求:\n"
 
+def _dedupe_system_notes(history):
+    """重复的系统提示（如多次记录的上传消息）只保留最后一次"""
+    last_index = {}
+    for i, entry in enumerate(history):
+        if entry["role"] == "system":
+            last_index[entry["content"]] = i
+    return [entry for i, entry in enumerate(history)
+            if entry["role"] != "system" or last_index[entry["content"]] == i]
 
-def dataframe_agent(df, question, openai_model, history=None):
+
+# 添加对话历史上下文功能
+def build_conversation_context(history, token_budget=CONTEXT_TOKEN_BUDGET):
     """
-    创建智能体，提问与回答 - 添加对话历史支持
-    :param df: 数据集
-    :param question: 用户问题
-    :param openai_model: OpenAI模型实例
+    构建对话上下文，控制在token预算内
+    最近的对话尽量原样保留，更早的对话压缩为滚动摘要，预算不足时先丢弃最早的内容
     :param history: 对话历史
-    :return: 响应结果
+    :param token_budget: token预算
+    :return: 对话上下文
     """
-    # 构建完整的提示词，包含对话历史
-    full_prompt = PROMPT_PREFIX
+    history = _dedupe_system_notes(history)
+
+    # 从最近的消息往前，原样保留的消息最多占用四分之三的预算
+    recent = []
+    used = 0
+    split = len(history)
+    for entry in reversed(history[-CONTEXT_RECENT_ENTRIES:]):
+        max_chars = CONTEXT_SYSTEM_MAX_CHARS if entry["role"] == "system" else CONTEXT_ENTRY_MAX_CHARS
+        line = f"{entry['role']}: {_truncate(entry['content'], max_chars)}\n"
+        tokens = count_tokens(line)
+        if recent and used + tokens > token_budget * 3 // 4:
+            break
+        recent.append(line)
+        used += tokens
+        split -= 1
+    recent.reverse()
+
+    # 更早的对话压缩为摘要，用剩余预算从新到旧保留
+    summary = []
+    for entry in reversed(history[:split]):
+        item = f"{_ROLE_NAMES.get(entry['role'], entry['role'])}: " \
+               f"{_truncate(entry['content'], CONTEXT_SUMMARY_ENTRY_CHARS)}"
+        tokens = count_tokens(item) + 1
+        if used + tokens > token_budget:
+            break
+        summary.append(item)
+        used += tokens
+    summary.reverse()
+
+    context = "\n\n### 对话历史:\n"
+    if summary:
+        context += f"早前对话摘要: {'；'.join(summary)}\n"
+    context += ''.join(recent)
+    return context + "\n### 当前请求:\n"
+
+
+# 智能体池中最多保留的智能体数量
+AGENT_POOL_MAX_ENTRIES = 32
 
-    # 如果提供了对话历史，添加到提示词中
-    if history:
-        full_prompt += build_conversation_context(history)
-    else:
-        full_prompt += "\n\n### 当前请求:\n"
 
-    full_prompt += question
+def model_config_key(openai_model):
+    """模型配置的缓存键：模型名、接口地址、温度和API密钥摘要"""
+    secret = getattr(openai_model, 'openai_api_key', None)
+    if secret is not None and hasattr(secret, 'get_secret_value'):
+        secret = secret.get_secret_value()
+    return (
+        getattr(openai_model, 'model_name', None),
+        getattr(openai_model, 'openai_api_base', None),
+        getattr(openai_model, 'temperature', None),
+        hashlib.sha256(str(secret).encode('utf-8')).hexdigest(),
+    )
+
+
+# 是否在沙箱进程中执行智能体生成的代码
+AGENT_SANDBOX = os.environ.get('AGENT_SANDBOX', '1') == '1'
+
 
+def build_agent(df, openai_model, dataset_path=None, workspace=None, sql=False):
+    """
+    创建pandas数据分析智能体
+    :param dataset_path: 数据集的列式文件路径，提供时python_repl_ast改为在沙箱进程中执行，SQL查询也直接扫描该文件
+    :param workspace: 多文件工作区，提供时代码中可以用tables、join_tables和union_tables访问其他表
+    :param sql: 是否额外提供DuckDB SQL查询工具
+    """
+    extra_tools = []
+    if sql:
+        extra_tools.append(SQLQueryTool(df=df, dataset_path=dataset_path, workspace=workspace))
     agent = create_pandas_dataframe_agent(
         llm=openai_model,
         df=df,
+        extra_tools=extra_tools,
         verbose=True,
         max_iterations=8,
         allow_dangerous_code=True,
+        # 由create_pandas_dataframe_agent传给AgentExecutor，不能再放进agent_executor_kwargs
+        return_intermediate_steps=True,
         agent_executor_kwargs={
             'handle_parsing_errors': True
         }
     )
+    if dataset_path is not None:
+        # 工具名称和描述不变，提示词无需调整；执行上下文在每轮调用时按会话设置，智能体本身不保存会话状态
+        agent.tools = [
+            SandboxPythonTool(dataset_path=dataset_path, workspace=workspace)
+            if tool.name == 'python_repl_ast' else tool
+            for tool in agent.tools
+        ]
+    elif workspace is not None:
+        for tool in agent.tools:
+            if tool.name == 'python_repl_ast':
+                tool.locals.update(workspace_locals(workspace))
+    return agent
+
+
+class AgentPool:
+    """
+    按 (数据版本, 模型配置) 复用智能体，避免每次提问都重新构建工具和提示词模板
+    数据版本变化时自然生成新的智能体，旧的按LRU淘汰
+    跨会话共享的智能体不能保存会话状态：沙箱执行的变量按会话保存在沙箱进程中，
+    进程内执行的变量保存在python_repl_ast工具中，这类智能体按会话区分
+    """
 
-    try:
-        res = agent.invoke({
-            'input': full_prompt
-        })
-        print("Agent Response:", res['output'])
-        return json.loads(res['output'])
-    except json.JSONDecodeError as e:
-        return {"answer": f"处理请求时发生错误: {str(e)}"}
+    def __init__(self, max_entries=AGENT_POOL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._agents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, df, openai_model, dataset_path=None, workspace=None, sql=False, session_id=None):
+        """
+        :param session_id: 智能体保存会话状态时传入会话ID，只在该会话内复用
+        """
+        # 带工作区的智能体只在所属会话内复用
+        key = (version, model_config_key(openai_model), dataset_path, workspace.id if workspace else None, sql,
+               session_id)
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                return agent
+        agent = build_agent(df, openai_model, dataset_path, workspace, sql)
+        with self._lock:
+            agent = self._agents.setdefault(key, agent)
+            self._agents.move_to_end(key)
+            while len(self._agents) > self.max_entries:
+                self._agents.popitem(last=False)
+        return agent
+
+    def invalidate(self, version):
+        """移除某个数据版本的全部智能体"""
+        with self._lock:
+            for key in [key for key in self._agents if key[0] == version]:
+                del self._agents[key]
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+
+
+agent_pool = AgentPool()
+
+
+def build_agent_prompt(question, history=None, profile=None, workspace=None):
+    """构建完整的提示词，包含数据概况和对话历史"""
+    full_prompt = PROMPT_PREFIX
 
+    # 加入预先计算好的数据概况，模型无需再自行统计
+    if profile is not None:
+        full_prompt += profile.to_prompt()
 
-def generate_chart_with_plotly(data_source, chart_type):
-    """使用plotly.express生成交互式图表"""
+    # 工作区中有多张表时列出表名和跨表函数
+    if workspace is not None:
+        full_prompt += workspace.to_prompt()
+
+    # 如果提供了对话历史，添加到提示词中
+    if history:
+        full_prompt += build_conversation_context(history)
+    else:
+        full_prompt += "\n\n### 当前请求:\n"
+
+    return full_prompt + question
+
+
+class _QueueCallbackHandler(BaseCallbackHandler):
+    """把模型生成的token放入事件队列"""
+
+    def __init__(self, events):
+        self.events = events
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.events.put(('token', token))
+
+
+class AgentCancelled(Exception):
+    """智能体运行已被取消"""
+
+
+class _CancelCallbackHandler(BaseCallbackHandler):
+    """每次调用模型或执行工具前检查是否已取消，已取消时抛出异常结束智能体循环"""
+
+    # 回调中的异常默认只记录日志，需要向上抛出才能中断智能体
+    raise_error = True
+
+    def __init__(self, is_cancelled):
+        self.is_cancelled = is_cancelled
+
+    def _check(self):
+        if self.is_cancelled():
+            raise AgentCancelled()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check()
+
+
+def _stream_agent(agent, full_prompt, callbacks=None, context_id=None, cancel=None):
+    """
+    在后台线程中运行agent.stream，逐个产出事件
+    生成器被关闭或cancel被设置后，智能体在下一次调用模型或工具前停止；关闭生成器时等待后台线程结束
+    :param callbacks: 额外的回调处理器
+    :param context_id: 沙箱中代码的执行上下文ID
+    :param cancel: 可选的threading.Event，设置后停止智能体
+    :return: 生成器，事件为 ('token', 文本) / ('action', 思考与行动) / ('observation', 观察结果) / ('output', 最终输出)
+    """
+    events = queue.Queue()
+    done = object()
+    stopped = threading.Event()
+
+    def is_cancelled():
+        return stopped.is_set() or (cancel is not None and cancel.is_set())
+
+    def worker():
+        # 新线程不继承调用方的上下文变量，在这里设置
+        execution_context.set(context_id)
+        handlers = [_CancelCallbackHandler(is_cancelled), _QueueCallbackHandler(events)] + (callbacks or [])
+        try:
+            for chunk in agent.stream({'input': full_prompt}, config={'callbacks': handlers}):
+                if is_cancelled():
+                    break
+                for action in chunk.get('actions', []):
+                    events.put(('action', action.log))
+                for step in chunk.get('steps', []):
+                    events.put(('observation', str(step.observation)))
+                if 'output' in chunk:
+                    events.put(('output', chunk['output']))
+        except Exception as e:
+            events.put(('error', e))
+        finally:
+            events.put((done, None))
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
     try:
-        if chart_type == 'bar':
-            # 处理柱状图数据
-            if 'groups' in data_source:
-                # 分组柱状图
-                df = pd.DataFrame({
-                    'x': np.tile(data_source['x'], len(data_source['groups'])),
-                    'y': np.concatenate(data_source['y']),
-                    'group': np.repeat(data_source['groups'], len(data_source['x']))
-                })
-                fig = px.bar(
-                    df,
-                    x='x',
-                    y='y',
-                    color='group',
-                    barmode='group',
-                    title=data_source.get('title', '柱状图'),
-                    labels={'x': data_source.get('x_label', '类别'),
-                            'y': data_source.get('y_label', '数值')}
-                )
-            else:
-                # 普通柱状图
-                fig = px.bar(
-                    x=data_source['x'],
-                    y=data_source['y'],
-                    title=data_source.get('title', '柱状图'),
-                    labels={'x': data_source.get('x_label', '类别'),
-                            'y': data_source.get('y_label', '数值')}
-                )
-
-        elif chart_type == 'line':
-            # 处理折线图数据
-            if 'groups' in data_source:
-                # 多线折线图
-                df = pd.DataFrame({
-                    'x': np.tile(data_source['x'], len(data_source['groups'])),
-                    'y': np.concatenate(data_source['y']),
-                    'group': np.repeat(data_source['groups'], len(data_source['x']))
-                })
-                fig = px.line(
-                    df,
-                    x='x',
-                    y='y',
-                    color='group',
-                    title=data_source.get('title', '折线图'),
-                    markers=True,
-                    labels={'x': data_source.get('x_label', 'X轴'),
-                            'y': data_source.get('y_label', 'Y轴')}
-                )
-            else:
-                # 单线折线图
-                fig = px.line(
-                    x=data_source['x'],
-                    y=data_source['y'],
-                    title=data_source.get('title', '折线图'),
-                    markers=True,
-                    labels={'x': data_source.get('x_label', 'X轴'),
-                            'y': data_source.get('y_label', 'Y轴')}
-                )
-
-        elif chart_type == 'pie':
-            # 处理饼图数据
-            fig = px.pie(
-                names=data_source['labels'],
-                values=data_source['values'],
-                title=data_source.get('title', '饼图'),
-                hole=0.3
-            )
-
-        elif chart_type == 'scatter':
-            # 处理散点图数据
-            if 'groups' in data_source:
-                # 分组散点图
-                df = pd.DataFrame({
-                    'x': data_source['x'],
-                    'y': data_source['y'],
-                    'group': data_source['groups']
-                })
-                fig = px.scatter(
-                    df,
-                    x='x',
-                    y='y',
-                    color='group',
-                    title=data_source.get('title', '散点图'),
-                    labels={'x': data_source.get('x_label', 'X轴'),
-                            'y': data_source.get('y_label', 'Y轴')}
-                )
-            else:
-                # 普通散点图
-                fig = px.scatter(
-                    x=data_source['x'],
-                    y=data_source['y'],
-                    title=data_source.get('title', '散点图'),
-                    labels={'x': data_source.get('x_label', 'X轴'),
-                            'y': data_source.get('y_label', 'Y轴')}
-                )
-
-        elif chart_type == 'heatmap':
-            # 处理热力图数据
-            fig = go.Figure(data=go.Heatmap(
-                z=data_source['data'],
-                x=data_source.get('x_labels', []),
-                y=data_source.get('y_labels', []),
-                colorscale='Viridis'
-            ))
-            fig.update_layout(
-                title=data_source.get('title', '热力图'),
-                xaxis_title=data_source.get('x_label', 'X轴'),
-                yaxis_title=data_source.get('y_label', 'Y轴')
-            )
-
-        elif chart_type == 'boxplot':
-            # 处理箱线图数据
-            if 'groups' in data_source:
-                # 分组箱线图
-                df = pd.DataFrame({
-                    'value': np.concatenate([vals for vals in data_source['groups'].values()]),
-                    'group': np.repeat(list(data_source['groups'].keys()),
-                                       [len(v) for v in data_source['groups'].values()])
-                })
-                fig = px.box(
-                    df,
-                    x='group',
-                    y='value',
-                    title=data_source.get('title', '箱线图'),
-                    labels={'group': data_source.get('x_label', '分组'),
-                            'value': data_source.get('y_label', '数值')}
-                )
+        while True:
+            kind, payload = events.get()
+            if kind is done:
+                return
+            if kind == 'error':
+                if isinstance(payload, AgentCancelled):
+                    return
+                raise payload
+            yield kind, payload
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def _history_digest(history, question):
+    """对话历史中用户和助手消息的摘要，作为答案缓存键的一部分；不含已加入历史的当前问题"""
+    turns = [[entry["role"], entry["content"]] for entry in history if entry["role"] in ("user", "assistant")]
+    if turns and turns[-1] == ["user", question]:
+        turns.pop()
+    return hashlib.sha256(json.dumps(turns, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def _parse_agent_output(output, openai_model=None, callbacks=None):
+    """解析智能体的最终输出，JSON格式有误时先在本地修复，仍失败再用结构化输出转换"""
+    return parse_answer(output, llm=openai_model, callbacks=callbacks)
+
+
+def dataframe_agent(df, question, openai_model, history=None, profile=None, version=None, stream=False,
+                    fast_path=True, stats=None, trace=None, workspace=None, sql=None, session_id=None, cancel=None,
+                    cache=True):
+    """
+    创建智能体，提问与回答 - 添加对话历史支持
+    :param df: 数据集
+    :param question: 用户问题
+    :param openai_model: OpenAI模型实例，流式模式下需设置streaming=True才能逐token输出
+    :param history: 对话历史
+    :param profile: 数据画像（data_profile.DataProfile），提供时作为数据概况加入提示词
+    :param version: 数据版本，提供时从智能体池复用智能体，并启用相似问题的答案缓存
+    :param stream: 是否使用流式模式
+    :param fast_path: 是否先尝试不经过模型、直接用pandas回答简单的统计类问题
+    :param stats: 可选的字典，调用结束后写入 source（fast_path / cache / agent）和 iterations（智能体迭代次数）
+    :param trace: 可选的telemetry.TurnTrace，记录各阶段耗时和token用量
+    :param workspace: 可选的多文件工作区（workspace.Workspace），智能体可以连接或合并其中的其他表
+    :param sql: 是否给智能体提供DuckDB SQL查询工具，默认取环境变量AGENT_SQL；未安装duckdb时忽略
+    :param session_id: 会话ID，同一会话的各轮问答共享代码中定义的变量；不提供时每轮使用独立的执行上下文
+    :param cancel: 可选的threading.Event，设置后智能体在下一次调用模型或工具前停止，不产出结果
+    :param cache: 是否使用相似问题的答案缓存（需提供version），为False时既不查找也不写入
+    :return: 响应结果，取消时为None；流式模式下返回事件生成器，依次产出 ('token' | 'action' | 'observation', 文本)，
+             最后产出 ('result', 响应结果)；流式模式下关闭生成器同样会停止智能体
+    """
+    if stats is None:
+        stats = {}
+    if trace is None:
+        trace = TurnTrace(question)
+    sql = (AGENT_SQL if sql is None else sql) and sql_available()
+    if stream:
+        return _dataframe_agent_events(df, question, openai_model, history, profile, version, fast_path, stats,
+                                       trace, workspace, sql, session_id=session_id, cancel=cancel, cache=cache)
+    for kind, payload in _dataframe_agent_events(df, question, openai_model, history, profile, version,
+                                                 fast_path, stats, trace, workspace, sql, stream=False,
+                                                 session_id=session_id, cancel=cancel, cache=cache):
+        if kind == 'result':
+            return payload
+
+
+def _dataframe_agent_events(df, question, openai_model, history, profile, version, fast_path, stats, trace,
+                            workspace=None, sql=False, stream=True, session_id=None, cancel=None, cache=True):
+    """dataframe_agent的实现，以事件生成器的形式返回结果"""
+    for kind, payload in _dataframe_agent_steps(df, question, openai_model, history, profile, version,
+                                                fast_path, stats, trace, workspace, sql, stream, session_id,
+                                                cancel, cache):
+        if kind == 'result':
+            trace.meta.update(source=stats.get('source'), iterations=stats['iterations'])
+        yield kind, payload
+
+
+def _dataframe_agent_steps(df, question, openai_model, history, profile, version, fast_path, stats, trace,
+                           workspace, sql, stream, session_id=None, cancel=None, cache=True):
+    stats['iterations'] = 0
+
+    # 简单的统计类问题直接计算，无需调用模型
+    if fast_path:
+        with trace.span('fast_path'):
+            result = try_fast_path(df, question, history)
+        if result is not None:
+            stats['source'] = 'fast_path'
+            yield 'result', result
+            return
+
+    # 同一数据版本下问过相似问题时直接返回缓存结果
+    # 有工作区时答案还取决于其他表；追问（如"画成饼图"）的答案取决于之前的对话，键中加入对话摘要
+    embedding = None
+    cache_version = version if cache else None
+    if cache_version is not None and workspace is not None:
+        cache_version = f"{cache_version}|{workspace.fingerprint()}"
+    if cache_version is not None and history:
+        cache_version = f"{cache_version}|{_history_digest(history, question)}"
+    if cache_version is not None:
+        with trace.span('cache_lookup'):
+            try:
+                cached, embedding = answer_cache.lookup(cache_version, question)
+            except Exception as e:
+                # 向量接口出错时不使用缓存，错误记录在本轮的耗时记录中
+                trace.meta['cache_error'] = f"{type(e).__name__}: {e}"
+                cached = None
+        if cached is not None:
+            stats['source'] = 'cache'
+            yield 'result', copy.deepcopy(cached)
+            return
+
+    with trace.span('prompt_build'):
+        full_prompt = build_agent_prompt(question, history, profile, workspace)
+    trace.meta['prompt_tokens_estimate'] = count_tokens(full_prompt)
+
+    with trace.span('agent_build'):
+        if version is None:
+            agent = build_agent(df, openai_model, workspace=workspace, sql=sql)
+        else:
+            # 沙箱进程通过列式文件共享数据，没有版本号时无法定位文件，仍在进程内执行
+            dataset_path = ensure_columnar(version, df) if AGENT_SANDBOX else None
+            if dataset_path is not None:
+                agent = agent_pool.get(version, df, openai_model, dataset_path, workspace, sql)
+            elif session_id is not None:
+                # 进程内执行时代码中的变量保存在智能体的工具里，只在同一会话内复用
+                agent = agent_pool.get(version, df, openai_model, workspace=workspace, sql=sql,
+                                       session_id=session_id)
             else:
-                # 普通箱线图
-                fig = px.box(
-                    y=data_source['data'],
-                    title=data_source.get('title', '箱线图'),
-                    labels={'y': data_source.get('y_label', '数值')}
-                )
+                agent = build_agent(df, openai_model, workspace=workspace, sql=sql)
 
+    stats['source'] = 'agent'
+    trace_handler = TraceCallbackHandler(trace, count_tokens)
+    callbacks = [trace_handler]
+    context_id = session_id or uuid.uuid4().hex
+    try:
+        if stream:
+            output = None
+            for kind, payload in _stream_agent(agent, full_prompt, callbacks, context_id, cancel):
+                if kind == 'output':
+                    output = payload
+                    continue
+                if kind == 'observation':
+                    stats['iterations'] += 1
+                yield kind, payload
+            if output is None and cancel is not None and cancel.is_set():
+                return
         else:
-            st.error(f"不支持的图表类型: {chart_type}")
-            return
+            if cancel is not None:
+                callbacks.append(_CancelCallbackHandler(cancel.is_set))
+            token = execution_context.set(context_id)
+            try:
+                res = agent.invoke({
+                    'input': full_prompt
+                }, config={'callbacks': callbacks})
+            except AgentCancelled:
+                return
+            finally:
+                execution_context.reset(token)
+            output = res['output']
+            stats['iterations'] = len(res.get('intermediate_steps', []))
+        with trace.span('parse'):
+            # 结构化输出的调用同样计入本轮的token用量
+            result = _parse_agent_output(output, openai_model, callbacks=[trace_handler])
+    except ValueError as e:
+        yield 'result', {"answer": f"处理请求时发生错误: {str(e)}"}
+        return
+
+    if cache_version is not None and embedding is not None:
+        answer_cache.store(cache_version, question, copy.deepcopy(result), embedding=embedding)
+    yield 'result', result
+
+
+# 支持的图表类型
+CHART_TYPES = ['bar', 'line', 'pie', 'scatter', 'heatmap', 'boxplot']
+
+# 图表缓存的数量上限
+CHART_CACHE_MAX_ENTRIES = 128
+
+# 折线图每条线最多显示的点数，超出后用LTTB降采样
+LINE_MAX_POINTS = 5000
+
+# 散点图超过该点数时使用WebGL渲染
+SCATTER_WEBGL_POINTS = 5000
+
+# 散点图超过该点数时改为二维分箱的密度图
+SCATTER_BIN_POINTS = 200_000
+
+# 密度图每个方向的分箱数
+SCATTER_BINS = 200
+
+# 热力图最多显示的格子数，超出后按块求平均
+HEATMAP_MAX_CELLS = 250_000
+
+
+def _numeric(values):
+    """数值列表转为numpy数组，plotly序列化时使用紧凑的二进制编码"""
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return values
+
+
+def _grouped_frame(data_source):
+    """把分组数据展开为长表：x按组平铺，y按组拼接"""
+    return pd.DataFrame({
+        'x': np.tile(data_source['x'], len(data_source['groups'])),
+        'y': np.concatenate(data_source['y']),
+        'group': np.repeat(data_source['groups'], len(data_source['x']))
+    })
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets降采样，保留折线形状的关键点
+    :param x: 数值型x坐标
+    :param y: 数值型y坐标
+    :param threshold: 保留的点数
+    :return: 保留点的下标
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    bucket = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        next_end = max(min(int((i + 2) * bucket) + 1, n), end + 1)
+        # 下一个桶的平均点作为三角形的第三个顶点
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def _downsample_line(x, y, threshold=LINE_MAX_POINTS):
+    """折线超过点数上限时用LTTB降采样，x不是数值时按顺序位置计算"""
+    y = _numeric(y)
+    if len(y) <= threshold or not isinstance(y, np.ndarray):
+        return x, y
+    x_values = _numeric(x)
+    if not isinstance(x_values, np.ndarray):
+        x_values = np.arange(len(y), dtype=float)
+    keep = lttb_indices(x_values, y, threshold)
+    return [x[i] for i in keep], y[keep]
+
+
+def _aggregate_heatmap(z, x_labels, y_labels, max_cells=None):
+    """热力图格子过多时按块求平均，标签取每块的第一个；格子数上限默认取HEATMAP_MAX_CELLS，与chart_is_downsampled一致"""
+    max_cells = HEATMAP_MAX_CELLS if max_cells is None else max_cells
+    z = np.asarray(z, dtype=float)
+    rows, cols = z.shape
+    factor = int(np.ceil(np.sqrt(rows * cols / max_cells)))
+    if factor <= 1:
+        return z, x_labels, y_labels
+    # 补齐到块大小的整数倍后按块求平均
+    padded = np.full((-(-rows // factor) * factor, -(-cols // factor) * factor), np.nan)
+    padded[:rows, :cols] = z
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+    z = np.nanmean(blocks, axis=(1, 3))
+    return z, list(x_labels)[::factor], list(y_labels)[::factor]
+
+
+def chart_is_downsampled(data_source, chart_type):
+    """图表数据是否大到需要降采样、分箱或聚合显示"""
+    try:
+        if chart_type == 'line':
+            lengths = [len(y) for y in data_source['y']] if 'groups' in data_source else [len(data_source['y'])]
+            return max(lengths, default=0) > LINE_MAX_POINTS
+        if chart_type == 'scatter':
+            return len(data_source['x']) > SCATTER_BIN_POINTS and 'groups' not in data_source
+        if chart_type == 'heatmap':
+            z = data_source['data']
+            return len(z) * (len(z[0]) if len(z) else 0) > HEATMAP_MAX_CELLS
+    except (KeyError, TypeError):
+        pass
+    return False
+
+
+def _build_bar(data_source, full_resolution=False):
+    labels = {'x': data_source.get('x_label', '类别'),
+              'y': data_source.get('y_label', '数值')}
+    if 'groups' in data_source:
+        # 分组柱状图
+        return px.bar(
+            _grouped_frame(data_source),
+            x='x',
+            y='y',
+            color='group',
+            barmode='group',
+            title=data_source.get('title', '柱状图'),
+            labels=labels
+        )
+    # 普通柱状图
+    return px.bar(
+        x=data_source['x'],
+        y=_numeric(data_source['y']),
+        title=data_source.get('title', '柱状图'),
+        labels=labels
+    )
+
+
+def _build_line(data_source, full_resolution=False):
+    labels = {'x': data_source.get('x_label', 'X轴'),
+              'y': data_source.get('y_label', 'Y轴')}
+    threshold = np.inf if full_resolution else LINE_MAX_POINTS
+    if 'groups' in data_source:
+        # 多线折线图，每条线分别降采样
+        frames = []
+        for group, y in zip(data_source['groups'], data_source['y']):
+            x, y = _downsample_line(data_source['x'], y, threshold)
+            frames.append(pd.DataFrame({'x': x, 'y': y, 'group': group}))
+        return px.line(
+            pd.concat(frames, ignore_index=True),
+            x='x',
+            y='y',
+            color='group',
+            title=data_source.get('title', '折线图'),
+            markers=True,
+            labels=labels
+        )
+    # 单线折线图
+    x, y = _downsample_line(data_source['x'], data_source['y'], threshold)
+    return px.line(
+        x=x,
+        y=y,
+        title=data_source.get('title', '折线图'),
+        markers=True,
+        labels=labels
+    )
+
+
+def _build_pie(data_source, full_resolution=False):
+    return px.pie(
+        names=data_source['labels'],
+        values=_numeric(data_source['values']),
+        title=data_source.get('title', '饼图'),
+        hole=0.3
+    )
+
+
+def _build_scatter(data_source, full_resolution=False):
+    labels = {'x': data_source.get('x_label', 'X轴'),
+              'y': data_source.get('y_label', 'Y轴')}
+    points = len(data_source['x'])
+    if points > SCATTER_BIN_POINTS and not full_resolution and 'groups' not in data_source:
+        # 点数过多时改为二维分箱的密度图
+        return px.density_heatmap(
+            x=_numeric(data_source['x']),
+            y=_numeric(data_source['y']),
+            nbinsx=SCATTER_BINS,
+            nbinsy=SCATTER_BINS,
+            title=data_source.get('title', '散点图'),
+            labels=labels
+        )
+    # 点数较多时使用WebGL渲染
+    render_mode = 'webgl' if points > SCATTER_WEBGL_POINTS else 'auto'
+    if 'groups' in data_source:
+        # 分组散点图
+        df = pd.DataFrame({
+            'x': data_source['x'],
+            'y': data_source['y'],
+            'group': data_source['groups']
+        })
+        return px.scatter(
+            df,
+            x='x',
+            y='y',
+            color='group',
+            title=data_source.get('title', '散点图'),
+            labels=labels,
+            render_mode=render_mode
+        )
+    # 普通散点图
+    return px.scatter(
+        x=_numeric(data_source['x']),
+        y=_numeric(data_source['y']),
+        title=data_source.get('title', '散点图'),
+        labels=labels,
+        render_mode=render_mode
+    )
+
 
-        # 设置统一的中文字体
-        fig.update_layout(
-            font_family="Microsoft YaHei",
-            title_font_size=20,
-            title_x=0.5
+def _build_heatmap(data_source, full_resolution=False):
+    z = _numeric(data_source['data'])
+    x_labels = data_source.get('x_labels', [])
+    y_labels = data_source.get('y_labels', [])
+    if not full_resolution and isinstance(z, np.ndarray) and z.ndim == 2:
+        z, x_labels, y_labels = _aggregate_heatmap(z, x_labels, y_labels)
+    fig = go.Figure(data=go.Heatmap(
+        z=z,
+        x=x_labels,
+        y=y_labels,
+        colorscale='Viridis'
+    ))
+    fig.update_layout(
+        title=data_source.get('title', '热力图'),
+        xaxis_title=data_source.get('x_label', 'X轴'),
+        yaxis_title=data_source.get('y_label', 'Y轴')
+    )
+    return fig
+
+
+def _build_boxplot(data_source, full_resolution=False):
+    if 'groups' in data_source:
+        # 分组箱线图
+        groups = data_source['groups']
+        df = pd.DataFrame({
+            'value': np.concatenate([vals for vals in groups.values()]),
+            'group': np.repeat(list(groups.keys()), [len(v) for v in groups.values()])
+        })
+        return px.box(
+            df,
+            x='group',
+            y='value',
+            title=data_source.get('title', '箱线图'),
+            labels={'group': data_source.get('x_label', '分组'),
+                    'value': data_source.get('y_label', '数值')}
         )
+    # 普通箱线图
+    return px.box(
+        y=_numeric(data_source['data']),
+        title=data_source.get('title', '箱线图'),
+        labels={'y': data_source.get('y_label', '数值')}
+    )
+
+
+# 各图表类型的构建函数
+_CHART_BUILDERS = {
+    'bar': _build_bar,
+    'line': _build_line,
+    'pie': _build_pie,
+    'scatter': _build_scatter,
+    'heatmap': _build_heatmap,
+    'boxplot': _build_boxplot,
+}
+
+
+def chart_cache_key(data_source, chart_type, full_resolution=False):
+    """图表缓存键：图表类型、图表数据和是否完整显示的哈希"""
+    payload = json.dumps([chart_type, data_source, full_resolution], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class FigureCache:
+    """已构建图表的LRU缓存，所有会话共享"""
+
+    def __init__(self, max_entries=CHART_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fig = self._figures.get(key)
+            if fig is not None:
+                self._figures.move_to_end(key)
+            return fig
+
+    def put(self, key, fig):
+        with self._lock:
+            self._figures[key] = fig
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+figure_cache = FigureCache()
+
+
+def build_chart_figure(data_source, chart_type, full_resolution=False):
+    """
+    根据智能体返回的图表数据构建plotly图表
+    相同的 (图表类型, 图表数据) 只构建一次，重新运行时直接复用缓存的图表对象
+    :param full_resolution: 为False时，大折线图降采样、大散点图用WebGL或分箱、大热力图按块聚合
+    """
+    builder = _CHART_BUILDERS.get(chart_type)
+    if builder is None:
+        raise ValueError(f"不支持的图表类型: {chart_type}")
+
+    key = chart_cache_key(data_source, chart_type, full_resolution)
+    fig = figure_cache.get(key)
+    if fig is not None:
+        return fig
+
+    fig = builder(data_source, full_resolution=full_resolution)
+
+    # 设置统一的中文字体
+    fig.update_layout(
+        font_family="Microsoft YaHei",
+        title_font_size=20,
+        title_x=0.5
+    )
+
+    figure_cache.put(key, fig)
+    return fig
+
+
+def generate_chart_with_plotly(data_source, chart_type):
+    """使用plotly.express生成交互式图表"""
+    if chart_type not in CHART_TYPES:
+        st.error(f"不支持的图表类型: {chart_type}")
+        return
+    try:
+        fig = build_chart_figure(data_source, chart_type)
 
         # 显示图表
         st.plotly_chart(fig, use_container_width=True)
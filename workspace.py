@@ -0,0 +1,231 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from data_loader import (dataframe_nbytes, ensure_columnar, excel_sheet_names, get_dataset_cache, load_bytes,
+                         upload_hash)
+from sandbox import table_helpers
+
+# 工作区中同时保持加载的数据表占用的内存上限（字节），默认1GB
+WORKSPACE_MEMORY_BUDGET = int(os.environ.get('WORKSPACE_MEMORY_BUDGET', 1024 ** 3))
+
+# 数据表空闲超过该时间（秒）后释放，再次引用时重新加载
+WORKSPACE_IDLE_SECONDS = float(os.environ.get('WORKSPACE_IDLE_SECONDS', 600))
+
+
+class WorkspaceEntry:
+    """工作区中的一张数据表：一个CSV文件或Excel文件的一个工作表"""
+
+    def __init__(self, name, uploaded_file, file_hash, sheet_name=None):
+        self.name = name
+        self.uploaded_file = uploaded_file
+        self.file_hash = file_hash
+        self.sheet_name = sheet_name
+        self.dataset_key = None
+        self.df = None
+        self.nbytes = 0
+        self.rows = None
+        self.last_used = 0.0
+
+    @property
+    def loaded(self):
+        return self.df is not None
+
+
+class Workspace:
+    """
+    会话的多文件工作区：登记所有上传的文件和工作表，首次引用时才加载
+    空闲或超出内存预算的表被释放，再次引用时从数据集缓存或列式文件重新打开
+    """
+
+    def __init__(self, memory_budget=WORKSPACE_MEMORY_BUDGET, idle_seconds=WORKSPACE_IDLE_SECONDS,
+                 clock=time.monotonic):
+        self.id = uuid.uuid4().hex
+        # 当前选中的表，即智能体代码中的df
+        self.current = None
+        self.memory_budget = memory_budget
+        self.idle_seconds = idle_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._files = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    def entry(self, name):
+        with self._lock:
+            return self._entries[name]
+
+    def _unique_name(self, name):
+        candidate, i = name, 2
+        while candidate in self._entries:
+            candidate = f"{name}({i})"
+            i += 1
+        return candidate
+
+    def sync(self, uploaded_files):
+        """
+        按上传控件的当前文件更新登记：新文件登记其全部工作表，已移除的文件注销
+        只读取Excel的工作表列表，不解析数据
+        """
+        with self._lock:
+            current = {}
+            for uploaded_file in uploaded_files:
+                file_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+                current[file_id] = uploaded_file
+                if file_id in self._files:
+                    continue
+                # 哈希在登记时计算，之后可在智能体的后台线程中加载
+                file_hash = upload_hash(uploaded_file)
+                stem = os.path.splitext(uploaded_file.name)[0]
+                names = []
+                if uploaded_file.name.endswith('.csv'):
+                    name = self._unique_name(stem)
+                    self._entries[name] = WorkspaceEntry(name, uploaded_file, file_hash)
+                    names.append(name)
+                else:
+                    for sheet in excel_sheet_names(uploaded_file):
+                        name = self._unique_name(f"{stem}/{sheet}")
+                        self._entries[name] = WorkspaceEntry(name, uploaded_file, file_hash, sheet)
+                        names.append(name)
+                self._files[file_id] = names
+            for file_id in [file_id for file_id in self._files if file_id not in current]:
+                for name in self._files.pop(file_id):
+                    self._entries.pop(name, None)
+            return self.names()
+
+    def load(self, name, on_progress=None):
+        """
+        获取数据表，未加载时加载
+        :return: (数据集键, DataFrame)
+        """
+        with self._lock:
+            entry = self._entries[name]
+            if entry.df is None:
+                entry.dataset_key, entry.df = load_bytes(
+                    entry.uploaded_file.getvalue(), entry.file_hash, entry.uploaded_file.name,
+                    sheet_name=entry.sheet_name, on_progress=on_progress
+                )
+                entry.nbytes = dataframe_nbytes(entry.df)
+                entry.rows = len(entry.df)
+            entry.last_used = self._clock()
+            self._entries.move_to_end(name)
+            dataset_key, df = entry.dataset_key, entry.df
+            self.evict(keep=name)
+            return dataset_key, df
+
+    def get(self, name):
+        """按表名获取DataFrame"""
+        return self.load(name)[1]
+
+    def _release(self, entry):
+        """
+        释放一张表：数据同时被共享的数据集缓存引用，只清空本工作区的引用不会释放内存，
+        因此一并从数据集缓存中移除；当前表（即df）仍被会话使用，保留其缓存
+        """
+        entry.df = None
+        if entry.name != self.current:
+            get_dataset_cache().discard(entry.dataset_key)
+
+    def evict(self, keep=None):
+        """释放空闲的表，并按最近使用顺序释放超出内存预算的表"""
+        with self._lock:
+            now = self._clock()
+            loaded = [entry for entry in self._entries.values() if entry.loaded and entry.name != keep]
+            for entry in loaded:
+                if now - entry.last_used > self.idle_seconds:
+                    self._release(entry)
+            total = sum(entry.nbytes for entry in self._entries.values() if entry.loaded)
+            # _entries按最近使用排序，从最早使用的开始释放
+            for entry in loaded:
+                if total <= self.memory_budget:
+                    break
+                if entry.loaded:
+                    self._release(entry)
+                    total -= entry.nbytes
+
+    def fingerprint(self):
+        """工作区内容的指纹，文件增减或替换时变化"""
+        with self._lock:
+            keys = sorted(f"{entry.file_hash}:{entry.sheet_name or ''}" for entry in self._entries.values())
+        return hashlib.sha256('|'.join(keys).encode('utf-8')).hexdigest()[:16]
+
+    def tables(self):
+        """按需加载的 表名 -> DataFrame 映射"""
+        return _LazyTables(self)
+
+    def referenced(self, text, identifiers=False):
+        """
+        文本中引用到的表名：表名完整地出现在引号中，如 tables['销售']；
+        identifiers为True时还包括作为完整标识符出现的表名（SQL中不加引号的表名）
+        按完整表名匹配，表a不会因为文本中出现data而被加载
+        """
+        names = []
+        for name in self.names():
+            pattern = rf"""(['"]){re.escape(name)}\1"""
+            if identifiers:
+                pattern += rf"""|(?<![\w."']){re.escape(name)}(?![\w"'])"""
+            if re.search(pattern, text):
+                names.append(name)
+        return names
+
+    def resolve_paths(self, code):
+        """
+        代码中以字符串引用到的表，加载并确保有列式文件，供沙箱进程读取
+        :return: 表名 -> 列式文件路径
+        """
+        paths = {}
+        for name in self.referenced(code):
+            dataset_key, df = self.load(name)
+            path = ensure_columnar(dataset_key, df)
+            if path is not None:
+                paths[name] = path
+        return paths
+
+    def to_prompt(self):
+        """列出工作区中的数据表及用法，供智能体使用"""
+        lines = []
+        with self._lock:
+            for entry in self._entries.values():
+                status = f"{entry.rows}行" if entry.rows is not None else "未加载"
+                mark = "，即df" if entry.name == self.current else ""
+                lines.append(f"- {entry.name}（{status}{mark}）")
+        return (
+            "\n\n### 工作区中的数据表:\n" + "\n".join(lines)
+            + "\n用 tables['表名'] 获取其他表的DataFrame（首次使用时加载）；"
+              "join_tables('左表', '右表', on='列名', how='inner') 按列连接两张表；"
+              "union_tables(['表名', ...]) 纵向合并多张表，并添加'来源表'列"
+        )
+
+
+class _LazyTables(Mapping):
+    """工作区表的只读映射，取值时才加载"""
+
+    def __init__(self, workspace):
+        self._workspace = workspace
+
+    def __getitem__(self, name):
+        if name not in self._workspace.names():
+            raise KeyError(f"工作区中没有数据表: {name}")
+        return self._workspace.get(name)
+
+    def __iter__(self):
+        return iter(self._workspace.names())
+
+    def __len__(self):
+        return len(self._workspace)
+
+
+def workspace_locals(workspace):
+    """进程内执行代码时注入的工作区变量和函数"""
+    return table_helpers(workspace.tables())
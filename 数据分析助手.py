@@ -1,9 +1,17 @@
 import streamlit as st
 import pandas as pd
-from langchain_openai import ChatOpenAI
-from pydantic import SecretStr
-from utils import dataframe_agent, generate_chart_with_plotly
-import time
+from utils import dataframe_agent
+from data_profile import get_profile
+from dataset_versions import DatasetVersion, get_version_store, version_profile
+from agent_jobs import get_agent_job_pool
+from llm_clients import get_chat_model
+from chat_render import clear_render_cache, new_message_id, render_message
+from telemetry import TurnTrace, get_telemetry
+from workspace import Workspace
+from sql_tool import AGENT_SQL, sql_available
+import html
+import uuid
+from functools import partial
 
 # 设置页面配置
 st.set_page_config(
@@ -211,9 +219,46 @@ if 'messages' not in st.session_state:
 if 'data' not in st.session_state:
     st.session_state.data = None
 
+if 'dataset_key' not in st.session_state:
+    st.session_state.dataset_key = None
+
+# 当前数据版本（DatasetVersion）及其ID，ID用于缓存数据画像、智能体和答案
+if 'dataset_version' not in st.session_state:
+    st.session_state.dataset_version = None
+
+if 'data_version' not in st.session_state:
+    st.session_state.data_version = None
+
+# 之前的数据版本，用于撤销预处理
+if 'version_history' not in st.session_state:
+    st.session_state.version_history = []
+
+# 未经预处理的原始数据，各版本由它按步骤生成
+if 'base_data' not in st.session_state:
+    st.session_state.base_data = None
+
 if 'openai_model' not in st.session_state:
     st.session_state.openai_model = None
 
+# 多文件工作区，登记上传的所有文件和工作表
+if 'workspace' not in st.session_state:
+    st.session_state.workspace = Workspace()
+
+# 会话ID，用于智能体任务池按会话限制并发，以及在同一会话的各轮问答间保留代码中定义的变量
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 正在处理的智能体任务，页面重新运行后继续接收结果
+if 'pending_job' not in st.session_state:
+    st.session_state.pending_job = None
+
+# 正在处理的任务的耗时记录，以及最近一轮的记录（调试面板使用）
+if 'pending_trace' not in st.session_state:
+    st.session_state.pending_trace = None
+
+if 'last_trace' not in st.session_state:
+    st.session_state.last_trace = None
+
 # 添加对话记忆状态
 if 'conversation_history' not in st.session_state:
     st.session_state.conversation_history = []
@@ -235,10 +280,12 @@ with st.sidebar:
 
     if api_key:
         try:
-            st.session_state.openai_model = ChatOpenAI(
-                model="gpt-4o-mini",
-                api_key=SecretStr(api_key),
-                base_url="https://api.openai-hk.com/v1",
+            # 相同配置复用同一个模型实例及其HTTP连接池
+            st.session_state.openai_model = get_chat_model(
+                "gpt-4o-mini",
+                "https://api.openai-hk.com/v1",
+                api_key,
+                streaming=True,
             )
             st.success("API密钥已设置!")
         except Exception as e:
@@ -250,43 +297,62 @@ with st.sidebar:
 
     # 文件上传区域
     st.subheader("数据上传")
-    uploaded_file = st.file_uploader(
+    uploaded_files = st.file_uploader(
         "上传CSV或Excel文件",
         type=["csv", "xlsx"],
-        accept_multiple_files=False,
-        help="支持CSV和Excel格式，文件大小限制200MB"
+        accept_multiple_files=True,
+        help="支持CSV和Excel格式，可同时上传多个文件，文件大小限制200MB"
     )
 
     # 文件上传处理
-    if uploaded_file is not None:
+    if uploaded_files:
         try:
-            # 根据文件类型读取数据
-            if uploaded_file.name.endswith('.csv'):
-                st.session_state.data = pd.read_csv(uploaded_file)
-            elif uploaded_file.name.endswith(('.xlsx', '.xls')):
-                # 读取Excel文件的工作表列表
-                excel_file = pd.ExcelFile(uploaded_file)
-                sheet_names = excel_file.sheet_names
-                # 添加工作表选择器
-                selected_sheet = st.selectbox(
-                    "选择工作表:",
-                    sheet_names,
-                    index=0,
-                    key='sheet_selector'
-                )
-                # 读取选定的工作表
-                st.session_state.data = pd.read_excel(
-                    uploaded_file,
-                    sheet_name=selected_sheet
+            # 登记所有文件和工作表，只有被选中或被智能体引用的表才会加载
+            table_names = st.session_state.workspace.sync(uploaded_files)
+            selected_table = st.selectbox(
+                "选择数据表:",
+                table_names,
+                index=0,
+                key='table_selector'
+            )
+            st.session_state.workspace.current = selected_table
+            # 解析大文件时在侧边栏显示进度，相同内容的文件只解析一次
+            progress_slot = st.empty()
+            load_trace = TurnTrace(f"加载数据: {selected_table}")
+            with load_trace.span('ingest'):
+                dataset_key, data = st.session_state.workspace.load(
+                    selected_table,
+                    on_progress=lambda fraction: progress_slot.progress(fraction, text="正在读取数据...")
                 )
+            progress_slot.empty()
+
+            # 只有文件内容或工作表变化时才替换会话数据，避免覆盖预处理结果
+            if st.session_state.dataset_key != dataset_key:
+                st.session_state.dataset_key = dataset_key
+                st.session_state.dataset_version = DatasetVersion(dataset_key)
+                st.session_state.data_version = dataset_key
+                st.session_state.version_history = []
+                st.session_state.base_data = data
+                st.session_state.data = data
+
+                # 只记录新数据集的加载耗时，重新运行时命中缓存的加载不记录
+                with load_trace.span('profile'):
+                    get_profile(dataset_key, data)
+                load_trace.meta['source'] = 'ingest'
+                get_telemetry().record(load_trace)
+
+                # 更新对话历史
+                st.session_state.conversation_history.append({
+                    "role": "system",
+                    "content": f"用户已选择数据表：{selected_table}，"
+                               f"数据包含{data.shape[0]}行{data.shape[1]}列"
+                })
             st.success("数据加载成功！")
-
-            # 更新对话历史
-            st.session_state.conversation_history.append({
-                "role": "system",
-                "content": f"用户已上传数据文件：{uploaded_file.name}，"
-                           f"数据包含{st.session_state.data.shape[0]}行{st.session_state.data.shape[1]}列"
-            })
+            if len(table_names) > 1:
+                st.caption(f"工作区共{len(table_names)}张表，提问时可直接引用其他表名")
+            sample_ratio = data.attrs.get('sample_ratio', 1.0)
+            if sample_ratio < 1.0:
+                st.warning(f"数据超出内存预算，已按{sample_ratio:.2%}的比例随机抽样")
 
         except Exception as e:
             st.error(f"加载文件时出错: {str(e)}")
@@ -295,11 +361,17 @@ with st.sidebar:
 
     # 显示数据基本信息
     if st.session_state.data is not None:
+        def load_base():
+            return st.session_state.base_data
+
+        # 数据画像按版本缓存，重新运行时不再全量扫描数据
+        profile = version_profile(st.session_state.dataset_version, load_base)
+
         with st.expander("数据概览", expanded=True):
-            st.write(f"行数: {st.session_state.data.shape[0]}")
-            st.write(f"列数: {st.session_state.data.shape[1]}")
+            st.write(f"行数: {profile.rows}")
+            st.write(f"列数: {len(profile.columns)}")
             st.write("数据摘要:")
-            st.dataframe(st.session_state.data.describe())
+            st.dataframe(profile.describe)
 
         # 显示前5行
         with st.expander("查看数据"):
@@ -307,18 +379,15 @@ with st.sidebar:
 
         # 显示列信息
         with st.expander("列信息"):
-            for col in st.session_state.data.columns:
-                dtype = st.session_state.data[col].dtype
-                unique_count = st.session_state.data[col].nunique()
-                st.write(f"- {col}: {dtype}, {unique_count}个唯一值")
+            st.markdown("\n".join(profile.column_summary()))
 
         # 数据预处理选项
         st.divider()
         st.subheader("数据预处理")
 
         # 缺失值处理
-        if st.session_state.data.isnull().sum().sum() > 0:
-            missing_cols = st.session_state.data.columns[st.session_state.data.isnull().any()].tolist()
+        if profile.total_nulls > 0:
+            missing_cols = profile.missing_columns
             st.warning(f"检测到缺失值: {', '.join(missing_cols)}")
 
             missing_option = st.selectbox(
@@ -327,11 +396,23 @@ with st.sidebar:
                 key='missing_option'
             )
 
-            if st.button("应用缺失值处理"):
+            if st.button("应用缺失值处理") and missing_option != "不处理":
+                current = st.session_state.dataset_version
                 if missing_option == "删除含有缺失值的行":
-                    original_rows = st.session_state.data.shape[0]
-                    st.session_state.data = st.session_state.data.dropna()
-                    new_rows = st.session_state.data.shape[0]
+                    new_version = current.then('dropna')
+                else:
+                    new_version = current.then('fillna', columns=missing_cols)
+                # 预处理记录为新版本，未改动的列与上一版本共享数据，画像由上一版本增量计算
+                data = get_version_store().materialize(new_version, load_base)
+                version_profile(new_version, load_base)
+                st.session_state.version_history.append(current)
+                st.session_state.dataset_version = new_version
+                st.session_state.data_version = new_version.id
+                st.session_state.data = data
+
+                if missing_option == "删除含有缺失值的行":
+                    original_rows = profile.rows
+                    new_rows = data.shape[0]
                     st.success(f"已删除含有缺失值的行! 剩余行数: {new_rows} (删除了{original_rows - new_rows}行)")
 
                     # 更新对话历史
@@ -339,14 +420,7 @@ with st.sidebar:
                         "role": "system",
                         "content": f"用户删除了含有缺失值的行，从{original_rows}行减少到{new_rows}行"
                     })
-
-                elif missing_option == "用平均值（众数）填充数值（分类）":
-                    for col in st.session_state.data.select_dtypes(include=['int', 'float']):
-                        st.session_state.data[col] = st.session_state.data[col].fillna(
-                            st.session_state.data[col].mean())
-                    for col in st.session_state.data.select_dtypes(include=['object']):
-                        st.session_state.data[col] = st.session_state.data[col].fillna(
-                            st.session_state.data[col].mode()[0])
+                else:
                     st.success(f"数据缺失值填充完毕！")
 
                     # 更新对话历史
@@ -357,123 +431,50 @@ with st.sidebar:
         else:
             st.success("数据中没有缺失值")
 
+        # 撤销最近一次预处理
+        if st.session_state.version_history:
+            st.caption(f"当前版本: {st.session_state.dataset_version.describe()}")
+            if st.button("撤销预处理", help="恢复到上一个数据版本"):
+                # 只切换本会话引用的版本；被撤销版本的数据、画像、智能体和列式文件可能正被其他会话使用，
+                # 由各自的LRU缓存按容量释放
+                previous = st.session_state.version_history.pop()
+                st.session_state.dataset_version = previous
+                st.session_state.data_version = previous.id
+                st.session_state.data = get_version_store().materialize(previous, load_base)
+                st.session_state.conversation_history.append({
+                    "role": "system",
+                    "content": f"用户撤销了预处理，数据恢复为: {previous.describe()}"
+                })
+                st.rerun()
+
+    # 大数据集上可以让智能体改用多线程的SQL引擎做分组聚合
+    use_sql = sql_available() and st.toggle(
+        "使用SQL查询引擎", value=AGENT_SQL, key="use_sql",
+        help="为智能体提供DuckDB SQL查询工具，适合百万行以上数据的筛选和分组统计"
+    )
+
     # 添加对话历史管理功能
     st.divider()
     # 添加清除对话历史按钮
     if st.button("清除对话历史", help="清除所有对话历史记录"):
         st.session_state.conversation_history = []
-        st.session_state.messages = [{"role": "assistant", "content": "对话历史已清除，请问您有什么数据分析需求？"}]
+        st.session_state.messages = [{"id": new_message_id(), "role": "assistant",
+                                      "content": "对话历史已清除，请问您有什么数据分析需求？"}]
+        clear_render_cache()
         st.success("对话历史已清除！")
 
+    # 智能体任务池状态
+    job_stats = get_agent_job_pool().stats()
+    st.caption(f"智能体任务：运行中 {job_stats['running']}/{job_stats['workers']}，排队 {job_stats['queued']}")
+
 # 主聊天界面 - 使用可滚动容器
 with st.container():
     # 使用自定义容器
     chat_container = st.markdown('<div class="chat-container">', unsafe_allow_html=True)
 
+    # 历史消息的HTML和图表按消息ID缓存，重新运行时直接复用
     for i, message in enumerate(st.session_state.messages):
-        role = message["role"]
-        row_class = "user-row" if role == "user" else "assistant-row"
-        bubble_class = "user-bubble" if role == "user" else "assistant-bubble"
-
-        # 使用自定义消息样式
-        message_html = f"""
-        <div class="message-row {row_class}">
-            <div class="message-bubble {bubble_class}">
-                <div class="message-header">
-                    <span class="message-role">
-                        {'<i class="fas fa-user"></i> 用户' if role == "user" else '<i class="fas fa-robot"></i> 助手'}
-                    </span>
-                    <span class="message-time">刚刚</span>
-                </div>
-                <div class="message-content">
-        """
-
-        # 显示文本回答
-        if "text" in message:
-            message_html += f'<div>{message["text"]}</div>'
-        elif "content" in message:
-            message_html += f'<div>{message["content"]}</div>'
-
-        # 显示表格数据
-        if "table" in message:
-            table_df = pd.DataFrame(
-                data=message["table"]["data"],
-                columns=message["table"]["columns"]
-            )
-
-            # 创建表格HTML
-            table_html = '<div class="chart-container">'
-            table_html += '<table class="message-table"><thead><tr>'
-            for col in table_df.columns:
-                table_html += f'<th>{col}</th>'
-            table_html += '</tr></thead><tbody>'
-
-            for _, row in table_df.iterrows():
-                table_html += '<tr>'
-                for value in row:
-                    table_html += f'<td>{value}</td>'
-                table_html += '</tr>'
-
-            table_html += '</tbody></table></div>'
-            message_html += table_html
-
-        # 添加图表占位符
-        if "chart" in message:
-            message_html += f'<div id="chart-{i}" class="message-chart"></div>'
-
-        message_html += """
-                </div>
-            </div>
-        </div>
-        """
-
-        st.markdown(message_html, unsafe_allow_html=True)
-
-        # 渲染图表到占位符
-        if "chart" in message:
-            chart_data = message["chart"]["data"]
-            chart_type = message["chart"]["type"]
-
-            # 在气泡内部显示图表
-            with st.container():
-                # 创建图表容器
-                chart_container = st.empty()
-
-                # 在容器中渲染图表
-                with chart_container:
-                    # 添加小延迟确保DOM已加载
-                    time.sleep(0.1)
-                    generate_chart_with_plotly(
-                        data_source=chart_data,
-                        chart_type=chart_type
-                    )
-
-                # 使用CSS将图表移动到气泡内部
-                st.markdown(
-                    f"""
-                    <script>
-                    // 将图表移动到气泡内的占位符
-                    setTimeout(function() {{
-                        const chartContainer = document.querySelector('#chart-{i}');
-                        const chartElement = document.querySelector('[data-testid="stPlotlyChart"]:last-child');
-                        if (chartContainer && chartElement) {{
-                            // 复制图表元素到气泡中
-                            const clonedChart = chartElement.cloneNode(true);
-                            chartContainer.innerHTML = '';
-                            chartContainer.appendChild(clonedChart);
-
-                            // 移除原始图表
-                            chartElement.remove();
-
-                            // 调整图表大小
-                            clonedChart.style.width = '100%';
-                            clonedChart.style.height = 'auto';
-                        }}
-                    }}, 300);
-                    </script>
-                    """,
-                    unsafe_allow_html=True
-                )
+        render_message(message, i)
 
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -485,24 +486,12 @@ st.markdown('</div>', unsafe_allow_html=True)
 # 处理用户输入
 if user_query:
     # 添加到消息历史
-    st.session_state.messages.append({"role": "user", "content": user_query})
+    user_message = {"id": new_message_id(), "role": "user", "content": user_query}
+    st.session_state.messages.append(user_message)
     st.session_state.conversation_history.append({"role": "user", "content": user_query})
 
     # 显示用户消息（使用自定义样式）
-    user_message_html = f"""
-    <div class="message-row user-row">
-        <div class="message-bubble user-bubble">
-            <div class="message-header">
-                <span class="message-role">
-                    <i class="fas fa-user"></i> 用户
-                </span>
-                <span class="message-time">刚刚</span>
-            </div>
-            <div class="message-content">{user_query}</div>
-        </div>
-    </div>
-    """
-    st.markdown(user_message_html, unsafe_allow_html=True)
+    render_message(user_message, len(st.session_state.messages) - 1)
 
     # 自动滚动到底部
     st.markdown(
@@ -523,173 +512,166 @@ if user_query:
     elif st.session_state.openai_model is None:
         st.warning("请先设置有效的OpenAI API密钥")
     else:
-        with st.spinner("正在思考中..."):
-            try:
-                # 调用代理处理查询
-                res = dataframe_agent(
+        # 提交到智能体任务池，同一会话的新问题会取消尚未完成的旧问题
+        trace = TurnTrace(user_query)
+        with trace.span('profile'):
+            profile = get_profile(st.session_state.data_version, st.session_state.data)
+        try:
+            st.session_state.pending_job = get_agent_job_pool().submit(
+                st.session_state.session_id,
+                partial(
+                    dataframe_agent,
                     df=st.session_state.data,
                     question=user_query,
                     openai_model=st.session_state.openai_model,
-                    history=st.session_state.conversation_history
+                    history=list(st.session_state.conversation_history),
+                    profile=profile,
+                    version=st.session_state.data_version,
+                    stream=True,
+                    trace=trace,
+                    sql=use_sql,
+                    session_id=st.session_state.session_id,
+                    # 只有一张表时不传工作区，智能体可以在会话间复用
+                    workspace=st.session_state.workspace if len(st.session_state.workspace) > 1 else None
                 )
-
-                # 构建助手消息
-                assistant_message = {"role": "assistant"}
-                message_index = len(st.session_state.messages)  # 用于图表占位符ID
-
-                # 添加文本回答
-                if "answer" in res:
-                    assistant_message["text"] = res["answer"]
-                    st.session_state.conversation_history.append({
-                        "role": "assistant",
-                        "content": res["answer"]
-                    })
-
-                # 添加表格数据
-                if "table" in res:
-                    assistant_message["table"] = {
-                        "columns": res["table"]["columns"],
-                        "data": res["table"]["data"]
-                    }
-                    st.session_state.conversation_history.append({
-                        "role": "system",
-                        "content": f"生成了包含{len(res['table']['data'])}行数据的表格"
-                    })
-
-                # 添加图表数据
-                chart_types = ['bar', 'line', 'pie', 'scatter', 'heatmap', 'boxplot']
-                for chart_type in chart_types:
-                    if chart_type in res:
-                        assistant_message["chart"] = {
-                            "type": chart_type,
-                            "data": res[chart_type]
-                        }
-                        st.session_state.conversation_history.append({
-                            "role": "system",
-                            "content": f"生成了{chart_type}图表: {res[chart_type].get('title', '')}"
-                        })
-                        break  # 只显示第一个图表
-
-                # 保存助手消息到历史
-                st.session_state.messages.append(assistant_message)
-
-                # 显示助手消息（使用自定义样式）
-                assistant_message_html = f"""
+            )
+            st.session_state.pending_trace = trace
+        except RuntimeError as e:
+            # 任务未被接受，撤回这条问题，避免对话中留下没有回答的消息
+            st.session_state.messages.pop()
+            st.session_state.conversation_history.pop()
+            st.warning(str(e))
+
+# 接收智能体任务的处理过程和结果
+if st.session_state.pending_job is not None:
+    job = st.session_state.pending_job
+    # 流式显示智能体的思考、行动和观察过程
+    thinking_placeholder = st.empty()
+    with st.spinner("正在思考中..."):
+        try:
+            # 定时刷新而不是阻塞等待任务事件：每次刷新页面元素时Streamlit都能响应用户的新操作并中断本次运行，
+            # 任务在任务池中继续执行，过程事件记录在任务上，重新运行后从头显示
+            while True:
+                finished = job.wait(timeout=0.2)
+                steps = []
+                current_step = ""
+                for kind, payload in list(job.events):
+                    if kind == 'token':
+                        current_step += payload
+                    elif kind == 'action':
+                        steps.append(payload.strip())
+                        current_step = ""
+                    elif kind == 'observation':
+                        steps.append(f"Observation: {payload}")
+                thinking_text = html.escape("\n".join(steps + [current_step]))
+                thinking_placeholder.markdown(f"""
                 <div class="message-row assistant-row">
                     <div class="message-bubble assistant-bubble">
                         <div class="message-header">
                             <span class="message-role">
                                 <i class="fas fa-robot"></i> 助手
                             </span>
-                            <span class="message-time">刚刚</span>
-                        </div>
-                        <div class="message-content">
-                """
-
-                # 显示文本回答
-                if "text" in assistant_message:
-                    assistant_message_html += f'<div>{assistant_message["text"]}</div>'
-
-                # 显示表格数据
-                if "table" in assistant_message:
-                    table_df = pd.DataFrame(
-                        data=assistant_message["table"]["data"],
-                        columns=assistant_message["table"]["columns"]
-                    )
-
-                    # 创建表格HTML
-                    table_html = '<div class="chart-container">'
-                    table_html += '<table class="message-table"><thead><tr>'
-                    for col in table_df.columns:
-                        table_html += f'<th>{col}</th>'
-                    table_html += '</tr></thead><tbody>'
-
-                    for _, row in table_df.iterrows():
-                        table_html += '<tr>'
-                        for value in row:
-                            table_html += f'<td>{value}</td>'
-                        table_html += '</tr>'
-
-                    table_html += '</tbody></table></div>'
-                    assistant_message_html += table_html
-
-                # 添加图表占位符
-                if "chart" in assistant_message:
-                    assistant_message_html += f'<div id="chart-{message_index}" class="message-chart"></div>'
-
-                assistant_message_html += """
+                            <span class="message-time">思考中...</span>
                         </div>
+                        <div class="message-content" style="white-space: pre-wrap; font-size: 0.9rem; color: #777;">{thinking_text}</div>
                     </div>
                 </div>
+                """, unsafe_allow_html=True)
+                if finished:
+                    break
+            thinking_placeholder.empty()
+            if job.error is not None:
+                raise job.error
+            st.session_state.pending_job = None
+            trace = st.session_state.pending_trace
+            st.session_state.pending_trace = None
+            res = job.result
+            if res is None:
+                # 任务已被取消
+                st.stop()
+
+            # 构建助手消息
+            assistant_message = {"id": new_message_id(), "role": "assistant"}
+            message_index = len(st.session_state.messages)  # 消息序号
+
+            # 添加文本回答
+            if "answer" in res:
+                assistant_message["text"] = res["answer"]
+                st.session_state.conversation_history.append({
+                    "role": "assistant",
+                    "content": res["answer"]
+                })
+
+            # 添加表格数据
+            if "table" in res:
+                assistant_message["table"] = {
+                    "columns": res["table"]["columns"],
+                    "data": res["table"]["data"]
+                }
+                st.session_state.conversation_history.append({
+                    "role": "system",
+                    "content": f"生成了包含{len(res['table']['data'])}行数据的表格"
+                })
+
+            # 添加图表数据
+            chart_types = ['bar', 'line', 'pie', 'scatter', 'heatmap', 'boxplot']
+            for chart_type in chart_types:
+                if chart_type in res:
+                    assistant_message["chart"] = {
+                        "type": chart_type,
+                        "data": res[chart_type]
+                    }
+                    st.session_state.conversation_history.append({
+                        "role": "system",
+                        "content": f"生成了{chart_type}图表: {res[chart_type].get('title', '')}"
+                    })
+                    break  # 只显示第一个图表
+
+            # 保存助手消息到历史
+            st.session_state.messages.append(assistant_message)
+
+            # 显示助手消息（使用自定义样式），图表渲染后滚动到底部
+            with trace.span('render'):
+                render_message(assistant_message, message_index, scroll=True)
+            trace.finish()
+            get_telemetry().record(trace)
+            st.session_state.last_trace = trace.to_dict()
+
+            # 自动滚动到底部
+            st.markdown(
                 """
+                <script>
+                setTimeout(function() {
+                    const container = document.querySelector('.chat-container');
+                    container.scrollTop = container.scrollHeight;
+                }, 100);
+                </script>
+                """,
+                unsafe_allow_html=True
+            )
 
-                st.markdown(assistant_message_html, unsafe_allow_html=True)
-
-                # 自动滚动到底部
-                st.markdown(
-                    """
-                    <script>
-                    setTimeout(function() {
-                        const container = document.querySelector('.chat-container');
-                        container.scrollTop = container.scrollHeight;
-                    }, 100);
-                    </script>
-                    """,
-                    unsafe_allow_html=True
-                )
+        except Exception as e:
+            st.session_state.pending_job = None
+            st.session_state.pending_trace = None
+            st.error(f"处理查询时出错: {str(e)}")
+            st.session_state.conversation_history.append({
+                "role": "system",
+                "content": f"处理查询时出错: {str(e)}"
+            })
 
-                # 渲染图表到占位符（如果存在）
-                if "chart" in assistant_message:
-                    chart_data = assistant_message["chart"]["data"]
-                    chart_type = assistant_message["chart"]["type"]
-
-                    # 在气泡内部显示图表
-                    with st.container():
-                        # 创建图表容器
-                        chart_container = st.empty()
-
-                        # 在容器中渲染图表
-                        with chart_container:
-                            # 添加小延迟确保DOM已加载
-                            time.sleep(0.1)
-                            generate_chart_with_plotly(
-                                data_source=chart_data,
-                                chart_type=chart_type
-                            )
-
-                        # 使用CSS将图表移动到气泡内部
-                        st.markdown(
-                            f"""
-                            <script>
-                            setTimeout(function() {{
-                                const chartContainer = document.querySelector('#chart-{message_index}');
-                                const chartElement = document.querySelector('[data-testid="stPlotlyChart"]:last-child');
-                                if (chartContainer && chartElement) {{
-                                    // 复制图表元素到气泡中
-                                    const clonedChart = chartElement.cloneNode(true);
-                                    chartContainer.innerHTML = '';
-                                    chartContainer.appendChild(clonedChart);
-
-                                    // 移除原始图表
-                                    chartElement.remove();
-
-                                    // 调整图表大小
-                                    clonedChart.style.width = '100%';
-                                    clonedChart.style.height = 'auto';
-
-                                    // 再次滚动到底部确保可见
-                                    const container = document.querySelector('.chat-container');
-                                    container.scrollTop = container.scrollHeight;
-                                }}
-                            }}, 300);
-                            </script>
-                            """,
-                            unsafe_allow_html=True
-                        )
-
-            except Exception as e:
-                st.error(f"处理查询时出错: {str(e)}")
-                st.session_state.conversation_history.append({
-                    "role": "system",
-                    "content": f"处理查询时出错: {str(e)}"
-                })
\ No newline at end of file
+# 调试面板：最近一轮问答的耗时分解和token用量
+with st.sidebar:
+    if st.toggle("调试面板", key="debug_panel", help="显示最近一轮问答各阶段的耗时和token用量"):
+        last_trace = st.session_state.last_trace
+        if last_trace is None:
+            st.caption("暂无记录")
+        else:
+            st.caption(
+                f"总耗时 {last_trace['duration']:.2f}s，来源 {last_trace['meta'].get('source')}，"
+                f"迭代 {last_trace['meta'].get('iterations', 0)}次"
+            )
+            st.caption(
+                f"token：输入 {last_trace['prompt_tokens']}，输出 {last_trace['completion_tokens']}，"
+                f"估算费用 {last_trace['cost']:.4f}"
+            )
+            st.dataframe(pd.DataFrame(last_trace['spans']), hide_index=True)